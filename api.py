@@ -0,0 +1,176 @@
+"""绩效数据接入服务（HTTP/JSON）
+
+供上游销售系统（ERP）按批推送事务员的月度分销、条盒数据，只依赖标准库和 core.py，
+可在本机直接运行，也可在测试中用 make_server 启动后离线调用：
+
+    python api.py --port 8601 --token 密钥
+
+接口：
+    GET  /health              服务状态和当前季度
+    GET  /metrics             本服务进程的运行指标（Prometheus文本格式）
+    POST /v1/metrics/batch    推送一批数据
+
+推送格式（幂等键也可放在请求头 Idempotency-Key 中）：
+    {
+        "idempotency_key": "erp-20261019-001",
+        "records": [
+            {"事务员": "庞雷", "月份": 10, "分销": 120, "条盒": 80},
+            {"事务员": "庞雷", "核心户数": 25}
+        ]
+    }
+
+整批校验通过后才写入，每个地市分片只重新计算、写入一次；网页会话通过变更通知自动获取新数据。
+一个服务可接收多个数据集的推送：请求头 X-Tenant 指定数据集名称，未指定时为 --tenant 的数据集。
+"""
+import argparse
+import hmac
+import json
+import os
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import core
+
+API_MAX_BODY_BYTES = 32 * 1024 * 1024
+
+
+class IngestHandler(BaseHTTPRequestHandler):
+    """接入接口的请求处理"""
+
+    server_version = 'PerformanceIngest/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False, default=core._json_default).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _authorized(self):
+        token = self.server.token
+        if not token:
+            return True
+        supplied = self.headers.get('Authorization', '')
+        return hmac.compare_digest(supplied, f'Bearer {token}')
+
+    def _read_json(self):
+        """读取请求体，返回 (数据, 错误响应)"""
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > API_MAX_BODY_BYTES:
+            return None, (413, {'error': f'请求体超过{API_MAX_BODY_BYTES // (1024 * 1024)}MB，请分批推送'})
+        try:
+            return json.loads(self.rfile.read(length) or b'null'), None
+        except (ValueError, UnicodeDecodeError):
+            return None, (400, {'error': '请求体不是有效的JSON'})
+
+    def _tenant(self):
+        """请求的数据集名称，数据集不存在时先返回404并返回None"""
+        tenant = self.headers.get('X-Tenant') or self.server.tenant
+        if not core.tenant_exists(tenant):
+            self._send_json(404, {'error': f'数据集不存在：{tenant}'})
+            return None
+        return tenant
+
+    def _send_metrics(self):
+        data = core.get_metrics().render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._send_metrics()
+            return
+        if self.path != '/health':
+            self._send_json(404, {'error': '接口不存在'})
+            return
+        tenant = self._tenant()
+        if tenant is None:
+            return
+        with core.use_tenant(tenant):
+            meta = core.load_meta() or {}
+        self._send_json(200, {'status': 'ok', 'tenant': tenant, 'quarter': meta.get('current_quarter')})
+
+    def do_POST(self):
+        if self.path != '/v1/metrics/batch':
+            self._send_json(404, {'error': '接口不存在'})
+            return
+        if not self._authorized():
+            self._send_json(401, {'error': '未授权'})
+            return
+        tenant = self._tenant()
+        if tenant is None:
+            return
+        body, error = self._read_json()
+        if error:
+            self._send_json(*error)
+            return
+        if not isinstance(body, dict):
+            self._send_json(400, {'error': '请求体必须是JSON对象'})
+            return
+
+        idempotency_key = self.headers.get('Idempotency-Key') or body.get('idempotency_key')
+        if not idempotency_key or not isinstance(idempotency_key, str):
+            self._send_json(400, {'error': '缺少幂等键（idempotency_key 或请求头 Idempotency-Key）'})
+            return
+        start = time.perf_counter()
+        try:
+            with core.use_tenant(tenant):
+                status, result = core.ingest_records(body.get('records'), idempotency_key, self.server.operator)
+        except Exception as e:
+            status, result = 500, {'error': f'写入失败：{str(e)}'}
+        if status == 200 and not result['replayed']:
+            core.record_import('api', result['records'], time.perf_counter() - start)
+        self._send_json(status, result)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def make_server(host='127.0.0.1', port=8601, token=None, operator='接口', verbose=False,
+                tenant=core.DEFAULT_TENANT):
+    """创建接入服务（调用 serve_forever 开始处理请求，port为0时自动选择端口）"""
+    server = ThreadingHTTPServer((host, port), IngestHandler)
+    server.tenant = tenant
+    server.token = token
+    server.operator = operator
+    server.verbose = verbose
+    server.daemon_threads = True
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="绩效数据接入服务")
+    parser.add_argument('-C', '--directory', help="应用所在目录（数据在其下的 data/ 中），默认为当前目录")
+    parser.add_argument('--host', default='127.0.0.1', help="监听地址（默认只允许本机访问）")
+    parser.add_argument('--port', type=int, default=8601, help="监听端口")
+    parser.add_argument('--token', default=os.environ.get('INGEST_API_TOKEN'),
+                        help="访问令牌（请求头 Authorization: Bearer <令牌>），默认读取环境变量 INGEST_API_TOKEN")
+    parser.add_argument('--operator', default='接口', help="审计日志中记录的操作人")
+    parser.add_argument('-t', '--tenant', default=core.DEFAULT_TENANT, help="请求未指定 X-Tenant 时使用的数据集")
+    parser.add_argument('-v', '--verbose', action='store_true', help="输出每个请求的日志")
+    args = parser.parse_args(argv)
+    if args.directory:
+        os.chdir(args.directory)
+
+    for tenant in core.list_tenants():
+        with core.use_tenant(tenant):
+            core.migrate_legacy_data()
+            core.prune_ingest_keys()
+    server = make_server(args.host, args.port, args.token, args.operator, args.verbose, args.tenant)
+    print(f"数据接入服务已启动：http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
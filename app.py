@@ -1,12 +1,47 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
+import plotly.io as pio
 from datetime import datetime
-from io import BytesIO
 import numpy as np
-import json
 import os
 import pickle
+import bisect
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from functools import wraps
+from streamlit.runtime.caching import get_data_cache_stats_provider
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from core import (
+    HISTORY_FILE, SHARD_DIR, META_FILE, SHARD_HISTORY_SUFFIX, DEFAULT_TENANT, list_tenants,
+    tenant_title, activate_tenant, current_tenant, data_dir, data_path, parallel_map,
+    FEED_POLL_SECONDS, AUDIT_RETENTION_MONTHS, BACKUP_INTERVAL_OPTIONS, new_data_version,
+    compose_data_version, list_shard_cities, read_shard, read_shards, delete_shard, load_meta,
+    write_meta, split_by_city, migrate_legacy_data, data_storage_stats, HISTORY_ARCHIVE_DIR,
+    HISTORY_ARCHIVE_SUFFIX, merge_hot_history, _archive_path, list_archived_quarters,
+    load_archived_quarter, archive_cold_quarters, clear_archived_quarters, quarter_columns,
+    archived_city_summary, archived_staff_positions, audit_timestamp, new_change_set_id,
+    get_audit_log, rollup_audit_log, format_audit_records, plan_rollback, list_snapshot_cities,
+    reconstruct_as_of, cas_patch_shard, cas_write_shard, feed_position, read_changes,
+    get_current_quarter, get_quarter_months, archive_quarter_records, reset_quarter_columns,
+    rollover_done, QuarterRolloverJob, check_grade_warning, calculate_distribution_score,
+    calculate_recycling_score, calculate_core_customer_score, calculate_salary_grade,
+    calculate_realtime_score_for_staff, get_grade_improvement_tips, init_data_from_template,
+    calculate_performance, get_current_quarter_data, detect_anomalies, ANOMALY_HISTORY_QUARTERS, export_to_excel,
+    export_quarter_history, list_backups, read_backup_files, BackupScheduler, find_backup_files,
+    backup_storage_stats, describe_backup, get_span_recorder, timed, get_metrics, record_import,
+    record_export, MetricsFileWriter, METRICS_FILE, deep_sizeof, process_rss_bytes,
+    get_tenant_registry, use_tenant, import_staff_rows,
+)
+
+try:
+    from pypinyin import lazy_pinyin, Style
+except ImportError:  # 未安装pypinyin时退回GB2312区位码推算拼音首字母
+    lazy_pinyin = None
 
 # ========== 页面配置 ==========
 st.set_page_config(
@@ -116,38 +151,142 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# ========== 数据持久化存储 ==========
-DATA_FILE = "performance_data.pkl"
-HISTORY_FILE = "quarter_history.pkl"
+# ========== 会话数据读写 ==========
+# 存储、评分、季度切换、归档和备份等不依赖会话的功能在 core.py 中（命令行批处理共用），
+# 这里只负责把会话状态与磁盘上的分片同步。
+@timed('save_data')
+def save_data(cities=None, force=False, operation=None, df=None):
+    """保存数据到文件
 
-def save_data():
-    """保存数据到文件"""
+    数据按地市分片保存：cities指定时只写入这些地市的分片，为None时写入会话中已加载的
+    全部地市，季度历史有修改时同时写入；加载了全部地市的会话还会更新全局信息（季度、名册）。
+    默认按行版本比较：加载后已被其他用户修改过的行按字段合并，与对方改动了同一字段的修改不写入，
+    记入st.session_state.write_conflicts并整页刷新显示合并视图；
+    force=True（重置、导入、恢复备份）时以本会话数据为准整体写入。
+    operation为整体操作的名称（如重新计算、导入），每个有变化的行会记入审计日志。
+    df为要保存的新版本数据（默认为会话当前数据），写入成功后才发布为会话数据。
+    """
     try:
-        data_to_save = {
-            'performance_data': st.session_state.performance_data,
-            'quarter_history': st.session_state.quarter_history,
-            'current_quarter': st.session_state.current_quarter,
-            'last_reset': st.session_state.last_reset,
-            'data_history': st.session_state.data_history
-        }
-        with open(DATA_FILE, 'wb') as f:
-            pickle.dump(data_to_save, f)
+        base_df = st.session_state.performance_data
+        df = base_df if df is None else df
+        os.makedirs(data_path(SHARD_DIR), exist_ok=True)
+        full_save = cities is None
+        parts = split_by_city(
+            df,
+            st.session_state.quarter_history if full_save and st.session_state.quarter_history_dirty else None,
+            cities
+        )
+        base_versions = dict(st.session_state.row_versions)
+        quarter = st.session_state.current_quarter
+        operator = current_operator()
+        change_set = new_change_set_id()
+        
+        # 各地市分片相互独立，并行写入
+        def write_part(item):
+            city, (city_df, city_quarters) = item
+            return city, cas_write_shard(
+                city, city_df, base_versions, city_quarters, force, quarter,
+                operation, operator, change_set, base_df
+            )
+        
+        results = parallel_map(write_part, parts.items())
+        
+        conflicts = []
+        for city, (shard, city_conflicts) in results:
+            df = merge_shard_rows(df, city, shard)
+            conflicts.extend(city_conflicts)
+        if full_save:
+            st.session_state.quarter_history_dirty = False
+        
+        if full_save and force and st.session_state.loaded_cities is None:
+            # 整体覆盖：删除已不存在的地市分片
+            for city in set(list_shard_cities()) - set(parts):
+                delete_shard(city)
+                st.session_state.shard_versions.pop(city, None)
+        if full_save and st.session_state.loaded_cities is None:
+            # 全量会话：更新名册和季度信息
+            st.session_state.roster = df[['行号', '地市', '事务员']]
+            st.session_state.roster_version = new_data_version()
+            write_meta({
+                'current_quarter': st.session_state.current_quarter,
+                'last_reset': st.session_state.last_reset,
+                'roster': st.session_state.roster,
+                'version': st.session_state.roster_version
+            })
+        
+        publish_session_data(df, set(parts))
+        
+        if conflicts:
+            updates = {}
+            for row in conflicts:
+                updates.setdefault(row['事务员'], {})[row['字段']] = row['我的修改']
+            st.session_state.write_conflicts = {
+                'rows': conflicts,
+                'updates': updates,
+                'operation': operation or '保存数据'
+            }
+            # 整页刷新以显示页面顶部的合并视图
+            st.rerun()
         return True
     except Exception as e:
         st.error(f"保存数据时出错：{str(e)}")
         return False
 
-def load_data():
-    """从文件加载数据"""
+def publish_session_data(df, cities, invalidate_figures=True):
+    """发布会话数据的新版本，同时更新数据版本、异常标记和图表缓存
+
+    数据和版本号总是一起替换，已发布的DataFrame不再修改：写入方在新版本上修改
+    （写时复制，未改动的列与旧版本共享内存），渲染和分析看到的总是某个完整的版本。
+    """
+    st.session_state.performance_data = df
+    st.session_state.data_version = compose_data_version(st.session_state.shard_versions)
+    # 每次保存后重新扫描异常填报
+    refresh_anomaly_flags()
+    # 数据已变化，丢弃受影响范围的图表缓存（同步他人修改时写入方已经清理过）
+    if invalidate_figures:
+        get_figure_cache().invalidate(set(cities) | {'全部'})
+
+@timed('load_data')
+def load_session_data(cities=None):
+    """加载会话数据
+
+    cities为None时并行读取全部地市分片（管理员），否则只读取指定地市（事务员、地市经理），
+    加载时间只与所读地市的数据量有关。
+    """
     try:
-        if os.path.exists(DATA_FILE):
-            with open(DATA_FILE, 'rb') as f:
-                data = pickle.load(f)
-                return data
-        return None
+        # 先记下变更日志位置，读取期间发生的修改会在下次同步时补上
+        st.session_state.feed_position = feed_position()
+        targets = list_shard_cities() if cities is None else list(cities)
+        shards = read_shards(targets)
+        
+        frames = [shard['performance_data'] for shard in shards.values()]
+        
+        st.session_state.performance_data = pd.concat(frames).sort_index() if frames else None
+        set_session_history(merge_hot_history(shard.get('quarter_history', {}) for shard in shards.values()), dirty=False)
+        st.session_state.loaded_cities = None if cities is None else list(cities)
+        st.session_state.shard_versions = {city: shard['version'] for city, shard in shards.items()}
+        st.session_state.row_versions = {}
+        for shard in shards.values():
+            st.session_state.row_versions.update(shard.get('row_versions', {}))
+        st.session_state.data_version = compose_data_version(st.session_state.shard_versions)
+        return True
     except Exception as e:
         st.error(f"加载数据时出错：{str(e)}")
-        return None
+        return False
+
+def ensure_session_data():
+    """按登录身份加载所需的地市分片（已加载相同范围时不重复读取）"""
+    release_evicted_data()
+    if st.session_state.user_role == "admin":
+        wanted = None
+    else:
+        wanted = [st.session_state.current_city]
+    if (sync_session_quarter() or st.session_state.performance_data is None
+            or st.session_state.loaded_cities != wanted):
+        load_session_data(wanted)
+    else:
+        # 已加载时只拉取其他用户修改过的行
+        sync_session_changes()
 
 def save_history():
     """保存季度历史数据"""
@@ -170,7 +309,113 @@ def load_history():
         st.error(f"加载历史数据时出错：{str(e)}")
         return {}
 
+# ========== 会话季度历史 ==========
+def set_session_history(quarter_history, dirty=True):
+    """替换会话中的热数据；dirty表示需要在下次整体保存时写入分片"""
+    st.session_state.quarter_history = quarter_history
+    st.session_state.quarter_history_dirty = dirty
+    st.session_state.history_version = new_data_version()
+
+def history_quarters():
+    """会话可查看的全部历史季度（今年的热数据加往年的归档）"""
+    return sorted(set(st.session_state.quarter_history) | set(list_archived_quarters()))
+
+def history_cache_key():
+    """季度历史的缓存版本：热数据版本加各归档文件的修改时间"""
+    return (st.session_state.history_version, tuple(
+        (quarter, os.path.getmtime(_archive_path(quarter))) for quarter in list_archived_quarters()
+    ))
+
+def get_history_quarter(quarter):
+    """读取一个历史季度（只含会话已加载的地市），不存在时返回空表"""
+    if quarter in st.session_state.quarter_history:
+        return st.session_state.quarter_history[quarter]
+    if not os.path.exists(_archive_path(quarter)):
+        return pd.DataFrame()
+    frame = load_archived_quarter(quarter, os.path.getmtime(_archive_path(quarter)))
+    loaded = st.session_state.loaded_cities
+    return frame if loaded is None else frame[frame['地市'].isin(loaded)]
+
+# ========== 审计与时点还原 ==========
+def current_operator():
+    """当前操作人"""
+    return st.session_state.get('user_name') or '系统'
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def cached_as_of_view(tenant, as_of, cities):
+    """按数据集和时间点缓存的还原结果（只用于过去的时间点，结果不会再变化）"""
+    return reconstruct_as_of(as_of, cities)
+
+# ========== 会话数据集 ==========
+# 同一进程托管多个数据集，每个会话通过 st.session_state.tenant 选择其一；
+# core中的存储函数按上下文中的当前数据集读写，所以每次运行（包括片段单独重跑）都先切换。
+def activate_session_tenant():
+    """切换到会话选择的数据集，数据集已被删除时回到默认数据集"""
+    try:
+        return activate_tenant(st.session_state.tenant)
+    except KeyError:
+        st.session_state.tenant = DEFAULT_TENANT
+        return activate_tenant(DEFAULT_TENANT)
+
+def switch_session_tenant(tenant):
+    """会话改用另一个数据集，清空已加载的数据"""
+    st.session_state.tenant = tenant
+    activate_session_tenant()
+    init_session_data()
+
+def fragment_rerun():
+    """当前是否为片段单独重跑"""
+    ctx = get_script_run_ctx()
+    return ctx is not None and bool(ctx.fragment_ids_this_run)
+
+def session_fragment(func=None, *, run_every=None):
+    """st.fragment的包装：片段单独重跑时也先切换到会话的数据集，并记录片段的渲染耗时"""
+    def decorate(func):
+        @wraps(func)
+        def run(*args, **kwargs):
+            activate_session_tenant()
+            # 定时自动运行的片段不计为用户操作，也不读取会话数据
+            touch_session(active=run_every is None)
+            # 片段单独重跑时不经过main，先拉取其他用户的修改；片段内一律从会话读取数据
+            if run_every is None and fragment_rerun() and st.session_state.get('authenticated'):
+                ensure_session_data()
+            with timed(f'片段:{func.__name__}'):
+                return func(*args, **kwargs)
+        return st.fragment(run, run_every=run_every)
+    return decorate if func is None else decorate(func)
+
 # ========== Session State 初始化 ==========
+def init_session_data():
+    """从文件加载全局信息，具体数据在登录后按身份加载对应地市的分片"""
+    migrate_legacy_data()
+    meta = load_meta()
+    st.session_state.performance_data = None
+    st.session_state.quarter_history = {}
+    st.session_state.quarter_history_dirty = False
+    st.session_state.history_version = new_data_version()
+    st.session_state.loaded_cities = []
+    st.session_state.shard_versions = {}
+    st.session_state.row_versions = {}
+    st.session_state.write_conflicts = None
+    st.session_state.feed_position = None
+    st.session_state.data_version = compose_data_version({})
+    st.session_state.applied_rollover = None
+    if meta:
+        st.session_state.current_quarter = meta.get('current_quarter')
+        st.session_state.last_reset = meta.get('last_reset')
+        st.session_state.roster = meta.get('roster')
+        st.session_state.roster_version = meta.get('version')
+    else:
+        st.session_state.current_quarter = None
+        st.session_state.last_reset = None
+        st.session_state.roster = None
+        st.session_state.roster_version = None
+
+if 'tenant' not in st.session_state:
+    # 可通过链接参数 ?tenant=<名称> 直接进入指定数据集
+    st.session_state.tenant = st.query_params.get('tenant', DEFAULT_TENANT)
+activate_session_tenant()
+
 if 'authenticated' not in st.session_state:
     st.session_state.authenticated = False
 if 'user_role' not in st.session_state:
@@ -180,93 +425,376 @@ if 'user_name' not in st.session_state:
 if 'current_city' not in st.session_state:
     st.session_state.current_city = None
 
-# 从文件加载数据
 if 'performance_data' not in st.session_state:
-    loaded_data = load_data()
-    if loaded_data:
-        st.session_state.performance_data = loaded_data.get('performance_data')
-        st.session_state.quarter_history = loaded_data.get('quarter_history', {})
-        st.session_state.current_quarter = loaded_data.get('current_quarter')
-        st.session_state.last_reset = loaded_data.get('last_reset')
-        st.session_state.data_history = loaded_data.get('data_history', {})
-    else:
-        st.session_state.performance_data = None
-        st.session_state.quarter_history = {}
-        st.session_state.current_quarter = None
-        st.session_state.last_reset = None
-        st.session_state.data_history = {}
+    init_session_data()
 
 if 'data_sync_flag' not in st.session_state:
     st.session_state.data_sync_flag = False
 
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
+# ========== 运行指标与会话表 ==========
+# 保存、导入导出等指标在 core.py 中记录，这里登记在线会话并启动指标文件写入线程。
+# 会话表同时用于管理员控制台的内存统计：每个会话的状态里放一个 SessionHandle，
+# 会话表只持有它的弱引用，会话关闭后随会话状态一起释放。
+SESSION_ACTIVE_SECONDS = 300      # 最近这段时间内有操作的会话计为在线
+SESSION_EXPIRE_SECONDS = 24 * 3600
+SESSION_IDLE_OPTIONS = {'闲置10分钟以上': 600, '闲置30分钟以上': 1800, '闲置1小时以上': 3600, '闲置4小时以上': 4 * 3600}
+
+class SessionHandle:
+    """会话状态的引用（存放在会话自己的状态中）
+
+    其他会话只读取state；需要释放数据时只设置evict标记，由会话在自己的脚本中释放。
+    """
+
+    def __init__(self):
+        self.state = None
+        self.evict = False
+
+class SessionRegistry:
+    """进程内的网页会话表：会话ID -> 最近活动时间、数据集、身份、用户和会话状态的弱引用"""
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def touch(self, session_id, tenant, role, user=None, handle=None, active=True):
+        with self._lock:
+            previous = self._sessions.get(session_id)
+            self._sessions[session_id] = {
+                'last_seen': time.monotonic() if active or previous is None else previous['last_seen'],
+                'tenant': tenant,
+                'role': role,
+                'user': user,
+                'handle': weakref.ref(handle) if handle is not None else None
+            }
+
+    def sessions(self):
+        """仍然存在的会话，附带闲置秒数和会话状态（读不到时为None），同时清理已关闭的会话"""
+        now = time.monotonic()
+        result = []
+        with self._lock:
+            for session_id, entry in list(self._sessions.items()):
+                handle = entry['handle']() if entry['handle'] is not None else None
+                if now - entry['last_seen'] > SESSION_EXPIRE_SECONDS or (entry['handle'] is not None and handle is None):
+                    del self._sessions[session_id]
+                    continue
+                result.append({
+                    **entry,
+                    'id': session_id,
+                    'idle': now - entry['last_seen'],
+                    'handle': handle,
+                    'state': handle.state if handle is not None else None
+                })
+        return result
+
+    def active_counts(self, within=SESSION_ACTIVE_SECONDS):
+        """按(数据集, 身份)统计最近活动的会话数"""
+        counts = {}
+        for session in self.sessions():
+            if session['idle'] <= within:
+                key = (session['tenant'], session['role'])
+                counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def metrics(self):
+        return [
+            ('performance_active_sessions', (('tenant', tenant), ('role', role)), count)
+            for (tenant, role), count in self.active_counts().items()
+        ]
+
+@st.cache_resource
+def get_session_registry():
+    """进程内共享的会话表（同时登记为在线会话数指标的采集函数）"""
+    registry = SessionRegistry()
+    get_metrics().add_collector('sessions', registry.metrics)
+    return registry
+
+@st.cache_resource
+def get_metrics_writer():
+    """进程内唯一的指标文件写入线程，环境变量 METRICS_FILE 可改写路径，设为空时不写文件"""
+    path = os.environ.get('METRICS_FILE', METRICS_FILE)
+    return MetricsFileWriter(path) if path else None
+
+def touch_session(active=True):
+    """记录本会话的最近活动时间；active为False时（定时自动运行的片段）只更新会话状态的引用"""
+    if 'session_handle' not in st.session_state:
+        st.session_state.session_handle = SessionHandle()
+    ctx = get_script_run_ctx()
+    # 每次运行的会话状态包装对象不同，指向最近一次运行的即可
+    st.session_state.session_handle.state = ctx.session_state if ctx is not None else None
+    get_session_registry().touch(
+        st.session_state.session_id, st.session_state.tenant, st.session_state.user_role or 'anonymous',
+        st.session_state.user_name, st.session_state.session_handle, active
+    )
+
+def session_memory_report():
+    """各会话的内存占用（每个会话单独统计，同一版本数据在会话之间共享的部分会重复计算）"""
+    rows = []
+    for session in get_session_registry().sessions():
+        state = session['state']
+        if state is None:
+            continue
+        values = state.filtered_state
+        values.pop('session_handle', None)
+        seen = set()
+        sizes = {key: deep_sizeof(values.pop(key, None), seen) for key in ('performance_data', 'quarter_history')}
+        loaded = values.get('loaded_cities')
+        rows.append({
+            '会话': session['id'][:8],
+            '数据集': session['tenant'],
+            '身份': session['role'],
+            '用户': session['user'] or '',
+            '闲置(分钟)': round(session['idle'] / 60, 1),
+            '数据版本': str(values.get('data_version', ''))[:12],
+            '已加载地市': '全部' if loaded is None else f"{len(loaded)}个",
+            '绩效数据(KB)': sizes['performance_data'] / 1024,
+            '季度历史(KB)': sizes['quarter_history'] / 1024,
+            '其他状态(KB)': deep_sizeof(values, seen) / 1024,
+        })
+    frame = pd.DataFrame(rows)
+    if not frame.empty:
+        frame['合计(KB)'] = frame[['绩效数据(KB)', '季度历史(KB)', '其他状态(KB)']].sum(axis=1)
+        frame = frame.sort_values('合计(KB)', ascending=False, ignore_index=True).round(1)
+    return frame
+
+def shared_cache_report():
+    """进程内共享缓存的内存占用：导出等按版本缓存的内容、图表缓存和各数据集的缓存"""
+    rows = []
+    for stat in get_data_cache_stats_provider().get_stats().get('cache_memory_bytes', []):
+        rows.append({'缓存': stat.cache_name.rsplit('.', 1)[-1], '大小(KB)': stat.byte_length / 1024, '说明': '按版本缓存（st.cache_data）'})
+    figure_cache = get_figure_cache()
+    rows.append({'缓存': '图表缓存', '大小(KB)': figure_cache.memory_bytes() / 1024, '说明': f"{len(figure_cache)}个图表"})
+    for name in get_tenant_registry().loaded():
+        with use_tenant(name) as tenant:
+            for label, (size, detail) in tenant.memory_usage().items():
+                rows.append({
+                    '缓存': f"{tenant.title}/{label}",
+                    '大小(KB)': None if size is None else size / 1024,
+                    '说明': detail
+                })
+    return pd.DataFrame(rows).round(1)
+
+def evict_idle_sessions(idle_seconds, keep_session_id):
+    """标记闲置会话释放已加载的数据，返回标记的会话数
+
+    其他会话可能正在运行自己的脚本，这里不修改它们的状态，只在会话表中设置标记，
+    由会话在下次同步检查或操作时自己释放（见release_evicted_data）。
+    """
+    marked = 0
+    for session in get_session_registry().sessions():
+        handle = session['handle']
+        if (handle is None or session['id'] == keep_session_id or session['idle'] < idle_seconds
+                or session['role'] == 'anonymous'):
+            continue
+        handle.evict = True
+        marked += 1
+    return marked
+
+def release_evicted_data():
+    """在本会话的脚本中释放被管理员标记的数据（需要时从磁盘重新加载），返回是否释放
+
+    季度历史有未保存修改时不释放。
+    """
+    handle = st.session_state.get('session_handle')
+    if handle is None or not handle.evict:
+        return False
+    handle.evict = False
+    if st.session_state.get('performance_data') is None or st.session_state.quarter_history_dirty:
+        return False
+    st.session_state.performance_data = None
+    set_session_history({}, dirty=False)
+    st.session_state.loaded_cities = []
+    st.session_state.shard_versions = {}
+    st.session_state.row_versions = {}
+    # 释放后不再跟踪变更日志，重新加载时重新记录位置
+    st.session_state.feed_position = None
+    st.session_state.data_version = compose_data_version({})
+    return True
+
+# ========== 并发写入与变更同步 ==========
+def merge_shard_rows(df, city, shard):
+    """用磁盘上的最新分片替换该地市的数据，返回下一个版本的会话数据（不修改df）"""
+    frames = []
+    if df is not None:
+        frames.append(df[df['地市'] != city])
+    if shard['performance_data'] is not None:
+        frames.append(shard['performance_data'])
+    st.session_state.row_versions.update(shard['row_versions'])
+    st.session_state.shard_versions[city] = shard['version']
+    return pd.concat(frames).sort_index() if frames else None
+
+def render_write_conflicts():
+    """显示保存冲突的合并视图，由用户选择保留哪一方的修改"""
+    conflicts = st.session_state.get('write_conflicts')
+    if not conflicts:
+        return
+    
+    st.warning(f"⚠️ 以下{len(conflicts['updates'])}位事务员的数据在您编辑期间已被其他用户修改，您的修改尚未保存")
+    st.dataframe(pd.DataFrame(conflicts['rows']), use_container_width=True, hide_index=True)
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("保留我的修改", type="primary", use_container_width=True, key="conflict_keep_mine_btn"):
+            # 会话已是最新数据，按最新行版本重新提交
+            st.session_state.write_conflicts = None
+            batch_update_staff_data(conflicts['updates'], operation=f"{conflicts['operation']}（冲突覆盖）")
+            st.rerun()
+    with col2:
+        if st.button("采用已保存的数据", use_container_width=True, key="conflict_keep_theirs_btn"):
+            st.session_state.write_conflicts = None
+            st.rerun()
+
+def feed_has_changes():
+    """只比较一次文件状态，判断是否有新的变更"""
+    position = st.session_state.get('feed_position')
+    return position is not None and feed_position() != position
+
+def merge_changed_rows(df, entry):
+    """把一条变更中的行替换进会话数据，返回下一个版本的会话数据（不修改df）"""
+    rows = entry['rows']
+    st.session_state.row_versions.update(entry['row_versions'])
+    st.session_state.shard_versions[entry['city']] = entry['version']
+    return pd.concat([
+        df[~df['事务员'].isin(rows['事务员'])],
+        rows
+    ]).sort_index()
+
+def sync_session_changes():
+    """拉取其他用户的修改，只替换会话中发生变化的行，返回有变化的地市数"""
+    if st.session_state.performance_data is None or not feed_has_changes():
+        return 0
+    
+    entries, position = read_changes(st.session_state.feed_position)
+    if entries is None:
+        load_session_data(st.session_state.loaded_cities)
+        return len(st.session_state.shard_versions)
+    
+    loaded = st.session_state.loaded_cities
+    changed_cities = set()
+    df = st.session_state.performance_data
+    for entry in entries:
+        city = entry['city']
+        if loaded is not None and city not in loaded:
+            continue
+        if entry['version'] is not None and entry['version'] == st.session_state.shard_versions.get(city):
+            # 本会话自己的写入，已经是最新数据
+            continue
+        if entry['rows'] is None:
+            shard = read_shard(city)
+            if shard is None:
+                df = df[df['地市'] != city]
+                st.session_state.shard_versions.pop(city, None)
+            else:
+                df = merge_shard_rows(df, city, shard)
+        else:
+            df = merge_changed_rows(df, entry)
+        changed_cities.add(city)
+    
+    st.session_state.feed_position = position
+    if changed_cities:
+        publish_session_data(df, changed_cities, invalidate_figures=False)
+    return len(changed_cities)
+
+@session_fragment(run_every=FEED_POLL_SECONDS)
+def render_live_sync():
+    """定时检查变更日志，其他用户保存后自动刷新页面；被标记释放的会话在这里释放数据"""
+    if release_evicted_data():
+        return
+    if feed_has_changes():
+        st.rerun()
+    st.caption(f"🔄 实时同步中（每{FEED_POLL_SECONDS}秒检查一次） | 最近检查：{datetime.now().strftime('%H:%M:%S')}")
+
 # ========== 核心数据操作函数 ==========
 def get_staff_data(staff_name):
     """获取事务员的完整数据"""
     if st.session_state.performance_data is None:
         return None
     
-    staff_data = st.session_state.performance_data[
-        st.session_state.performance_data['事务员'] == staff_name
-    ]
-    
-    if staff_data.empty:
-        return None
-    
-    return staff_data.iloc[0].to_dict()
+    return cached_staff_record(
+        st.session_state.data_version,
+        staff_name,
+        st.session_state.performance_data
+    )
+
+def get_city_rows(city):
+    """获取地市的全部事务员数据"""
+    return cached_city_rows(
+        st.session_state.data_version,
+        city,
+        st.session_state.performance_data
+    )
 
 def update_staff_data(staff_name, updates):
     """更新事务员数据并保存到文件"""
-    if st.session_state.performance_data is None:
-        return False
+    return batch_update_staff_data({staff_name: updates}) > 0
+
+def batch_update_staff_data(updates_by_staff, operation='更新数据'):
+    """按事务员姓名批量更新数据
+
+    updates_by_staff为 {事务员: {字段: 新值}}。按地市分组后在各地市分片锁内做行版本比较再写入，
+    每个地市只重新计算涉及的行、只写入一次文件；与他人修改冲突的事务员不写入，
+    记入st.session_state.write_conflicts并整页刷新显示合并视图。返回成功更新的事务员人数。
+    """
+    df = st.session_state.performance_data
+    if df is None or not updates_by_staff:
+        return 0
     
     try:
-        # 找到事务员的索引
-        staff_idx = st.session_state.performance_data[
-            st.session_state.performance_data['事务员'] == staff_name
-        ].index
-        
-        if len(staff_idx) == 0:
-            return False
-        
-        staff_idx = staff_idx[0]
-        
-        # 记录原始数据
-        original_data = {}
-        for key in updates.keys():
-            if key in st.session_state.performance_data.columns:
-                original_data[key] = st.session_state.performance_data.at[staff_idx, key]
-        
-        # 更新数据
-        for key, value in updates.items():
-            if key in st.session_state.performance_data.columns:
-                st.session_state.performance_data.at[staff_idx, key] = value
-        
-        # 记录数据变更
-        if staff_name not in st.session_state.data_history:
-            st.session_state.data_history[staff_name] = []
-        
-        st.session_state.data_history[staff_name].append({
-            '时间': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            '操作': '更新数据',
-            '更新内容': updates,
-            '原始数据': original_data
-        })
-        
-        # 重新计算绩效
-        st.session_state.performance_data = calculate_performance(
-            st.session_state.performance_data, 
-            st.session_state.current_quarter
-        )
-        
-        # 保存到文件
-        save_data()
+        index = session_data_index()
+        change_set = new_change_set_id()
+        patches_by_city = {}
+        
+        for staff_name, updates in updates_by_staff.items():
+            # 通过索引定位事务员所在行
+            positions = lookup_name_exact(index, staff_name)
+            if len(positions) == 0:
+                continue
+            staff_idx = df.index[positions[0]]
+            updates = {key: value for key, value in updates.items() if key in df.columns}
+            
+            # 记录读取时的行版本和原值，写入时据此判断是否与他人修改冲突
+            patches_by_city.setdefault(df.at[staff_idx, '地市'], {})[staff_name] = {
+                'updates': updates,
+                'base_version': st.session_state.row_versions.get(staff_name, 0),
+                'base_values': {key: df.at[staff_idx, key] for key in updates}
+            }
+        
+        if not patches_by_city:
+            return 0
+        
+        success_count = 0
+        conflicts = []
+        for city, patches in patches_by_city.items():
+            shard, applied, city_conflicts = cas_patch_shard(
+                city, patches, operation, current_operator(), change_set,
+                st.session_state.current_quarter
+            )
+            # 写入后会话同步为该地市的最新数据（含他人的修改），全部地市写完后一次发布
+            df = merge_shard_rows(df, city, shard)
+            success_count += applied
+            conflicts.extend(city_conflicts)
+        
+        publish_session_data(df, patches_by_city)
+        
+        if conflicts:
+            conflict_names = {row['事务员'] for row in conflicts}
+            st.session_state.write_conflicts = {
+                'rows': conflicts,
+                'updates': {name: updates_by_staff[name] for name in conflict_names},
+                'operation': operation
+            }
+            # 整页刷新以显示页面顶部的合并视图
+            st.rerun()
         
-        return True
+        return success_count
         
     except Exception as e:
         st.error(f"更新数据时出错：{str(e)}")
-        return False
+        return 0
 
+# ========== 季度管理函数 ==========
 def get_current_quarter_month_columns():
     """获取当前季度的月份列名"""
     month_range = get_current_quarter_month_range()
@@ -275,35 +803,6 @@ def get_current_quarter_month_columns():
         columns.extend([f'分销_{month_num}月', f'条盒_{month_num}月'])
     return columns
 
-# ========== 季度管理函数 ==========
-def get_current_quarter():
-    """获取当前季度"""
-    today = datetime.now()
-    month = today.month
-    year = today.year
-    
-    if month in [1, 2, 3]:
-        return f"{year}年Q1季度"
-    elif month in [4, 5, 6]:
-        return f"{year}年Q2季度"
-    elif month in [7, 8, 9]:
-        return f"{year}年Q3季度"
-    else:
-        return f"{year}年Q4季度"
-
-def get_quarter_months(quarter):
-    """获取季度对应的月份"""
-    quarter_map = {
-        "Q1季度": ["1月", "2月", "3月"],
-        "Q2季度": ["4月", "5月", "6月"],
-        "Q3季度": ["7月", "8月", "9月"],
-        "Q4季度": ["10月", "11月", "12月"]
-    }
-    for key, months in quarter_map.items():
-        if key in quarter:
-            return months
-    return []
-
 def get_current_quarter_month_range():
     """获取当前季度对应的月份范围"""
     quarter = st.session_state.current_quarter
@@ -318,532 +817,617 @@ def get_current_quarter_month_range():
     else:
         return [1, 2, 3]
 
-def check_reset_needed():
-    """检查是否需要季度重置"""
-    current_quarter = get_current_quarter()
-    
-    # 如果是新季度，且还未重置
-    if (st.session_state.current_quarter != current_quarter or 
-        (st.session_state.last_reset and st.session_state.last_reset != current_quarter)):
-        return True
-    return False
-
 def reset_quarter_data(df, target_grade=6):
     """重置季度数据并设置目标档位"""
     # 保存当前季度数据到历史记录
     current_q = st.session_state.current_quarter
     if current_q and not df.empty:
-        # 保存完整的季度数据到历史
-        history_df = df.copy()
-        
-        # 只保留关键字段
-        key_columns = ['行号', '地市', '事务员', '分销均季度', '条盒均季度', 
-                      '分销得分', '条盒回收得分', '核心户得分', '综合得分', 
-                      '总分', '档位', '预估月薪', '季度目标档位']
-        
-        history_df = history_df[key_columns].copy()
-        history_df['季度'] = current_q
-        st.session_state.quarter_history[current_q] = history_df.to_dict('records')
+        set_session_history({**st.session_state.quarter_history, current_q: archive_quarter_records(df, current_q)})
     
-    # 重置数据
-    reset_df = df.copy()
-    
-    # 获取当前季度月份范围
-    month_range = get_current_quarter_month_range()
-    
-    # 只清空当前季度的月度数据
-    for month_num in month_range:
-        dist_col = f'分销_{month_num}月'
-        recycle_col = f'条盒_{month_num}月'
-        
-        if dist_col in reset_df.columns:
-            reset_df[dist_col] = 0
-        if recycle_col in reset_df.columns:
-            reset_df[recycle_col] = 0
-    
-    # 重置其他可编辑字段
-    reset_columns = ['核心户数', '综合评分']
-    for col in reset_columns:
-        if col in reset_df.columns:
-            reset_df[col] = 0
-    
-    # 设置季度目标
-    reset_df['季度目标档位'] = target_grade
-    
-    # 清空计算结果（重新计算时会生成）
-    calc_columns = ['分销均季度', '条盒均季度', '分销得分', '条盒回收得分', 
-                   '核心户得分', '综合得分', '总分', '档位', '预估月薪']
-    for col in calc_columns:
-        if col in reset_df.columns:
-            reset_df[col] = 0
+    # 在浅拷贝上按列替换得到新版本，只有被清零的列占用新内存，当前版本保持不变
+    reset_df = reset_quarter_columns(df.copy(deep=False), current_q, target_grade)
     
     # 更新重置记录
     st.session_state.last_reset = st.session_state.current_quarter
     
-    # 清空数据历史（新季度开始）
-    st.session_state.data_history = {}
-    
-    # 保存数据
-    save_data()
+    # 保存数据（保存的是重置后的数据，整体覆盖）；审计日志保留，按保留期限归档
+    backup_data('季度重置前备份')
+    save_data(force=True, operation='季度重置', df=reset_df)
     
-    return reset_df
+    return st.session_state.performance_data
 
-def check_grade_warning(current_grade, target_grade):
-    """检查档位是否需要提醒"""
-    if current_grade > target_grade:
-        return "danger", f"⚠️ 警告：当前档位为{current_grade}档，低于目标{target_grade}档！"
-    elif current_grade == target_grade:
-        return "warning", f"📊 注意：当前档位为{current_grade}档，刚好达到目标。"
-    else:
-        return "success", f"✅ 优秀：当前档位为{current_grade}档，超过目标{target_grade}档！"
-
-# ========== 评分计算函数 ==========
-def calculate_distribution_score(average):
-    """计算分销得分"""
-    if average >= 1000:
-        return 25
-    elif average >= 601:
-        return 20
-    elif average >= 301:
-        return 15
-    elif average >= 151:
-        return 10
-    elif average >= 61:
-        return 5
-    else:
-        return 0
+def get_quarter_rollover_job():
+    """当前数据集的季度切换线程（切换前的备份交给后台备份线程），数据集被淘汰后继续运行"""
+    return get_tenant_registry().background(
+        current_tenant().name, 'quarter_rollover_job',
+        lambda: QuarterRolloverJob(backup=lambda label: get_backup_scheduler().request(label))
+    )
 
-def calculate_recycling_score(average):
-    """计算条盒回收得分"""
-    if average >= 1000:
-        return 35
-    elif average >= 801:
-        return 30
-    elif average >= 601:
-        return 25
-    elif average >= 401:
-        return 20
-    elif average >= 301:
-        return 15
-    elif average >= 201:
-        return 10
-    elif average >= 181:
-        return 5
-    else:
-        return 0
+def sync_session_quarter():
+    """季度切换完成后，会话改用新季度并重新加载数据，返回是否发生了切换
 
-def calculate_core_customer_score(customer_count):
-    """计算核心户得分"""
-    if customer_count >= 31:
-        return 20
-    elif customer_count >= 26:
-        return 15
-    elif customer_count >= 21:
-        return 10
-    elif customer_count >= 16:
-        return 5
-    else:
-        return 0
+    每次季度切换只应用一次（记录在applied_rollover中），之后管理员手动切换的季度不会被改回。
+    """
+    current_quarter = get_current_quarter()
+    if st.session_state.get('applied_rollover') == current_quarter or not rollover_done(current_quarter):
+        return False
+    st.session_state.applied_rollover = current_quarter
+    meta = load_meta() or {}
+    quarter = meta.get('current_quarter', current_quarter)
+    if st.session_state.current_quarter == quarter:
+        return False
+    st.session_state.current_quarter = quarter
+    st.session_state.last_reset = meta.get('last_reset')
+    return True
 
-def calculate_salary_grade(total_score):
-    """计算档位和工资"""
-    if total_score >= 91:
-        return 1, 6000
-    elif total_score >= 81:
-        return 2, 5500
-    elif total_score >= 71:
-        return 3, 5000
-    elif total_score >= 61:
-        return 4, 4700
-    elif total_score >= 51:
-        return 5, 4400
-    elif total_score >= 46:
-        return 6, 4100
-    elif total_score >= 41:
-        return 7, 3900
-    elif total_score >= 36:
-        return 8, 3700
-    elif total_score >= 31:
-        return 9, 3500
-    else:
-        return 10, 3300
+# ========== 异常填报检测 ==========
+def refresh_anomaly_flags():
+    """对全部数据重新执行一次异常扫描（保存或导入之后调用）"""
+    if st.session_state.get('performance_data') is None or not st.session_state.get('current_quarter'):
+        return None
+    quarter = st.session_state.current_quarter
+    # 个人基线使用最近几个历史季度的记录
+    quarters = [q for q in history_quarters() if q != quarter][-ANOMALY_HISTORY_QUARTERS:]
+    return cached_anomaly_flags(
+        st.session_state.data_version,
+        quarter,
+        history_cache_key(),
+        st.session_state.performance_data,
+        {q: get_history_quarter(q) for q in quarters}
+    )
 
-def calculate_quarter_average(monthly_data, quarter):
-    """计算季度平均值（处理4个月的特殊情况）"""
-    # 过滤掉为0的月份（未填报）
-    valid_data = [x for x in monthly_data if x > 0]
-    
-    if not valid_data:
-        return 0
-    
-    # 如果是Q4季度，且填报了4个月的数据
-    if "Q4" in quarter and len(valid_data) == 4:
-        # 4个月的数据转换为季度平均值（乘以3/4）
-        return sum(valid_data) * 0.75
-    else:
-        # 其他季度按实际填报月数计算平均值
-        avg_monthly = sum(valid_data) / len(valid_data)
-        return avg_monthly * 3
+def attach_anomaly_flags(df):
+    """在展示用的数据上附加“异常提示”列"""
+    flags = refresh_anomaly_flags()
+    if flags is None or df.empty:
+        return df
+    # assign返回共享原有列的新表，不修改会话数据
+    return df.assign(异常提示=flags['异常提示'].reindex(df.index).fillna(''))
+
+def show_anomaly_summary(df):
+    """在编辑器上方展示被标记的异常行"""
+    if '异常提示' not in df.columns:
+        return
+    flagged = df[df['异常提示'] != '']
+    if flagged.empty:
+        return
+    st.markdown(f'<div class="warning-card">⚠️ 检测到 {len(flagged)} 位事务员存在疑似异常填报，请核实后再保存</div>', unsafe_allow_html=True)
+    with st.expander("查看疑似异常明细", expanded=False):
+        st.dataframe(
+            flagged[['地市', '事务员', '异常提示']].reset_index(drop=True),
+            use_container_width=True
+        )
+
+# ========== 按数据版本缓存的计算 ==========
+# 第一个参数均为数据版本号，保存数据后版本号变化，旧缓存自然失效；
+# 带下划线前缀的参数不参与缓存键的哈希计算。
+
+@st.cache_data(max_entries=512, show_spinner=False)
+def cached_staff_record(data_version, staff_name, _df):
+    """按版本缓存的事务员数据"""
+    staff_data = _df[_df['事务员'] == staff_name]
+    if staff_data.empty:
+        return None
+    return staff_data.iloc[0].to_dict()
+
+@st.cache_data(max_entries=128, show_spinner=False)
+def cached_city_rows(data_version, city, _df):
+    """按版本缓存的地市数据"""
+    return _df[_df['地市'] == city]
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def cached_anomaly_flags(data_version, quarter, history_key, _df, _history):
+    """按数据版本和历史版本缓存的异常扫描结果"""
+    return detect_anomalies(_df, quarter, _history)
+
+@st.cache_data(max_entries=128, show_spinner=False)
+def cached_grade_distribution(data_version, city, _df):
+    """按版本缓存的档位分布（city为None时为全部地市）"""
+    if city is not None:
+        _df = _df[_df['地市'] == city]
+    return _df['档位'].value_counts().sort_index()
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def cached_city_stats(data_version, _df):
+    """按版本缓存的地区绩效汇总"""
+    city_stats = _df.groupby('地市').agg({
+        '总分': 'mean',
+        '档位': 'mean',
+        '事务员': 'count'
+    }).round(1).reset_index()
+    city_stats.columns = ['地市', '平均总分', '平均档位', '事务员数']
+    return city_stats
+
+@st.cache_data(max_entries=512, show_spinner=False)
+def cached_history_staff_row(history_key, quarter, staff_name, _history_data):
+    """按版本缓存的某事务员历史季度数据"""
+    history_data = _history_data
+    if history_data.empty:
+        return None
+    user_history = history_data[history_data['事务员'] == staff_name]
+    if user_history.empty:
+        return None
+    return user_history.iloc[0].to_dict()
+
+def history_staff_row(quarter, staff_name):
+    """某事务员某个历史季度的数据（归档季度直接读列文件）"""
+    if quarter in st.session_state.quarter_history:
+        return cached_history_staff_row(
+            history_cache_key(), quarter, staff_name, st.session_state.quarter_history[quarter]
+        )
+    columns = quarter_columns(quarter)
+    if columns is None:
+        return None
+    positions = archived_staff_positions(columns, staff_name)
+    return columns.row(positions[0]) if len(positions) else None
+
+def history_city_summary(quarter):
+    """历史季度的地市汇总（归档季度直接读列文件）"""
+    if quarter in st.session_state.quarter_history:
+        return cached_history_summary(history_cache_key(), quarter, st.session_state.quarter_history[quarter])
+    return archived_city_summary(quarter, st.session_state.loaded_cities)
+
+def staff_score_trend(staff_name):
+    """事务员各历史季度的总分和档位（归档季度只读取事务员、总分、档位三列）"""
+    rows = []
+    for quarter in history_quarters():
+        if quarter in st.session_state.quarter_history:
+            frame = st.session_state.quarter_history[quarter]
+            matched = frame[frame['事务员'] == staff_name]
+            if not matched.empty:
+                rows.append((quarter, matched['总分'].iloc[0], matched['档位'].iloc[0]))
+            continue
+        columns = quarter_columns(quarter)
+        positions = archived_staff_positions(columns, staff_name)[:1]
+        if len(positions):
+            rows.append((quarter, columns.values('总分', positions)[0], columns.values('档位', positions)[0]))
+    return pd.DataFrame(rows, columns=['季度', '总分', '档位'])
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def cached_history_summary(history_key, quarter, _history_df):
+    """按版本缓存的历史季度地市汇总"""
+    history_df = _history_df
+    return history_df.groupby('地市').agg({
+        '总分': 'mean',
+        '档位': 'mean',
+        '事务员': 'count'
+    }).round(1)
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def cached_excel_export(data_version, _df):
+    """按版本缓存的Excel导出内容"""
+    output, success, message = export_to_excel(_df)
+    return (output.getvalue() if success else None), success, message
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def cached_csv_export(data_version, city, _df):
+    """按版本缓存的CSV导出内容（city为None时为全部地市）"""
+    if city is not None:
+        _df = _df[_df['地市'] == city]
+    with timed('export_csv'):
+        data = _df.to_csv(index=False).encode('utf-8')
+    record_export('csv', len(data))
+    return data
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def cached_history_export(history_key, quarters):
+    """按版本缓存的季度历史导出内容（归档季度只在生成导出文件时解压）"""
+    output, success, message = export_quarter_history({quarter: get_history_quarter(quarter) for quarter in quarters})
+    return (output.getvalue() if success else None), success, message
+
+# ========== 检索索引与分页 ==========
+PAGE_SIZE_OPTIONS = [10, 20, 50, 100]
+# 排序选项：显示名称 -> (排序列, 是否升序)
+SORT_OPTIONS = {
+    "行号": ('行号', True),
+    "姓名": ('事务员', True),
+    "总分从高到低": ('总分', False),
+    "总分从低到高": ('总分', True),
+    "档位从高到低": ('档位', True),
+}
+
+def build_data_index(df):
+    """为绩效数据建立检索索引
+
+    索引只保存行位置数组，不复制数据：
+    - 按姓名排序的数组，用于二分查找姓名前缀
+    - 每个地市的行位置
+    - 各排序列的排序结果
+    """
+    names = df['事务员'].astype(str).to_numpy()
+    name_order = np.argsort(names, kind='stable')
+
+    city_codes, city_names = pd.factorize(df['地市'])
+    city_positions = {
+        city: np.flatnonzero(city_codes == code)
+        for code, city in enumerate(city_names)
+    }
+
+    sort_orders = {}
+    for column, _ in SORT_OPTIONS.values():
+        if column in df.columns and column not in sort_orders:
+            sort_orders[column] = np.argsort(df[column].to_numpy(), kind='stable')
 
-def calculate_realtime_score_for_staff(dist_values, recycle_values, core_customers, comp_score, quarter, target_grade=6):
-    """为事务员计算实时得分"""
-    # 计算季度平均值
-    dist_avg = calculate_quarter_average(dist_values, quarter)
-    recycle_avg = calculate_quarter_average(recycle_values, quarter)
-    
-    # 计算各项得分
-    dist_score = calculate_distribution_score(dist_avg)
-    recycle_score = calculate_recycling_score(recycle_avg)
-    core_score = calculate_core_customer_score(core_customers)
-    
-    # 限制综合评分为0-20
-    comp_score = min(20, max(0, comp_score))
-    
-    # 总分和档位
-    total_score = dist_score + recycle_score + core_score + comp_score
-    grade, salary = calculate_salary_grade(total_score)
-    
-    # 检查档位提醒
-    warning_level, warning_msg = check_grade_warning(grade, target_grade)
-    
     return {
-        '分销均季度': round(dist_avg, 1),
-        '条盒均季度': round(recycle_avg, 1),
-        '分销得分': dist_score,
-        '条盒回收得分': recycle_score,
-        '核心户得分': core_score,
-        '综合得分': comp_score,
-        '总分': total_score,
-        '档位': grade,
-        '预估月薪': salary,
-        '档位提醒级别': warning_level,
-        '档位提醒信息': warning_msg,
-        '是否达标': grade <= target_grade
+        'size': len(df),
+        'names_sorted': names[name_order],
+        'name_order': name_order,
+        'city_positions': city_positions,
+        'sort_orders': sort_orders,
     }
 
-def get_grade_improvement_tips(current_scores, target_grade):
-    """获取提升档位的建议"""
-    tips = []
-    
-    # 计算当前总分对应的档位
-    current_total = current_scores['总分']
-    current_grade, _ = calculate_salary_grade(current_total)
-    
-    if current_grade <= target_grade:
-        return ["✅ 已达到目标档位，继续保持！"]
-    
-    # 需要提升的分数
-    needed_improvement = 0
-    if target_grade == 1:
-        needed_score = 91
-    elif target_grade == 2:
-        needed_score = 81
-    elif target_grade == 3:
-        needed_score = 71
-    elif target_grade == 4:
-        needed_score = 61
-    elif target_grade == 5:
-        needed_score = 51
-    elif target_grade == 6:
-        needed_score = 46
-    elif target_grade == 7:
-        needed_score = 41
-    elif target_grade == 8:
-        needed_score = 36
-    elif target_grade == 9:
-        needed_score = 31
-    else:
-        needed_score = 0
-    
-    needed_improvement = max(0, needed_score - current_total)
-    
-    if needed_improvement == 0:
-        return ["✅ 已达到目标档位，继续保持！"]
-    
-    tips.append(f"📈 需要提升 {needed_improvement} 分才能达到 {target_grade} 档")
-    
-    # 各项得分分析
-    if current_scores['分销得分'] < 25:
-        tips.append(f"📦 分销得分：{current_scores['分销得分']}/25，可以提升 {25 - current_scores['分销得分']} 分")
-        if current_scores['分销均季度'] < 61:
-            tips.append(f"   → 建议将分销季度平均值提升到 61条以上（当前 {current_scores['分销均季度']}条）")
-        elif current_scores['分销均季度'] < 151:
-            tips.append(f"   → 建议将分销季度平均值提升到 151条以上（当前 {current_scores['分销均季度']}条）")
-        elif current_scores['分销均季度'] < 301:
-            tips.append(f"   → 建议将分销季度平均值提升到 301条以上（当前 {current_scores['分销均季度']}条）")
-        elif current_scores['分销均季度'] < 601:
-            tips.append(f"   → 建议将分销季度平均值提升到 601条以上（当前 {current_scores['分销均季度']}条）")
-        else:
-            tips.append(f"   → 建议将分销季度平均值提升到 1000条以上（当前 {current_scores['分销均季度']}条）")
-    
-    if current_scores['条盒回收得分'] < 35:
-        tips.append(f"📊 条盒回收得分：{current_scores['条盒回收得分']}/35，可以提升 {35 - current_scores['条盒回收得分']} 分")
-        if current_scores['条盒均季度'] < 181:
-            tips.append(f"   → 建议将条盒回收季度平均值提升到 181条以上（当前 {current_scores['条盒均季度']}条）")
-        elif current_scores['条盒均季度'] < 201:
-            tips.append(f"   → 建议将条盒回收季度平均值提升到 201条以上（当前 {current_scores['条盒均季度']}条）")
-        elif current_scores['条盒均季度'] < 301:
-            tips.append(f"   → 建议将条盒回收季度平均值提升到 301条以上（当前 {current_scores['条盒均季度']}条）")
-        elif current_scores['条盒均季度'] < 401:
-            tips.append(f"   → 建议将条盒回收季度平均值提升到 401条以上（当前 {current_scores['条盒均季度']}条）")
-        elif current_scores['条盒均季度'] < 601:
-            tips.append(f"   → 建议将条盒回收季度平均值提升到 601条以上（当前 {current_scores['条盒均季度']}条）")
-        elif current_scores['条盒均季度'] < 801:
-            tips.append(f"   → 建议将条盒回收季度平均值提升到 801条以上（当前 {current_scores['条盒均季度']}条）")
-        else:
-            tips.append(f"   → 建议将条盒回收季度平均值提升到 1000条以上（当前 {current_scores['条盒均季度']}条）")
-    
-    if current_scores['核心户得分'] < 20:
-        tips.append(f"👥 核心户得分：{current_scores['核心户得分']}/20，可以提升 {20 - current_scores['核心户得分']} 分")
-        if current_scores['核心户得分'] < 5:
-            tips.append(f"   → 建议将核心户数增加到 16人以上")
-        elif current_scores['核心户得分'] < 10:
-            tips.append(f"   → 建议将核心户数增加到 21人以上")
-        elif current_scores['核心户得分'] < 15:
-            tips.append(f"   → 建议将核心户数增加到 26人以上")
-        else:
-            tips.append(f"   → 建议将核心户数增加到 31人以上")
-    
-    if current_scores['综合得分'] < 20:
-        tips.append(f"⭐ 综合得分：{current_scores['综合得分']}/20，可以提升 {20 - current_scores['综合得分']} 分")
-        tips.append(f"   → 请加强与地市经理的沟通，提高工作表现评分")
-    
-    return tips
-
-# ========== 数据初始化 ==========
-def init_data_from_template():
-    """从模板初始化数据"""
-    data = []
-    staff_list = [
-        ('石家庄', '庞雷'), ('保定', '方亚辉'), ('保定', '李建英'), ('保定', '史亚卿'),
-        ('保定', '甄喜梅'), ('沧州', '郝亮'), ('沧州', '张卿'), ('张家口', '李晓峰'),
-        ('石家庄', '孙霆'), ('石家庄', '李凤霞'), ('石家庄', '赵晴'), ('石家庄', '刘东青'),
-        ('邯郸', '冯斌'), ('邯郸', '谷巧霞'), ('邢台', '黄小刚'), ('唐山', '张丽颖'),
-        ('廊坊', '王玉刚'), ('秦皇岛', '陈晔'), ('天津', '夏美佳'), ('天津', '刘波'),
-        ('北京', '段体春'), ('北京', '胡颖'), ('临沂', '王培娟'), ('临沂', '朱森'),
-        ('潍坊', '李雪兰'), ('潍坊', '王军军'), ('枣庄', '黄成志'), ('淄博', '杨秀霞'),
-        ('济南', '陈蕾'), ('济南', '杨晶晶'), ('威海', '马晓燕'), ('青岛', '田亮'),
-        ('烟台', '岳东玉'), ('烟台', '高韶伟'), ('太原', '辛伟'), ('太原', '樊芳'),
-        ('晋中', '聂江波')
-    ]
-    
-    for i, (city, name) in enumerate(staff_list, 1):
-        data.append({
-            '行号': i,
-            '地市': city,
-            '事务员': name,
-            # 月度数据 - 所有月份都保留
-            '分销_1月': 0, '分销_2月': 0, '分销_3月': 0,
-            '分销_4月': 0, '分销_5月': 0, '分销_6月': 0,
-            '分销_7月': 0, '分销_8月': 0, '分销_9月': 0,
-            '分销_10月': 0, '分销_11月': 0, '分销_12月': 0,
-            '条盒_1月': 0, '条盒_2月': 0, '条盒_3月': 0,
-            '条盒_4月': 0, '条盒_5月': 0, '条盒_6月': 0,
-            '条盒_7月': 0, '条盒_8月': 0, '条盒_9月': 0,
-            '条盒_10月': 0, '条盒_11月': 0, '条盒_12月': 0,
-            # 其他数据
-            '核心户数': 0,
-            '综合评分': 0,
-            '季度目标档位': 6,
-            '备注': ''
-        })
-    
-    df = pd.DataFrame(data)
-    return df
+# 每个地市分片一个条目（同一地市同一版本的会话共用），另为加载全部地市的管理员会话留出几个条目
+DATA_INDEX_EXTRA_ENTRIES = 4
 
-def calculate_performance(df, quarter):
-    """根据季度计算绩效"""
-    # 确定月份范围
-    if "Q1" in quarter:
-        month_range = [1, 2, 3]
-    elif "Q2" in quarter:
-        month_range = [4, 5, 6]
-    elif "Q3" in quarter:
-        month_range = [7, 8, 9]
-    elif "Q4" in quarter:
-        month_range = [10, 11, 12]
-    else:
-        month_range = [1, 2, 3]
-    
-    for idx, row in df.iterrows():
-        # 收集当前季度的分销数据
-        dist_data = []
-        recycle_data = []
-        
-        for month_num in month_range:
-            dist_col = f'分销_{month_num}月'
-            recycle_col = f'条盒_{month_num}月'
-            
-            if dist_col in row:
-                dist_data.append(row[dist_col])
-            if recycle_col in row:
-                recycle_data.append(row[recycle_col])
-        
-        # 计算季度平均值
-        dist_avg = calculate_quarter_average(dist_data, quarter)
-        recycle_avg = calculate_quarter_average(recycle_data, quarter)
-        
-        # 计算各项得分
-        dist_score = calculate_distribution_score(dist_avg)
-        recycle_score = calculate_recycling_score(recycle_avg)
-        core_score = calculate_core_customer_score(row['核心户数'])
-        comp_score = row['综合评分'] if row['综合评分'] <= 20 else 20
-        
-        # 总分和档位
-        total_score = dist_score + recycle_score + core_score + comp_score
-        grade, salary = calculate_salary_grade(total_score)
-        
-        # 检查档位提醒
-        target_grade = row.get('季度目标档位', 6)
-        warning_level, warning_msg = check_grade_warning(grade, target_grade)
-        
-        # 添加到结果
-        df.at[idx, '分销均季度'] = round(dist_avg, 1)
-        df.at[idx, '条盒均季度'] = round(recycle_avg, 1)
-        df.at[idx, '分销得分'] = dist_score
-        df.at[idx, '条盒回收得分'] = recycle_score
-        df.at[idx, '核心户得分'] = core_score
-        df.at[idx, '综合得分'] = comp_score
-        df.at[idx, '总分'] = total_score
-        df.at[idx, '档位'] = grade
-        df.at[idx, '预估月薪'] = salary
-        df.at[idx, '档位提醒级别'] = warning_level
-        df.at[idx, '档位提醒信息'] = warning_msg
-        df.at[idx, '是否达标'] = grade <= target_grade
-    
-    return df
-
-def get_current_quarter_data(df, quarter):
-    """获取当前季度的数据（只显示当前季度的相关列）"""
-    if df.empty:
-        return df
-    
-    # 确定当前季度月份范围
-    if "Q1" in quarter:
-        month_range = [1, 2, 3]
-    elif "Q2" in quarter:
-        month_range = [4, 5, 6]
-    elif "Q3" in quarter:
-        month_range = [7, 8, 9]
-    elif "Q4" in quarter:
-        month_range = [10, 11, 12]
-    else:
-        month_range = [1, 2, 3]
-    
-    # 基本列
-    base_columns = ['行号', '地市', '事务员', '核心户数', '综合评分', 
-                   '季度目标档位', '备注']
-    
-    # 当前季度月份列
-    month_columns = []
-    for month_num in month_range:
-        month_columns.extend([f'分销_{month_num}月', f'条盒_{month_num}月'])
-    
-    # 计算列
-    calc_columns = ['分销均季度', '条盒均季度', '分销得分', '条盒回收得分',
-                   '核心户得分', '综合得分', '总分', '档位', '预估月薪',
-                   '是否达标']
-    
-    # 合并所有需要显示的列
-    display_columns = base_columns + month_columns
-    
-    # 只保留存在的列
-    available_columns = [col for col in display_columns if col in df.columns]
-    
-    # 创建新的DataFrame
-    result_df = df[available_columns].copy()
-    
-    # 添加计算列（如果存在）
-    for col in calc_columns:
-        if col in df.columns:
-            result_df[col] = df[col]
-    
-    return result_df
+class DataIndexCache:
+    """按已加载各地市分片的版本缓存检索索引，容量为地市数加少量余量，超出时淘汰最久未使用的索引"""
 
-# ========== 数据导入导出函数 ==========
-def import_excel_data(uploaded_file):
-    """从Excel文件导入数据"""
-    try:
-        df = pd.read_excel(uploaded_file)
-        return df, True, "导入成功"
-    except Exception as e:
-        return None, False, f"导入失败: {str(e)}"
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
 
-def export_to_excel(df):
-    """导出数据到Excel"""
-    try:
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='绩效数据')
-        output.seek(0)
-        return output, True, "导出成功"
-    except Exception as e:
-        return None, False, f"导出失败: {str(e)}"
+    def get_or_build(self, shard_versions, df):
+        """命中缓存时直接返回索引，否则在df上建立索引"""
+        key = tuple(sorted(shard_versions.items()))
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        # 建立索引时不持有锁，避免阻塞其他会话
+        index = build_data_index(df)
+
+        max_entries = len(list_shard_cities()) + DATA_INDEX_EXTRA_ENTRIES
+        with self._lock:
+            self._entries[key] = index
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+        return index
+
+    def __len__(self):
+        return len(self._entries)
+
+@st.cache_resource
+def get_data_index_cache(tenant):
+    """每个数据集一个检索索引缓存（进程内共享）"""
+    return DataIndexCache()
+
+def session_data_index():
+    """会话数据的检索索引（只读，多个会话共享）"""
+    return get_data_index_cache(st.session_state.tenant).get_or_build(
+        st.session_state.shard_versions, st.session_state.performance_data
+    )
+
+def lookup_name_prefix(index, prefix):
+    """二分查找姓名前缀，返回匹配行的位置"""
+    names_sorted = index['names_sorted']
+    lo = np.searchsorted(names_sorted, prefix, side='left')
+    hi = np.searchsorted(names_sorted, prefix + '\uffff', side='right')
+    return index['name_order'][lo:hi]
+
+def lookup_name_exact(index, name):
+    """二分查找姓名完全相同的行位置"""
+    names_sorted = index['names_sorted']
+    lo = np.searchsorted(names_sorted, name, side='left')
+    hi = np.searchsorted(names_sorted, name, side='right')
+    return index['name_order'][lo:hi]
+
+def query_data_index(index, city=None, prefix='', sort_by='行号', ascending=True, mask=None):
+    """在索引上完成筛选与排序，返回排好序的行位置
+
+    mask为可选的布尔数组（与数据行一一对应），用于附加筛选条件。
+    """
+    selected = np.ones(index['size'], dtype=bool) if mask is None else mask.copy()
+
+    if city is not None:
+        city_mask = np.zeros(index['size'], dtype=bool)
+        city_mask[index['city_positions'].get(city, np.empty(0, dtype=int))] = True
+        selected &= city_mask
+
+    prefix = (prefix or '').strip()
+    if prefix:
+        prefix_mask = np.zeros(index['size'], dtype=bool)
+        prefix_mask[lookup_name_prefix(index, prefix)] = True
+        selected &= prefix_mask
+
+    order = index['sort_orders'].get(sort_by)
+    if order is None:
+        order = np.arange(index['size'])
+    if not ascending:
+        order = order[::-1]
+    return order[selected[order]]
+
+def paginate(positions, page, page_size):
+    """取出某一页的行位置，返回(本页位置, 总页数)"""
+    page_count = max(1, -(-len(positions) // page_size))
+    page = min(max(1, page), page_count)
+    start = (page - 1) * page_size
+    return positions[start:start + page_size], page_count
+
+def query_performance_positions(df, index, city=None, grades=None, qualified=None, prefix='',
+                                sort_by='行号', ascending=True):
+    """服务端查询：在索引上完成筛选和排序，返回符合条件的行位置
+
+    grades为档位列表，qualified为True/False/None（是否达标）。
+    """
+    mask = None
+    if grades:
+        mask = np.isin(df['档位'].to_numpy(), grades)
+    if qualified is not None and '是否达标' in df.columns:
+        qualified_mask = df['是否达标'].to_numpy(dtype=bool) == qualified
+        mask = qualified_mask if mask is None else mask & qualified_mask
+    
+    return query_data_index(index, city, prefix, sort_by, ascending, mask)
+
+def load_page(df, positions, page, page_size, quarter=None):
+    """只取出当前页的数据（指定季度时只保留该季度的相关列）"""
+    page_positions, _ = paginate(positions, page, page_size)
+    page_df = df.iloc[page_positions]
+    if quarter is not None:
+        page_df = get_current_quarter_data(page_df, quarter)
+    return page_df
+
+def collect_editor_updates(editor_key, page_df, editable_fields):
+    """从data_editor的编辑状态中取出被修改的单元格
+
+    只读取编辑器记录的增量（edited_rows），返回 {事务员: {字段: 新值}}。
+    """
+    editor_state = st.session_state.get(editor_key) or {}
+    updates_by_staff = {}
+    for row_pos, changes in editor_state.get('edited_rows', {}).items():
+        row_pos = int(row_pos)
+        if row_pos >= len(page_df):
+            continue
+        updates = {field: value for field, value in changes.items() if field in editable_fields}
+        if updates:
+            staff_name = page_df.iloc[row_pos]['事务员']
+            updates_by_staff.setdefault(staff_name, {}).update(updates)
+    return updates_by_staff
+
+def render_pager(total, page_size, key):
+    """显示页码选择控件，返回当前页码"""
+    page_count = max(1, -(-total // page_size))
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        page = st.number_input("页码", min_value=1, max_value=page_count, value=1, step=1, key=key)
+    with col2:
+        st.caption(f"共 {total} 条记录，每页 {page_size} 条，共 {page_count} 页")
+    return int(page)
+
+# ========== 登录姓名检索 ==========
+LOGIN_SEARCH_LIMIT = 10
+
+# GB2312一级汉字按拼音排序，可根据区位码区间得到拼音首字母（二级汉字无法推算）
+_GB2312_INITIAL_BOUNDARIES = [
+    (0xB0A1, 'a'), (0xB0C5, 'b'), (0xB2C1, 'c'), (0xB4EE, 'd'), (0xB6EA, 'e'),
+    (0xB7A2, 'f'), (0xB8C1, 'g'), (0xB9FE, 'h'), (0xBBF7, 'j'), (0xBFA6, 'k'),
+    (0xC0AC, 'l'), (0xC2E8, 'm'), (0xC4C3, 'n'), (0xC5B6, 'o'), (0xC5BE, 'p'),
+    (0xC6DA, 'q'), (0xC8BB, 'r'), (0xC8F6, 's'), (0xCBFA, 't'), (0xCDDA, 'w'),
+    (0xCEF4, 'x'), (0xD1B9, 'y'), (0xD4D1, 'z'),
+]
+_GB2312_LEVEL1_END = 0xD7F9
+_GB2312_CODES = [code for code, _ in _GB2312_INITIAL_BOUNDARIES]
 
-def export_quarter_history():
-    """导出季度历史数据"""
+def _char_initial(char):
+    """根据GB2312区位码推算单个汉字的拼音首字母，无法推算时返回原字符"""
+    if char.isascii():
+        return char.lower()
     try:
-        if not st.session_state.quarter_history:
-            return None, False, "没有历史数据"
-        
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            for quarter, data in st.session_state.quarter_history.items():
-                df = pd.DataFrame(data)
-                df.to_excel(writer, index=False, sheet_name=quarter[:10])  # 限制sheet名长度
-        
-        output.seek(0)
-        return output, True, "历史数据导出成功"
-    except Exception as e:
-        return None, False, f"导出失败: {str(e)}"
+        encoded = char.encode('gb2312')
+    except UnicodeEncodeError:
+        return char
+    if len(encoded) != 2:
+        return char
+    code = encoded[0] * 256 + encoded[1]
+    if code < _GB2312_CODES[0] or code > _GB2312_LEVEL1_END:
+        return char
+    return _GB2312_INITIAL_BOUNDARIES[bisect.bisect_right(_GB2312_CODES, code) - 1][1]
+
+def name_search_keys(name):
+    """生成姓名的检索键：姓名本身、拼音首字母，以及（安装pypinyin时）全拼"""
+    keys = {name.lower()}
+    if lazy_pinyin is not None:
+        keys.add(''.join(lazy_pinyin(name, style=Style.FIRST_LETTER)).lower())
+        keys.add(''.join(lazy_pinyin(name)).lower())
+    else:
+        keys.add(''.join(_char_initial(char) for char in name))
+    return keys
+
+def build_login_index(names, cities):
+    """建立登录用的姓名前缀索引：排好序的检索键及其对应的姓名"""
+    entries = []
+    city_of = {}
+    for name, city in zip(names, cities):
+        name = str(name)
+        city_of.setdefault(name, city)
+        for key in name_search_keys(name):
+            entries.append((key, name))
+    entries.sort()
+    return {
+        'keys': [key for key, _ in entries],
+        'names': [name for _, name in entries],
+        'city_of': city_of,
+    }
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def cached_login_index(data_version, _df):
+    """按版本缓存的登录姓名索引"""
+    return build_login_index(_df['事务员'].tolist(), _df['地市'].tolist())
+
+def search_staff_names(index, query, limit=LOGIN_SEARCH_LIMIT):
+    """按姓名或拼音前缀检索，只返回前limit个匹配的姓名"""
+    query = (query or '').strip().lower()
+    if not query:
+        return []
+    keys = index['keys']
+    results = []
+    for pos in range(bisect.bisect_left(keys, query), len(keys)):
+        if not keys[pos].startswith(query):
+            break
+        name = index['names'][pos]
+        if name not in results:
+            results.append(name)
+            if len(results) >= limit:
+                break
+    return results
+
+# ========== 图表缓存 ==========
+FIGURE_CACHE_SIZE = 64
+
+class FigureCache:
+    """按(图表ID, 范围, 数据版本)缓存plotly图表JSON，超出容量时淘汰最久未使用的图表"""
+
+    def __init__(self, max_entries=FIGURE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_build(self, chart_id, scope, data_version, builder):
+        """命中缓存时直接返回图表JSON，否则调用builder生成图表"""
+        key = (chart_id, scope, data_version)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        # 生成图表时不持有锁，避免阻塞其他会话
+        fig_json = builder().to_json()
+
+        with self._lock:
+            self._entries[key] = fig_json
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return fig_json
+
+    def invalidate(self, scopes=None):
+        """丢弃指定范围（地市或'全部'）的图表（不指定范围时全部清空）"""
+        with self._lock:
+            if scopes is None:
+                self._entries.clear()
+                return
+            stale_keys = [key for key in self._entries if key[1] in scopes]
+            for key in stale_keys:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def memory_bytes(self):
+        """缓存的图表JSON占用的内存"""
+        with self._lock:
+            return sum(deep_sizeof(fig_json) for fig_json in self._entries.values())
+
+@st.cache_resource
+def get_figure_cache():
+    """进程内共享的图表缓存"""
+    return FigureCache()
+
+def render_cached_chart(chart_id, scope, builder):
+    """从图表缓存中取出（或生成）图表并显示"""
+    fig_json = get_figure_cache().get_or_build(
+        chart_id, scope, st.session_state.data_version, builder
+    )
+    st.plotly_chart(pio.from_json(fig_json), use_container_width=True)
+
+def build_grade_bar_figure(grade_dist, title, color_scale):
+    """档位分布柱状图"""
+    fig = px.bar(x=[f"{g}档" for g in grade_dist.index], 
+                y=grade_dist.values,
+                title=title,
+                color=grade_dist.values,
+                color_continuous_scale=color_scale)
+    fig.update_layout(xaxis_title="档位", yaxis_title="人数")
+    return fig
+
+def build_grade_pie_figure(grade_dist, title):
+    """档位占比饼图"""
+    return px.pie(values=grade_dist.values, 
+                names=[f"{g}档" for g in grade_dist.index],
+                title=title)
 
-def backup_data():
-    """备份数据到文件"""
+def build_city_top_figure(city_stats):
+    """平均总分前十地区柱状图"""
+    fig = px.bar(city_stats.sort_values('平均总分', ascending=False).head(10),
+                x='地市', y='平均总分',
+                title='平均总分前十地区',
+                color='平均总分',
+                color_continuous_scale='Viridis')
+    fig.update_layout(xaxis_title="地市", yaxis_title="平均总分")
+    return fig
+
+def build_city_scatter_figure(city_stats):
+    """地区人数与绩效关系散点图"""
+    return px.scatter(city_stats, x='事务员数', y='平均总分',
+                    size='事务员数', hover_name='地市',
+                    title='地区人数与绩效关系',
+                    color='平均档位',
+                    color_continuous_scale='RdYlGn')
+
+def build_score_trend_figure(trend):
+    """历史季度总分趋势折线图"""
+    fig = px.line(trend, x='季度', y='总分', markers=True,
+                 hover_data=['档位'], title='历史季度总分趋势')
+    fig.update_layout(xaxis_title="季度", yaxis_title="总分")
+    return fig
+
+# ========== 数据备份与恢复 ==========
+def get_backup_scheduler():
+    """当前数据集的后台备份线程，数据集被淘汰后继续运行"""
+    return get_tenant_registry().background(current_tenant().name, 'backup_scheduler', BackupScheduler)
+
+def backup_data(label='手动备份'):
+    """备份数据：冻结当前数据后由后台线程写入备份"""
     try:
-        backup_time = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_file = f"backup_{backup_time}.pkl"
-        
-        backup_data = {
-            'performance_data': st.session_state.performance_data,
-            'quarter_history': st.session_state.quarter_history,
-            'current_quarter': st.session_state.current_quarter,
-            'last_reset': st.session_state.last_reset,
-            'data_history': st.session_state.data_history
-        }
-        
-        with open(backup_file, 'wb') as f:
-            pickle.dump(backup_data, f)
-        
-        return backup_file, True, f"备份成功：{backup_file}"
+        get_backup_scheduler().request(label)
+        return None, True, f"{label}已开始，正在后台写入"
     except Exception as e:
         return None, False, f"备份失败: {str(e)}"
 
-def restore_backup(backup_file):
-    """从备份文件恢复数据"""
+def restore_backup(backup_id):
+    """从备份恢复数据（旧版整文件备份也可恢复）"""
     try:
-        with open(backup_file, 'rb') as f:
-            backup_data = pickle.load(f)
-        
-        st.session_state.performance_data = backup_data.get('performance_data')
-        st.session_state.quarter_history = backup_data.get('quarter_history', {})
-        st.session_state.current_quarter = backup_data.get('current_quarter')
-        st.session_state.last_reset = backup_data.get('last_reset')
-        st.session_state.data_history = backup_data.get('data_history', {})
-        
-        save_data()
-        
-        return True, "数据恢复成功"
+        backup_data('恢复前备份')
+        if backup_id.endswith('.pkl'):
+            with open(backup_id, 'rb') as f:
+                backup = pickle.load(f)
+            clear_archived_quarters()
+            performance_data = backup.get('performance_data')
+            quarter_history = backup.get('quarter_history', {})
+            meta = backup
+        else:
+            files = read_backup_files(backup_id)
+            meta = pickle.loads(files['meta.pkl']) if 'meta.pkl' in files else {}
+            frames = []
+            histories = []
+            archives = {}
+            for rel_path, data in files.items():
+                if rel_path.endswith(SHARD_HISTORY_SUFFIX):
+                    histories.append(pickle.loads(data))
+                elif rel_path.startswith('shards/'):
+                    frames.append(pickle.loads(data)['performance_data'])
+                elif rel_path.startswith('history/'):
+                    archives[rel_path[len('history/'):-len(HISTORY_ARCHIVE_SUFFIX)]] = data
+            performance_data = pd.concat(frames).sort_index() if frames else None
+            quarter_history = merge_hot_history(histories)
+            clear_archived_quarters()
+            os.makedirs(data_path(HISTORY_ARCHIVE_DIR), exist_ok=True)
+            for quarter, data in archives.items():
+                with open(_archive_path(quarter), 'wb') as f:
+                    f.write(data)
+        
+        set_session_history(merge_hot_history([quarter_history]))
+        st.session_state.current_quarter = meta.get('current_quarter')
+        st.session_state.last_reset = meta.get('last_reset')
+        
+        save_data(force=True, operation='恢复备份', df=performance_data)
+        archive_cold_quarters()
+        
+        return True, "数据恢复成功（已通过校验）"
     except Exception as e:
         return False, f"恢复失败: {str(e)}"
 
-def find_backup_files():
-    """查找备份文件"""
-    backup_files = []
-    for file in os.listdir('.'):
-        if file.startswith('backup_') and file.endswith('.pkl'):
-            backup_files.append(file)
-    return sorted(backup_files, reverse=True)
-
 # ========== 登录页面 ==========
 def login_page():
     st.markdown('<h1 class="main-header">🔐 广东中烟绩效管理系统（季度版）</h1>', unsafe_allow_html=True)
@@ -852,25 +1436,22 @@ def login_page():
     if st.session_state.current_quarter is None:
         st.session_state.current_quarter = get_current_quarter()
     
-    # 检查是否需要季度重置
-    if check_reset_needed():
-        st.warning(f"检测到新季度开始，即将自动重置数据...")
-        if st.session_state.performance_data is not None:
-            st.session_state.performance_data = reset_quarter_data(
-                st.session_state.performance_data, 
-                target_grade=6
-            )
-        st.session_state.current_quarter = get_current_quarter()
-    
-    # 初始化数据
-    if st.session_state.performance_data is None:
-        st.session_state.performance_data = init_data_from_template()
-        st.session_state.performance_data = calculate_performance(
-            st.session_state.performance_data, 
-            st.session_state.current_quarter
-        )
+    # 新季度由后台任务切换，登录不等待
+    if not rollover_done(get_current_quarter()):
+        get_quarter_rollover_job().trigger()
+        if st.session_state.current_quarter != get_current_quarter():
+            st.info("检测到新季度开始，数据正在后台切换，稍后自动更新")
+    sync_session_quarter()
+    
+    # 初始化数据（还没有任何地市分片时）
+    if st.session_state.roster is None:
+        load_session_data()
+    if st.session_state.roster is None and st.session_state.performance_data is None:
         # 保存初始数据
-        save_data()
+        save_data(operation='初始化数据', df=calculate_performance(
+            init_data_from_template(), 
+            st.session_state.current_quarter
+        ))
     
     # 季度显示
     quarter_badge = {
@@ -896,26 +1477,49 @@ def login_page():
     with col2:
         with st.container():
             st.markdown('<div class="metric-card">', unsafe_allow_html=True)
+            
+            tenants = list_tenants()
+            if len(tenants) > 1:
+                tenant = st.selectbox(
+                    "数据集", tenants,
+                    index=tenants.index(st.session_state.tenant) if st.session_state.tenant in tenants else 0,
+                    format_func=tenant_title, key="tenant_select"
+                )
+                if tenant != st.session_state.tenant:
+                    switch_session_tenant(tenant)
+                    st.rerun()
+            
             st.subheader("请选择身份登录")
             
             role = st.radio("您的身份", ["事务员", "地市经理", "管理员"], horizontal=True, key="role_radio")
             
             if role == "事务员":
-                staff_names = st.session_state.performance_data['事务员'].tolist()
-                user_name = st.selectbox("请选择您的姓名", staff_names, key="staff_select")
+                # 输入姓名或拼音首字母检索，只显示少量匹配结果
+                login_index = cached_login_index(
+                    st.session_state.roster_version,
+                    st.session_state.roster
+                )
+                query = st.text_input("输入姓名或拼音首字母", placeholder="例如：庞雷 或 pl", key="staff_search")
+                matched_names = search_staff_names(login_index, query)
+                if query and not matched_names:
+                    st.info("未找到匹配的事务员")
+                user_name = st.selectbox(
+                    "请选择您的姓名",
+                    matched_names,
+                    format_func=lambda name: f"{name}（{login_index['city_of'][name]}）",
+                    # 检索条件变化时重新选中第一个匹配结果
+                    key=f"staff_select_{query.strip().lower()}"
+                )
                 
-                if st.button("登录", type="primary", use_container_width=True, key="staff_login_btn"):
+                if st.button("登录", type="primary", use_container_width=True, key="staff_login_btn", disabled=user_name is None):
                     st.session_state.authenticated = True
                     st.session_state.user_role = "staff"
                     st.session_state.user_name = user_name
-                    user_city = st.session_state.performance_data[
-                        st.session_state.performance_data['事务员'] == user_name
-                    ]['地市'].values[0]
-                    st.session_state.current_city = user_city
+                    st.session_state.current_city = login_index['city_of'][user_name]
                     st.rerun()
             
             elif role == "地市经理":
-                cities = st.session_state.performance_data['地市'].unique().tolist()
+                cities = st.session_state.roster['地市'].unique().tolist()
                 city = st.selectbox("请选择您管理的地市", cities, key="city_select")
                 manager_pwd = st.text_input("地市经理密码", type="password", value="manager123", key="manager_pwd_input")
                 
@@ -944,355 +1548,610 @@ def login_page():
             st.markdown('</div>', unsafe_allow_html=True)
 
 # ========== 事务员个人页面 ==========
-def staff_dashboard():
-    st.markdown(f'<h2 class="main-header">👤 {st.session_state.user_name} 的个人中心</h2>', unsafe_allow_html=True)
+def render_staff_overview(staff_data):
+    """季度绩效总览"""
+    # 档位提醒
+    if '档位提醒级别' in staff_data and '档位提醒信息' in staff_data:
+        st.markdown(f'<div class="{staff_data["档位提醒级别"]}-card">{staff_data["档位提醒信息"]}</div>', unsafe_allow_html=True)
+    
+    # 季度绩效总览
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("季度总分", f"{staff_data['总分']}分" if '总分' in staff_data else "0分")
+    with col2:
+        if '档位' in staff_data and '季度目标档位' in staff_data:
+            current_grade = staff_data['档位']
+            target_grade = staff_data['季度目标档位']
+            color = "#10b981" if current_grade <= target_grade else "#ef4444"
+            st.markdown(f"""
+            <div style="text-align: center;">
+                <div style="font-size: 0.9rem; color: #666;">季度档位</div>
+                <div style="font-size: 2rem; font-weight: bold; color: {color};">{current_grade}档</div>
+                <div style="font-size: 0.8rem; color: #666;">目标：{target_grade}档</div>
+            </div>
+            """, unsafe_allow_html=True)
+    with col3:
+        st.metric("季度月薪", f"¥{staff_data['预估月薪']}" if '预估月薪' in staff_data else "¥0")
+    with col4:
+        st.metric("所属地市", staff_data['地市'])
     
-    # 获取用户数据
-    staff_data = get_staff_data(st.session_state.user_name)
+    st.divider()
+    
+    # 得分详情
+    st.subheader("📈 季度得分详情")
     
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        dist_score = staff_data['分销得分'] if '分销得分' in staff_data else 0
+        dist_avg = staff_data['分销均季度'] if '分销均季度' in staff_data else 0
+        st.metric("分销得分", f"{dist_score}/25")
+        st.caption(f"均季度: {dist_avg}条")
+    with col2:
+        recycle_score = staff_data['条盒回收得分'] if '条盒回收得分' in staff_data else 0
+        recycle_avg = staff_data['条盒均季度'] if '条盒均季度' in staff_data else 0
+        st.metric("条盒回收得分", f"{recycle_score}/35")
+        st.caption(f"均季度: {recycle_avg}条")
+    with col3:
+        core_score = staff_data['核心户得分'] if '核心户得分' in staff_data else 0
+        core_count = staff_data['核心户数'] if '核心户数' in staff_data else 0
+        st.metric("核心户得分", f"{core_score}/20")
+        st.caption(f"核心户数: {core_count}人")
+    with col4:
+        comp_score = staff_data['综合得分'] if '综合得分' in staff_data else 0
+        st.metric("综合得分", f"{comp_score}/20")
+        st.caption("地市经理评分")
+    
+    # 显示当前填报的数据
+    st.divider()
+    st.subheader("📋 当前填报数据")
+    
+    quarter_months = get_quarter_months(st.session_state.current_quarter)
+    col_count = len(quarter_months)
+    
+    if col_count > 0:
+        cols = st.columns(col_count)
+        for i, month in enumerate(quarter_months):
+            with cols[i]:
+                month_num = int(month.replace('月', ''))
+                dist_col = f'分销_{month_num}月'
+                recycle_col = f'条盒_{month_num}月'
+                
+                dist_value = staff_data[dist_col] if dist_col in staff_data else 0
+                recycle_value = staff_data[recycle_col] if recycle_col in staff_data else 0
+                
+                st.metric(f"{month}分销", f"{dist_value}条")
+                st.metric(f"{month}回收", f"{recycle_value}条")
+    
+    # 改进建议和提升档位提示
+    st.divider()
+    st.subheader("💡 提升建议")
+    
+    if '档位' in staff_data and '季度目标档位' in staff_data:
+        current_grade = staff_data['档位']
+        target_grade = staff_data['季度目标档位']
+        
+        if current_grade > target_grade:
+            current_scores = {
+                '总分': staff_data['总分'] if '总分' in staff_data else 0,
+                '分销得分': staff_data['分销得分'] if '分销得分' in staff_data else 0,
+                '条盒回收得分': staff_data['条盒回收得分'] if '条盒回收得分' in staff_data else 0,
+                '核心户得分': staff_data['核心户得分'] if '核心户得分' in staff_data else 0,
+                '综合得分': staff_data['综合得分'] if '综合得分' in staff_data else 0,
+                '分销均季度': staff_data['分销均季度'] if '分销均季度' in staff_data else 0,
+                '条盒均季度': staff_data['条盒均季度'] if '条盒均季度' in staff_data else 0,
+            }
+            
+            tips = get_grade_improvement_tips(current_scores, target_grade)
+            
+            st.markdown('<div class="tip-card">', unsafe_allow_html=True)
+            st.markdown("### 🎯 提升档位建议")
+            for tip in tips:
+                st.write(f"• {tip}")
+            st.markdown('</div>', unsafe_allow_html=True)
+        else:
+            st.success("✅ 恭喜！您已达到或超过目标档位，继续保持！")
+
+@session_fragment
+def render_monthly_form():
+    """实时数据填报（独立片段，填写时只重跑本区域）"""
+    staff_data = get_staff_data(st.session_state.user_name)
     if staff_data is None:
-        st.error("未找到您的数据")
         return
+    st.subheader(f"📅 {st.session_state.current_quarter} 实时数据填报")
     
-    # 创建标签页
-    tab1, tab2, tab3, tab4 = st.tabs(["📊 季度绩效", "📝 实时数据填报", "🧮 得分计算器", "📈 历史季度"])
+    # 获取季度月份
+    quarter_months = get_quarter_months(st.session_state.current_quarter)
     
-    with tab1:
-        # 档位提醒
-        if '档位提醒级别' in staff_data and '档位提醒信息' in staff_data:
-            st.markdown(f'<div class="{staff_data["档位提醒级别"]}-card">{staff_data["档位提醒信息"]}</div>', unsafe_allow_html=True)
-        
-        # 季度绩效总览
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            st.metric("季度总分", f"{staff_data['总分']}分" if '总分' in staff_data else "0分")
-        with col2:
-            if '档位' in staff_data and '季度目标档位' in staff_data:
-                current_grade = staff_data['档位']
-                target_grade = staff_data['季度目标档位']
-                color = "#10b981" if current_grade <= target_grade else "#ef4444"
-                st.markdown(f"""
-                <div style="text-align: center;">
-                    <div style="font-size: 0.9rem; color: #666;">季度档位</div>
-                    <div style="font-size: 2rem; font-weight: bold; color: {color};">{current_grade}档</div>
-                    <div style="font-size: 0.8rem; color: #666;">目标：{target_grade}档</div>
-                </div>
-                """, unsafe_allow_html=True)
-        with col3:
-            st.metric("季度月薪", f"¥{staff_data['预估月薪']}" if '预估月薪' in staff_data else "¥0")
-        with col4:
-            st.metric("所属地市", staff_data['地市'])
+    # 获取当前数据
+    dist_values = []
+    recycle_values = []
+    
+    for month in quarter_months:
+        month_num = int(month.replace('月', ''))
+        dist_col = f'分销_{month_num}月'
+        recycle_col = f'条盒_{month_num}月'
         
-        st.divider()
+        dist_values.append(staff_data[dist_col] if dist_col in staff_data else 0)
+        recycle_values.append(staff_data[recycle_col] if recycle_col in staff_data else 0)
+    
+    core_customers = staff_data['核心户数'] if '核心户数' in staff_data else 0
+    target_grade = staff_data['季度目标档位'] if '季度目标档位' in staff_data else 6
+    comp_score = staff_data['综合评分'] if '综合评分' in staff_data else 0
+    
+    # 实时计算当前得分
+    current_score = calculate_realtime_score_for_staff(
+        dist_values, recycle_values, core_customers, comp_score,
+        st.session_state.current_quarter, target_grade
+    )
+    
+    # 显示实时评分卡片
+    st.markdown('<div class="real-time-score">', unsafe_allow_html=True)
+    st.subheader("🎯 实时评分预览")
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("预估总分", f"{current_score['总分']}分")
+    with col2:
+        color = "#10b981" if current_score['档位'] <= target_grade else "#ef4444"
+        st.markdown(f"""
+        <div style="text-align: center;">
+            <div style="font-size: 0.9rem; color: #666;">预估档位</div>
+            <div style="font-size: 2rem; font-weight: bold; color: {color};">{current_score['档位']}档</div>
+            <div style="font-size: 0.8rem; color: #666;">目标：{target_grade}档</div>
+        </div>
+        """, unsafe_allow_html=True)
+    with col3:
+        st.metric("预估月薪", f"¥{current_score['预估月薪']}")
+    
+    # 显示各项得分详情
+    st.markdown("##### 各项得分详情")
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("分销得分", f"{current_score['分销得分']}/25")
+        st.caption(f"均季度: {current_score['分销均季度']}条")
+    with col2:
+        st.metric("条盒回收得分", f"{current_score['条盒回收得分']}/35")
+        st.caption(f"均季度: {current_score['条盒均季度']}条")
+    with col3:
+        st.metric("核心户得分", f"{current_score['核心户得分']}/20")
+        st.caption(f"核心户数: {core_customers}人")
+    with col4:
+        st.metric("综合得分", f"{current_score['综合得分']}/20")
+        st.caption("地市经理评分")
+    
+    st.markdown('</div>', unsafe_allow_html=True)
+    
+    # 数据填报表单
+    with st.form("monthly_data_form", clear_on_submit=False):
+        st.markdown("### 分销数据填报（单位：条）")
         
-        # 得分详情
-        st.subheader("📈 季度得分详情")
+        cols = st.columns(len(quarter_months))
+        new_dist_values = []
         
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            dist_score = staff_data['分销得分'] if '分销得分' in staff_data else 0
-            dist_avg = staff_data['分销均季度'] if '分销均季度' in staff_data else 0
-            st.metric("分销得分", f"{dist_score}/25")
-            st.caption(f"均季度: {dist_avg}条")
-        with col2:
-            recycle_score = staff_data['条盒回收得分'] if '条盒回收得分' in staff_data else 0
-            recycle_avg = staff_data['条盒均季度'] if '条盒均季度' in staff_data else 0
-            st.metric("条盒回收得分", f"{recycle_score}/35")
-            st.caption(f"均季度: {recycle_avg}条")
-        with col3:
-            core_score = staff_data['核心户得分'] if '核心户得分' in staff_data else 0
-            core_count = staff_data['核心户数'] if '核心户数' in staff_data else 0
-            st.metric("核心户得分", f"{core_score}/20")
-            st.caption(f"核心户数: {core_count}人")
-        with col4:
-            comp_score = staff_data['综合得分'] if '综合得分' in staff_data else 0
-            st.metric("综合得分", f"{comp_score}/20")
-            st.caption("地市经理评分")
+        for i, month in enumerate(quarter_months):
+            with cols[i]:
+                # 获取月份数字
+                month_num = int(month.replace('月', ''))
+                
+                value = st.number_input(f"{month}分销", 
+                                      min_value=0, 
+                                      value=int(dist_values[i]),
+                                      key=f"dist_{st.session_state.user_name}_{month_num}")
+                new_dist_values.append(value)
         
-        # 显示当前填报的数据
-        st.divider()
-        st.subheader("📋 当前填报数据")
+        st.markdown("### 条盒回收数据填报（单位：条）")
         
-        quarter_months = get_quarter_months(st.session_state.current_quarter)
-        col_count = len(quarter_months)
+        cols = st.columns(len(quarter_months))
+        new_recycle_values = []
         
-        if col_count > 0:
-            cols = st.columns(col_count)
+        for i, month in enumerate(quarter_months):
+            with cols[i]:
+                # 获取月份数字
+                month_num = int(month.replace('月', ''))
+                
+                value = st.number_input(f"{month}回收", 
+                                      min_value=0, 
+                                      value=int(recycle_values[i]),
+                                      key=f"recycle_{st.session_state.user_name}_{month_num}")
+                new_recycle_values.append(value)
+        
+        # 核心户数
+        new_core_customers = st.number_input("本季度核心户数", 
+                                           min_value=0, 
+                                           value=int(core_customers),
+                                           key=f"core_{st.session_state.user_name}")
+        
+        submitted = st.form_submit_button("保存季度数据", type="primary")
+        
+        if submitted:
+            # 准备更新数据
+            updates = {}
+            
+            # 添加月度数据更新
             for i, month in enumerate(quarter_months):
-                with cols[i]:
-                    month_num = int(month.replace('月', ''))
-                    dist_col = f'分销_{month_num}月'
-                    recycle_col = f'条盒_{month_num}月'
-                    
-                    dist_value = staff_data[dist_col] if dist_col in staff_data else 0
-                    recycle_value = staff_data[recycle_col] if recycle_col in staff_data else 0
-                    
-                    st.metric(f"{month}分销", f"{dist_value}条")
-                    st.metric(f"{month}回收", f"{recycle_value}条")
-        
-        # 改进建议和提升档位提示
-        st.divider()
-        st.subheader("💡 提升建议")
-        
-        if '档位' in staff_data and '季度目标档位' in staff_data:
-            current_grade = staff_data['档位']
-            target_grade = staff_data['季度目标档位']
+                month_num = int(month.replace('月', ''))
+                dist_col = f'分销_{month_num}月'
+                recycle_col = f'条盒_{month_num}月'
+                
+                updates[dist_col] = new_dist_values[i]
+                updates[recycle_col] = new_recycle_values[i]
             
-            if current_grade > target_grade:
-                current_scores = {
-                    '总分': staff_data['总分'] if '总分' in staff_data else 0,
-                    '分销得分': staff_data['分销得分'] if '分销得分' in staff_data else 0,
-                    '条盒回收得分': staff_data['条盒回收得分'] if '条盒回收得分' in staff_data else 0,
-                    '核心户得分': staff_data['核心户得分'] if '核心户得分' in staff_data else 0,
-                    '综合得分': staff_data['综合得分'] if '综合得分' in staff_data else 0,
-                    '分销均季度': staff_data['分销均季度'] if '分销均季度' in staff_data else 0,
-                    '条盒均季度': staff_data['条盒均季度'] if '条盒均季度' in staff_data else 0,
-                }
+            # 添加核心户数更新
+            updates['核心户数'] = new_core_customers
+            
+            # 执行更新
+            success = update_staff_data(st.session_state.user_name, updates)
+            
+            if success:
+                st.success("✅ 季度数据保存成功！")
+                st.info("💾 数据已保存到本地文件，地市经理和管理员可以立即查看。")
                 
-                tips = get_grade_improvement_tips(current_scores, target_grade)
+                # 显示保存的数据
+                with st.expander("查看保存的数据详情", expanded=True):
+                    for i, month in enumerate(quarter_months):
+                        st.write(f"{month}: 分销 {new_dist_values[i]}条, 回收 {new_recycle_values[i]}条")
+                    st.write(f"核心户数: {new_core_customers}人")
                 
-                st.markdown('<div class="tip-card">', unsafe_allow_html=True)
-                st.markdown("### 🎯 提升档位建议")
-                for tip in tips:
-                    st.write(f"• {tip}")
-                st.markdown('</div>', unsafe_allow_html=True)
+                # 自动刷新页面
+                st.rerun()
             else:
-                st.success("✅ 恭喜！您已达到或超过目标档位，继续保持！")
+                st.error("❌ 保存数据失败，请重试")
+
+@session_fragment
+def render_score_calculator():
+    """得分与工资计算器（独立片段，拖动滑块时只重跑本区域）"""
+    st.subheader("🧮 得分与工资计算器")
     
-    with tab2:
-        st.subheader(f"📅 {st.session_state.current_quarter} 实时数据填报")
-        
-        # 获取季度月份
-        quarter_months = get_quarter_months(st.session_state.current_quarter)
-        
-        # 获取当前数据
-        dist_values = []
-        recycle_values = []
-        
-        for month in quarter_months:
-            month_num = int(month.replace('月', ''))
-            dist_col = f'分销_{month_num}月'
-            recycle_col = f'条盒_{month_num}月'
-            
-            dist_values.append(staff_data[dist_col] if dist_col in staff_data else 0)
-            recycle_values.append(staff_data[recycle_col] if recycle_col in staff_data else 0)
-        
-        core_customers = staff_data['核心户数'] if '核心户数' in staff_data else 0
-        target_grade = staff_data['季度目标档位'] if '季度目标档位' in staff_data else 6
-        comp_score = staff_data['综合评分'] if '综合评分' in staff_data else 0
-        
-        # 实时计算当前得分
-        current_score = calculate_realtime_score_for_staff(
-            dist_values, recycle_values, core_customers, comp_score,
-            st.session_state.current_quarter, target_grade
-        )
-        
-        # 显示实时评分卡片
-        st.markdown('<div class="real-time-score">', unsafe_allow_html=True)
-        st.subheader("🎯 实时评分预览")
-        
-        col1, col2, col3 = st.columns(3)
+    with st.container():
+        col1, col2 = st.columns(2)
         with col1:
-            st.metric("预估总分", f"{current_score['总分']}分")
+            st.markdown("### 输入模拟数据")
+            target_grade = st.selectbox("目标档位", list(range(1, 11)), index=5, key="calc_target_grade")
+            dist_q = st.number_input("分销季度总量（条）", min_value=0, value=900, key="calc_dist_q")
+            recycle_q = st.number_input("条盒回收季度总量（条）", min_value=0, value=1200, key="calc_recycle_q")
+            core_customers = st.number_input("核心户数", min_value=0, value=28, key="calc_core_customers")
+            comp_score = st.slider("综合评分（0-20）", 0, 20, 16, key="calc_comp_score")
+        
         with col2:
-            color = "#10b981" if current_score['档位'] <= target_grade else "#ef4444"
+            # 计算得分
+            dist_score = calculate_distribution_score(dist_q)
+            recycle_score = calculate_recycling_score(recycle_q)
+            core_score = calculate_core_customer_score(core_customers)
+            total_score = dist_score + recycle_score + core_score + comp_score
+            grade, salary = calculate_salary_grade(total_score)
+            
+            # 检查档位
+            warning_level, warning_msg = check_grade_warning(grade, target_grade)
+            
             st.markdown(f"""
-            <div style="text-align: center;">
-                <div style="font-size: 0.9rem; color: #666;">预估档位</div>
-                <div style="font-size: 2rem; font-weight: bold; color: {color};">{current_score['档位']}档</div>
-                <div style="font-size: 0.8rem; color: #666;">目标：{target_grade}档</div>
+            <div class="{warning_level}-card">
+                <h4>{warning_msg}</h4>
+            </div>
+            <div class="data-card" style="margin-top: 1rem;">
+                <h4>各项得分：</h4>
+                <p>📦 分销得分：<b>{dist_score}/25</b></p>
+                <p>📊 条盒回收得分：<b>{recycle_score}/35</b></p>
+                <p>👥 核心户得分：<b>{core_score}/20</b></p>
+                <p>⭐ 综合得分：<b>{comp_score}/20</b></p>
+                <hr>
+                <h3>总分：<span style="color:#4f46e5">{total_score}分</span></h3>
+                <h4>档位：{grade}档 (目标：{target_grade}档)</h4>
+                <h2>预估季度月薪：<span style="color:#10b981">¥{salary}</span></h2>
             </div>
             """, unsafe_allow_html=True)
-        with col3:
-            st.metric("预估月薪", f"¥{current_score['预估月薪']}")
-        
-        # 显示各项得分详情
-        st.markdown("##### 各项得分详情")
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            st.metric("分销得分", f"{current_score['分销得分']}/25")
-            st.caption(f"均季度: {current_score['分销均季度']}条")
-        with col2:
-            st.metric("条盒回收得分", f"{current_score['条盒回收得分']}/35")
-            st.caption(f"均季度: {current_score['条盒均季度']}条")
-        with col3:
-            st.metric("核心户得分", f"{current_score['核心户得分']}/20")
-            st.caption(f"核心户数: {core_customers}人")
-        with col4:
-            st.metric("综合得分", f"{current_score['综合得分']}/20")
-            st.caption("地市经理评分")
-        
-        st.markdown('</div>', unsafe_allow_html=True)
+
+@session_fragment
+def render_staff_history():
+    """历史季度查询（独立片段）"""
+    st.subheader("📈 历史季度数据")
+    
+    quarters = history_quarters()
+    if quarters:
+        selected_quarter = st.selectbox("选择历史季度查看", quarters, key="history_quarter_select")
         
-        # 数据填报表单
-        with st.form("monthly_data_form", clear_on_submit=False):
-            st.markdown("### 分销数据填报（单位：条）")
-            
-            cols = st.columns(len(quarter_months))
-            new_dist_values = []
-            
-            for i, month in enumerate(quarter_months):
-                with cols[i]:
-                    # 获取月份数字
-                    month_num = int(month.replace('月', ''))
-                    
-                    value = st.number_input(f"{month}分销", 
-                                          min_value=0, 
-                                          value=int(dist_values[i]),
-                                          key=f"dist_{st.session_state.user_name}_{month_num}")
-                    new_dist_values.append(value)
-            
-            st.markdown("### 条盒回收数据填报（单位：条）")
-            
-            cols = st.columns(len(quarter_months))
-            new_recycle_values = []
-            
-            for i, month in enumerate(quarter_months):
-                with cols[i]:
-                    # 获取月份数字
-                    month_num = int(month.replace('月', ''))
-                    
-                    value = st.number_input(f"{month}回收", 
-                                          min_value=0, 
-                                          value=int(recycle_values[i]),
-                                          key=f"recycle_{st.session_state.user_name}_{month_num}")
-                    new_recycle_values.append(value)
-            
-            # 核心户数
-            new_core_customers = st.number_input("本季度核心户数", 
-                                               min_value=0, 
-                                               value=int(core_customers),
-                                               key=f"core_{st.session_state.user_name}")
-            
-            submitted = st.form_submit_button("保存季度数据", type="primary")
-            
-            if submitted:
-                # 准备更新数据
-                updates = {}
-                
-                # 添加月度数据更新
-                for i, month in enumerate(quarter_months):
-                    month_num = int(month.replace('月', ''))
-                    dist_col = f'分销_{month_num}月'
-                    recycle_col = f'条盒_{month_num}月'
-                    
-                    updates[dist_col] = new_dist_values[i]
-                    updates[recycle_col] = new_recycle_values[i]
-                
-                # 添加核心户数更新
-                updates['核心户数'] = new_core_customers
-                
-                # 执行更新
-                success = update_staff_data(st.session_state.user_name, updates)
+        if selected_quarter in quarters:
+            hist_row = history_staff_row(selected_quarter, st.session_state.user_name)
+
+            if hist_row is not None:
+
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.metric(f"{selected_quarter}总分", f"{hist_row['总分']}分")
+                with col2:
+                    st.metric(f"{selected_quarter}档位", f"{hist_row['档位']}档")
+                with col3:
+                    st.metric(f"{selected_quarter}月薪", f"¥{hist_row['预估月薪']}")
                 
-                if success:
-                    st.success("✅ 季度数据保存成功！")
-                    st.info("💾 数据已保存到本地文件，地市经理和管理员可以立即查看。")
-                    
-                    # 显示保存的数据
-                    with st.expander("查看保存的数据详情", expanded=True):
-                        for i, month in enumerate(quarter_months):
-                            st.write(f"{month}: 分销 {new_dist_values[i]}条, 回收 {new_recycle_values[i]}条")
-                        st.write(f"核心户数: {new_core_customers}人")
-                    
-                    # 自动刷新页面
-                    st.rerun()
-                else:
-                    st.error("❌ 保存数据失败，请重试")
-    
-    with tab3:
-        st.subheader("🧮 得分与工资计算器")
+                # 显示详细得分
+                st.markdown("### 详细得分")
+                col1, col2, col3, col4 = st.columns(4)
+                with col1:
+                    st.metric("分销得分", f"{hist_row['分销得分']}/25")
+                with col2:
+                    st.metric("条盒回收得分", f"{hist_row['条盒回收得分']}/35")
+                with col3:
+                    st.metric("核心户得分", f"{hist_row['核心户得分']}/20")
+                with col4:
+                    st.metric("综合得分", f"{hist_row['综合得分']}/20")
+            else:
+                st.info(f"{selected_quarter}没有您的历史数据")
         
-        with st.container():
+        # 历年总分趋势
+        trend = staff_score_trend(st.session_state.user_name)
+        if len(trend) > 1:
+            st.plotly_chart(build_score_trend_figure(trend), use_container_width=True)
+    else:
+        st.info("暂无历史季度数据")
+
+def staff_dashboard():
+    st.markdown(f'<h2 class="main-header">👤 {st.session_state.user_name} 的个人中心</h2>', unsafe_allow_html=True)
+    
+    # 获取用户数据
+    staff_data = get_staff_data(st.session_state.user_name)
+    
+    if staff_data is None:
+        st.error("未找到您的数据")
+        return
+    
+    # 创建标签页
+    tab1, tab2, tab3, tab4 = st.tabs(["📊 季度绩效", "📝 实时数据填报", "🧮 得分计算器", "📈 历史季度"])
+    
+    with tab1, timed('页面:事务员/季度绩效'):
+        render_staff_overview(staff_data)
+
+    with tab2, timed('页面:事务员/实时数据填报'):
+        render_monthly_form()
+
+    with tab3, timed('页面:事务员/得分计算器'):
+        render_score_calculator()
+
+    with tab4, timed('页面:事务员/历史季度'):
+        render_staff_history()
+
+# ========== 地市经理页面 ==========
+@session_fragment
+def render_manager_staff_editor(managed_city):
+    """事务员列表与数据编辑（独立片段，分页显示）"""
+    st.subheader(f"{managed_city}地区事务员列表")
+    
+    # 检索与分页设置
+    col1, col2, col3, col4 = st.columns([3, 2, 1, 1])
+    with col1:
+        search_prefix = st.text_input("按姓名搜索", placeholder="输入姓名开头的字", key="manager_search")
+    with col2:
+        sort_label = st.selectbox("排序方式", list(SORT_OPTIONS.keys()), key="manager_sort")
+    with col3:
+        page_size = st.selectbox("每页人数", PAGE_SIZE_OPTIONS, index=1, key="manager_page_size")
+    with col4:
+        anomaly_only = st.checkbox("只看异常", key="manager_anomaly_only")
+    
+    # 在索引上完成筛选和排序，只取出当前页的数据
+    index = session_data_index()
+    mask = None
+    if anomaly_only:
+        flags = refresh_anomaly_flags()
+        mask = flags['异常数'].to_numpy() > 0
+    sort_by, ascending = SORT_OPTIONS[sort_label]
+    positions = query_data_index(index, managed_city, search_prefix, sort_by, ascending, mask)
+    
+    page = render_pager(len(positions), page_size, key=f"manager_page_{search_prefix}_{sort_label}_{page_size}_{anomaly_only}")
+    current_city_data = load_page(
+        st.session_state.performance_data, positions, page, page_size,
+        st.session_state.current_quarter
+    )
+    current_city_data = attach_anomaly_flags(current_city_data)
+    
+    if current_city_data.empty:
+        st.info("没有符合条件的事务员")
+        return
+    
+    # 显示具体的事务员数据
+    month_range = get_current_quarter_month_range()
+    for idx, row in current_city_data.iterrows():
+        with st.expander(f"{row['事务员']} - 当前数据", expanded=False):
             col1, col2 = st.columns(2)
+            
             with col1:
-                st.markdown("### 输入模拟数据")
-                target_grade = st.selectbox("目标档位", list(range(1, 11)), index=5, key="calc_target_grade")
-                dist_q = st.number_input("分销季度总量（条）", min_value=0, value=900, key="calc_dist_q")
-                recycle_q = st.number_input("条盒回收季度总量（条）", min_value=0, value=1200, key="calc_recycle_q")
-                core_customers = st.number_input("核心户数", min_value=0, value=28, key="calc_core_customers")
-                comp_score = st.slider("综合评分（0-20）", 0, 20, 16, key="calc_comp_score")
+                st.write("**分销数据：**")
+                for month_num in month_range:
+                    dist_col = f'分销_{month_num}月'
+                    if dist_col in row:
+                        st.write(f"{month_num}月: {row[dist_col]}条")
             
             with col2:
-                # 计算得分
-                dist_score = calculate_distribution_score(dist_q)
-                recycle_score = calculate_recycling_score(recycle_q)
-                core_score = calculate_core_customer_score(core_customers)
-                total_score = dist_score + recycle_score + core_score + comp_score
-                grade, salary = calculate_salary_grade(total_score)
-                
-                # 检查档位
-                warning_level, warning_msg = check_grade_warning(grade, target_grade)
-                
-                st.markdown(f"""
-                <div class="{warning_level}-card">
-                    <h4>{warning_msg}</h4>
-                </div>
-                <div class="data-card" style="margin-top: 1rem;">
-                    <h4>各项得分：</h4>
-                    <p>📦 分销得分：<b>{dist_score}/25</b></p>
-                    <p>📊 条盒回收得分：<b>{recycle_score}/35</b></p>
-                    <p>👥 核心户得分：<b>{core_score}/20</b></p>
-                    <p>⭐ 综合得分：<b>{comp_score}/20</b></p>
-                    <hr>
-                    <h3>总分：<span style="color:#4f46e5">{total_score}分</span></h3>
-                    <h4>档位：{grade}档 (目标：{target_grade}档)</h4>
-                    <h2>预估季度月薪：<span style="color:#10b981">¥{salary}</span></h2>
-                </div>
-                """, unsafe_allow_html=True)
-    
-    with tab4:
-        st.subheader("📈 历史季度数据")
-        
-        if st.session_state.quarter_history:
-            quarters = list(st.session_state.quarter_history.keys())
-            if quarters:
-                selected_quarter = st.selectbox("选择历史季度查看", quarters, key="history_quarter_select")
+                st.write("**条盒回收数据：**")
+                for month_num in month_range:
+                    recycle_col = f'条盒_{month_num}月'
+                    if recycle_col in row:
+                        st.write(f"{month_num}月: {row[recycle_col]}条")
+            
+            st.write(f"**核心户数：** {row['核心户数'] if '核心户数' in row else 0}人")
+            st.write(f"**综合评分：** {row['综合评分'] if '综合评分' in row else 0}分")
+            st.write(f"**目标档位：** {row['季度目标档位'] if '季度目标档位' in row else 6}档")
+    
+    # 数据编辑界面
+    st.subheader("编辑事务员数据")
+    show_anomaly_summary(current_city_data)
+    
+    editable_fields = ['综合评分', '季度目标档位', '核心户数'] + get_current_quarter_month_columns()
+    editor_key = f"manager_editor_{search_prefix}_{sort_label}_{page_size}_{anomaly_only}_{page}"
+    st.data_editor(
+        current_city_data,
+        column_config={
+            '综合评分': st.column_config.NumberColumn(
+                "综合评分（0-20）",
+                min_value=0,
+                max_value=20,
+                step=1,
+                help="地市经理对事务员的综合表现评分"
+            ),
+            '季度目标档位': st.column_config.NumberColumn(
+                "目标档位",
+                min_value=1,
+                max_value=10,
+                step=1,
+                help="为该事务员设定的季度目标档位"
+            ),
+            '核心户数': st.column_config.NumberColumn(
+                "核心户数",
+                min_value=0,
+                step=1,
+                help="事务员的核心客户数量"
+            ),
+            '异常提示': st.column_config.TextColumn(
+                "异常提示",
+                disabled=True,
+                help="系统自动检测的疑似异常填报"
+            )
+        },
+        disabled=[col for col in current_city_data.columns if col not in editable_fields],
+        use_container_width=True,
+        height=400,
+        key=editor_key
+    )
+    
+    # 只读取编辑器记录的修改
+    pending_updates = collect_editor_updates(editor_key, current_city_data, editable_fields)
+    
+    if pending_updates:
+        st.markdown(f'<div class="data-changed">📝 检测到{len(pending_updates)}位事务员的数据修改，请保存以应用更改</div>', unsafe_allow_html=True)
+    
+    if st.button("保存修改", type="primary", use_container_width=True, key="save_manager_changes_btn"):
+        # 按事务员批量写入：一次重新计算、一次保存
+        success_count = batch_update_staff_data(pending_updates, operation='地市经理修改')
+        
+        st.success(f"✅ {managed_city}地区数据保存成功！共更新{success_count}位事务员")
+        st.info("💾 数据已保存到本地文件")
+        st.rerun()
+
+@session_fragment
+def render_city_analysis(managed_city):
+    """地区绩效分析图表（独立片段）"""
+    city_data = get_city_rows(managed_city)
+    st.subheader(f"{managed_city}地区绩效分析")
+    
+    # 确保数据包含必要的列
+    if '总分' in city_data.columns:
+        # 总体统计
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            avg_score = city_data['总分'].mean()
+            st.metric("平均总分", f"{avg_score:.1f}分")
+        with col2:
+            if '档位' in city_data.columns:
+                avg_grade = city_data['档位'].mean()
+                st.metric("平均档位", f"{avg_grade:.1f}档")
+            else:
+                st.metric("平均档位", "0档")
+        with col3:
+            if '是否达标' in city_data.columns:
+                da_biao_lv = city_data['是否达标'].mean() * 100
+                st.metric("达标率", f"{da_biao_lv:.1f}%")
+            else:
+                st.metric("达标率", "0%")
+        
+        # 档位分布
+        if '档位' in city_data.columns:
+            st.subheader("档位分布")
+            grade_dist = cached_grade_distribution(
+                st.session_state.data_version,
+                managed_city,
+                st.session_state.performance_data
+            )
+            
+            if not grade_dist.empty:
+                col1, col2 = st.columns(2)
+                with col1:
+                    render_cached_chart(
+                        'manager_grade_bar', managed_city,
+                        lambda: build_grade_bar_figure(grade_dist, '档位分布', 'Viridis')
+                    )
                 
-                if selected_quarter in st.session_state.quarter_history:
-                    history_data = pd.DataFrame(st.session_state.quarter_history[selected_quarter])
-                    user_history = history_data[history_data['事务员'] == st.session_state.user_name]
-                    
-                    if not user_history.empty:
-                        hist_row = user_history.iloc[0]
-                        
-                        col1, col2, col3 = st.columns(3)
-                        with col1:
-                            st.metric(f"{selected_quarter}总分", f"{hist_row['总分']}分")
-                        with col2:
-                            st.metric(f"{selected_quarter}档位", f"{hist_row['档位']}档")
-                        with col3:
-                            st.metric(f"{selected_quarter}月薪", f"¥{hist_row['预估月薪']}")
-                        
-                        # 显示详细得分
-                        st.markdown("### 详细得分")
-                        col1, col2, col3, col4 = st.columns(4)
-                        with col1:
-                            st.metric("分销得分", f"{hist_row['分销得分']}/25")
-                        with col2:
-                            st.metric("条盒回收得分", f"{hist_row['条盒回收得分']}/35")
-                        with col3:
-                            st.metric("核心户得分", f"{hist_row['核心户得分']}/20")
-                        with col4:
-                            st.metric("综合得分", f"{hist_row['综合得分']}/20")
-                    else:
-                        st.info(f"{selected_quarter}没有您的历史数据")
+                with col2:
+                    render_cached_chart(
+                        'manager_grade_pie', managed_city,
+                        lambda: build_grade_pie_figure(grade_dist, '档位占比')
+                    )
             else:
-                st.info("暂无历史季度数据")
+                st.info("暂无档位分布数据")
+        
+        # 绩效排名
+        st.subheader("事务员绩效排名")
+        if '总分' in city_data.columns and '事务员' in city_data.columns:
+            ranking_data = city_data[['事务员', '总分', '档位', '预估月薪']].sort_values('总分', ascending=False)
+            st.dataframe(ranking_data.reset_index(drop=True), use_container_width=True)
         else:
-            st.info("暂无历史季度数据")
+            st.info("暂无绩效排名数据")
+    else:
+        st.info("暂无地区分析数据")
+
+@session_fragment
+def render_manager_batch_ops(managed_city):
+    """批量绩效操作（独立片段）"""
+    city_data = get_city_rows(managed_city)
+    st.subheader("批量绩效操作")
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.markdown("### 批量设置目标档位")
+        new_target_grade = st.slider("统一目标档位", 1, 10, 6, key="batch_target_grade")
+        
+        if st.button("批量设置目标档位", use_container_width=True, key="set_batch_target_btn"):
+            # 准备批量更新并一次写入
+            updates_by_staff = {
+                staff_name: {'季度目标档位': new_target_grade}
+                for staff_name in city_data['事务员']
+            }
+            success_count = batch_update_staff_data(updates_by_staff, operation='批量设置目标档位')
+            
+            st.success(f"✅ 已为{success_count}位事务员设置目标档位为{new_target_grade}档")
+            st.rerun()
+    
+    with col2:
+        st.markdown("### 批量重置综合评分")
+        reset_score = st.slider("重置为", 0, 20, 10, key="reset_score_slider")
+        
+        if st.button("批量重置综合评分", use_container_width=True, key="reset_scores_btn"):
+            # 准备批量更新并一次写入
+            updates_by_staff = {
+                staff_name: {'综合评分': reset_score}
+                for staff_name in city_data['事务员']
+            }
+            success_count = batch_update_staff_data(updates_by_staff, operation='批量重置综合评分')
+            
+            st.success(f"✅ 已重置{success_count}位事务员的综合评分为{reset_score}分")
+            st.rerun()
+    
+    # 导出地区数据
+    st.divider()
+    st.markdown("### 导出地区数据")
+    
+    csv_data = cached_csv_export(
+        st.session_state.data_version,
+        managed_city,
+        st.session_state.performance_data
+    )
+    st.download_button(
+        label=f"📥 下载{managed_city}地区数据",
+        data=csv_data,
+        file_name=f"{managed_city}_绩效数据_{st.session_state.current_quarter}.csv",
+        mime="text/csv",
+        use_container_width=True,
+        key="export_city_data_btn"
+    )
 
-# ========== 地市经理页面 ==========
 def manager_dashboard():
     st.markdown(f'<h2 class="main-header">📊 {st.session_state.user_name} - 地市经理管理</h2>', unsafe_allow_html=True)
     
+    # 其他用户保存后自动刷新
+    render_live_sync()
+    
     # 获取地市经理管理的地市
     managed_city = st.session_state.current_city
     
     # 获取该地市的数据
-    city_data = st.session_state.performance_data[
-        st.session_state.performance_data['地市'] == managed_city
-    ]
+    city_data = get_city_rows(managed_city)
     
     if city_data.empty:
         st.warning(f"没有找到{managed_city}的数据")
@@ -1304,477 +2163,477 @@ def manager_dashboard():
     st.info(f"✅ 数据已从本地文件加载，以下是事务员填报的最新数据")
     
     # 创建标签页
-    tab1, tab2, tab3 = st.tabs(["👥 事务员管理", "📊 地区分析", "📈 绩效考核"])
+    tab1, tab2, tab3, tab4 = st.tabs(["👥 事务员管理", "📊 地区分析", "📈 绩效考核", "🕒 历史时点"])
     
-    with tab1:
-        st.subheader(f"{managed_city}地区事务员列表")
-        
-        # 获取当前季度数据
-        current_city_data = get_current_quarter_data(city_data, st.session_state.current_quarter)
-        
-        # 显示具体的事务员数据
-        for idx, row in current_city_data.iterrows():
-            with st.expander(f"{row['事务员']} - 当前数据", expanded=False):
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    st.write("**分销数据：**")
-                    month_range = get_current_quarter_month_range()
-                    for month_num in month_range:
-                        dist_col = f'分销_{month_num}月'
-                        if dist_col in row:
-                            st.write(f"{month_num}月: {row[dist_col]}条")
-                
-                with col2:
-                    st.write("**条盒回收数据：**")
-                    for month_num in month_range:
-                        recycle_col = f'条盒_{month_num}月'
-                        if recycle_col in row:
-                            st.write(f"{month_num}月: {row[recycle_col]}条")
-                
-                st.write(f"**核心户数：** {row['核心户数'] if '核心户数' in row else 0}人")
-                st.write(f"**综合评分：** {row['综合评分'] if '综合评分' in row else 0}分")
-                st.write(f"**目标档位：** {row['季度目标档位'] if '季度目标档位' in row else 6}档")
-        
-        # 数据编辑界面
-        st.subheader("编辑事务员数据")
-        
-        edited_df = st.data_editor(
-            current_city_data,
-            column_config={
-                '综合评分': st.column_config.NumberColumn(
-                    "综合评分（0-20）",
-                    min_value=0,
-                    max_value=20,
-                    step=1,
-                    help="地市经理对事务员的综合表现评分"
-                ),
-                '季度目标档位': st.column_config.NumberColumn(
-                    "目标档位",
-                    min_value=1,
-                    max_value=10,
-                    step=1,
-                    help="为该事务员设定的季度目标档位"
-                ),
-                '核心户数': st.column_config.NumberColumn(
-                    "核心户数",
-                    min_value=0,
-                    step=1,
-                    help="事务员的核心客户数量"
-                )
-            },
-            use_container_width=True,
-            height=400,
-            key="manager_editor"
+    with tab1, timed('页面:地市经理/事务员管理'):
+        render_manager_staff_editor(managed_city)
+
+    with tab2, timed('页面:地市经理/地区分析'):
+        render_city_analysis(managed_city)
+
+    with tab3, timed('页面:地市经理/绩效考核'):
+        render_manager_batch_ops(managed_city)
+    
+    with tab4, timed('页面:地市经理/历史时点'):
+        render_as_of_view([managed_city], "manager")
+
+# ========== 管理员页面 ==========
+@session_fragment
+def render_admin_data_editor():
+    """全员数据管理（独立片段，服务端筛选分页）"""
+    st.subheader("全员数据管理")
+    
+    # 显示筛选选项
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        # 选择查看的地市
+        index = session_data_index()
+        all_cities = list(index['city_positions'].keys())
+        selected_city = st.selectbox(
+            "选择地市查看", 
+            ["全部"] + all_cities,
+            key="admin_city_select"
         )
-        
-        # 检查数据差异
-        data_diff = not edited_df.equals(current_city_data)
-        
-        if data_diff:
-            st.markdown('<div class="data-changed">📝 检测到数据修改，请保存以应用更改</div>', unsafe_allow_html=True)
-        
-        if st.button("保存修改", type="primary", use_container_width=True, key="save_manager_changes_btn"):
-            # 保存修改
-            for idx, row in edited_df.iterrows():
-                # 找到原始数据中的对应行
-                original_idx = city_data.index[city_data['行号'] == row['行号']].tolist()
-                if original_idx:
-                    original_idx = original_idx[0]
-                    
-                    # 准备更新数据
-                    updates = {}
-                    
-                    # 更新可编辑字段
-                    editable_fields = ['综合评分', '季度目标档位', '核心户数']
-                    for field in editable_fields:
-                        if field in row:
-                            updates[field] = row[field]
-                    
-                    # 更新月度数据
-                    month_range = get_current_quarter_month_range()
-                    for month_num in month_range:
-                        dist_col = f'分销_{month_num}月'
-                        recycle_col = f'条盒_{month_num}月'
-                        
-                        if dist_col in row:
-                            updates[dist_col] = row[dist_col]
-                        if recycle_col in row:
-                            updates[recycle_col] = row[recycle_col]
+    with col2:
+        selected_grades = st.multiselect("档位", list(range(1, 11)), key="admin_grade_filter")
+    with col3:
+        qualified_option = st.selectbox("是否达标", ["全部", "达标", "未达标"], key="admin_qualified_filter")
+    with col4:
+        search_prefix = st.text_input("按姓名搜索", placeholder="输入姓名开头的字", key="admin_search")
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        sort_label = st.selectbox("排序方式", list(SORT_OPTIONS.keys()), key="admin_sort")
+    with col2:
+        page_size = st.selectbox("每页行数", PAGE_SIZE_OPTIONS, index=2, key="admin_page_size")
+    with col3:
+        # 只显示当前季度数据
+        display_current_only = st.checkbox(
+            "只显示当前季度数据", 
+            value=True,
+            help="勾选后只显示当前季度的相关数据列",
+            key="display_current_only"
+        )
+    
+    # 在服务端完成筛选、排序和分页，只把当前页发送到浏览器
+    city_filter = None if selected_city == "全部" else selected_city
+    qualified = {"全部": None, "达标": True, "未达标": False}[qualified_option]
+    sort_by, ascending = SORT_OPTIONS[sort_label]
+    query_key = f"{selected_city}_{selected_grades}_{qualified_option}_{search_prefix}_{sort_label}_{page_size}_{display_current_only}"
+    
+    positions = query_performance_positions(
+        st.session_state.performance_data, index,
+        city_filter, selected_grades, qualified, search_prefix, sort_by, ascending
+    )
+    total = len(positions)
+    page = render_pager(total, page_size, key=f"admin_page_{query_key}")
+    display_data = load_page(
+        st.session_state.performance_data, positions, page, page_size,
+        st.session_state.current_quarter if display_current_only else None
+    )
+    
+    # 附加异常检测结果
+    display_data = attach_anomaly_flags(display_data)
+    
+    # 显示庞雷的数据示例（用于验证）
+    pang_lei_data = get_staff_data("庞雷")
+    if pang_lei_data is not None and city_filter in (None, pang_lei_data['地市']):
+        with st.expander("🔍 验证：庞雷的数据（示例）", expanded=True):
+            st.write("**当前季度数据：**")
+            quarter_months = get_quarter_months(st.session_state.current_quarter)
+            
+            cols = st.columns(len(quarter_months))
+            for i, month in enumerate(quarter_months):
+                with cols[i]:
+                    month_num = int(month.replace('月', ''))
+                    dist_col = f'分销_{month_num}月'
+                    recycle_col = f'条盒_{month_num}月'
                     
-                    # 执行更新
-                    staff_name = row['事务员']
-                    success = update_staff_data(staff_name, updates)
+                    if dist_col in pang_lei_data:
+                        st.metric(f"{month}分销", f"{pang_lei_data[dist_col]}条")
+                    if recycle_col in pang_lei_data:
+                        st.metric(f"{month}回收", f"{pang_lei_data[recycle_col]}条")
+            
+            st.write(f"**核心户数：** {pang_lei_data['核心户数'] if '核心户数' in pang_lei_data else 0}人")
+            st.write(f"**综合评分：** {pang_lei_data['综合评分'] if '综合评分' in pang_lei_data else 0}分")
+            st.write(f"**目标档位：** {pang_lei_data['季度目标档位'] if '季度目标档位' in pang_lei_data else 6}档")
+    
+    # 显示数据编辑界面
+    st.write(f"显示数据：第 {page} 页，本页 {len(display_data)} 行 / 共 {total} 行")
+    show_anomaly_summary(display_data)
+    
+    editable_fields = ['综合评分', '季度目标档位', '核心户数', '备注'] + get_current_quarter_month_columns()
+    editor_key = f"admin_editor_{query_key}_{page}"
+    st.data_editor(
+        display_data,
+        column_config={
+            '季度目标档位': st.column_config.NumberColumn(
+                "目标档位",
+                min_value=1,
+                max_value=10,
+                step=1
+            ),
+            '综合评分': st.column_config.NumberColumn(
+                "综合评分",
+                min_value=0,
+                max_value=20,
+                step=1
+            ),
+            '核心户数': st.column_config.NumberColumn(
+                "核心户数",
+                min_value=0,
+                step=1
+            ),
+            '异常提示': st.column_config.TextColumn(
+                "异常提示",
+                disabled=True
+            )
+        },
+        disabled=[col for col in display_data.columns if col not in editable_fields],
+        use_container_width=True,
+        height=500,
+        key=editor_key
+    )
+    
+    # 只读取编辑器记录的修改，不再比较整张表
+    pending_updates = collect_editor_updates(editor_key, display_data, editable_fields)
+    if pending_updates:
+        st.markdown(f'<div class="data-changed">📝 检测到{len(pending_updates)}位事务员的数据修改，请保存以应用更改</div>', unsafe_allow_html=True)
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        if st.button("保存修改", type="primary", use_container_width=True, key="save_all_changes_btn"):
+            # 按事务员批量写入：一次重新计算、一次保存
+            success_count = batch_update_staff_data(pending_updates, operation='管理员修改')
             
-            st.success(f"✅ {managed_city}地区数据保存成功！")
+            st.success(f"✅ 数据保存成功！共更新{success_count}位事务员")
             st.info("💾 数据已保存到本地文件")
             st.rerun()
     
-    with tab2:
-        st.subheader(f"{managed_city}地区绩效分析")
-        
-        # 确保数据包含必要的列
-        if '总分' in city_data.columns:
-            # 总体统计
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                avg_score = city_data['总分'].mean()
-                st.metric("平均总分", f"{avg_score:.1f}分")
-            with col2:
-                if '档位' in city_data.columns:
-                    avg_grade = city_data['档位'].mean()
-                    st.metric("平均档位", f"{avg_grade:.1f}档")
-                else:
-                    st.metric("平均档位", "0档")
-            with col3:
-                if '是否达标' in city_data.columns:
-                    da_biao_lv = city_data['是否达标'].mean() * 100
-                    st.metric("达标率", f"{da_biao_lv:.1f}%")
-                else:
-                    st.metric("达标率", "0%")
-            
-            # 档位分布
-            if '档位' in city_data.columns:
-                st.subheader("档位分布")
-                grade_dist = city_data['档位'].value_counts().sort_index()
-                
-                if not grade_dist.empty:
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        fig = px.bar(x=[f"{g}档" for g in grade_dist.index], 
-                                    y=grade_dist.values,
-                                    title='档位分布',
-                                    color=grade_dist.values,
-                                    color_continuous_scale='Viridis')
-                        fig.update_layout(xaxis_title="档位", yaxis_title="人数")
-                        st.plotly_chart(fig, use_container_width=True)
-                    
-                    with col2:
-                        fig = px.pie(values=grade_dist.values, 
-                                    names=[f"{g}档" for g in grade_dist.index],
-                                    title='档位占比')
-                        st.plotly_chart(fig, use_container_width=True)
-                else:
-                    st.info("暂无档位分布数据")
-            
-            # 绩效排名
-            st.subheader("事务员绩效排名")
-            if '总分' in city_data.columns and '事务员' in city_data.columns:
-                ranking_data = city_data[['事务员', '总分', '档位', '预估月薪']].sort_values('总分', ascending=False)
-                st.dataframe(ranking_data.reset_index(drop=True), use_container_width=True)
+    with col2:
+        if st.button("重新计算绩效", type="secondary", use_container_width=True, key="recalculate_btn"):
+            # 先读取最新数据，避免用旧数据覆盖其他用户的修改
+            load_session_data()
+            save_data(operation='重新计算绩效', df=calculate_performance(
+                st.session_state.performance_data, 
+                st.session_state.current_quarter
+            ))
+            st.success("✅ 绩效重新计算完成！")
+            st.rerun()
+    
+    with col3:
+        if st.button("备份数据", type="secondary", use_container_width=True, key="backup_btn"):
+            backup_file, success, message = backup_data()
+            if success:
+                st.success(f"✅ {message}")
             else:
-                st.info("暂无绩效排名数据")
-        else:
-            st.info("暂无地区分析数据")
+                st.error(f"❌ {message}")
+
+@session_fragment
+def render_global_analysis():
+    """全局分析图表（独立片段）"""
+    st.subheader("全局分析")
     
-    with tab3:
-        st.subheader("批量绩效操作")
-        
-        col1, col2 = st.columns(2)
-        
+    if st.session_state.performance_data is not None and not st.session_state.performance_data.empty:
+        # 总体统计
+        col1, col2, col3, col4 = st.columns(4)
         with col1:
-            st.markdown("### 批量设置目标档位")
-            new_target_grade = st.slider("统一目标档位", 1, 10, 6, key="batch_target_grade")
-            
-            if st.button("批量设置目标档位", use_container_width=True, key="set_batch_target_btn"):
-                # 准备批量更新
-                updates_list = []
-                for idx in city_data.index:
-                    staff_name = city_data.at[idx, '事务员']
-                    updates = {'季度目标档位': new_target_grade}
-                    updates_list.append((staff_name, updates))
-                
-                # 执行批量更新
-                success_count = 0
-                for staff_name, updates in updates_list:
-                    if update_staff_data(staff_name, updates):
-                        success_count += 1
-                
-                st.success(f"✅ 已为{success_count}位事务员设置目标档位为{new_target_grade}档")
-                st.rerun()
-        
+            total_staff = len(st.session_state.performance_data)
+            st.metric("事务员总数", total_staff)
         with col2:
-            st.markdown("### 批量重置综合评分")
-            reset_score = st.slider("重置为", 0, 20, 10, key="reset_score_slider")
+            if '总分' in st.session_state.performance_data.columns:
+                avg_score = st.session_state.performance_data['总分'].mean()
+                st.metric("平均总分", f"{avg_score:.1f}分")
+            else:
+                st.metric("平均总分", "0分")
+        with col3:
+            if '档位' in st.session_state.performance_data.columns:
+                avg_grade = st.session_state.performance_data['档位'].mean()
+                st.metric("平均档位", f"{avg_grade:.1f}档")
+            else:
+                st.metric("平均档位", "0档")
+        with col4:
+            if '是否达标' in st.session_state.performance_data.columns:
+                da_biao_lv = st.session_state.performance_data['是否达标'].mean() * 100
+                st.metric("整体达标率", f"{da_biao_lv:.1f}%")
+            else:
+                st.metric("整体达标率", "0%")
+        
+        # 档位分布
+        if '档位' in st.session_state.performance_data.columns:
+            st.subheader("📊 档位分布情况")
+            grade_dist = cached_grade_distribution(
+                st.session_state.data_version,
+                None,
+                st.session_state.performance_data
+            )
             
-            if st.button("批量重置综合评分", use_container_width=True, key="reset_scores_btn"):
-                # 准备批量更新
-                updates_list = []
-                for idx in city_data.index:
-                    staff_name = city_data.at[idx, '事务员']
-                    updates = {'综合评分': reset_score}
-                    updates_list.append((staff_name, updates))
+            if not grade_dist.empty:
+                col1, col2 = st.columns(2)
+                with col1:
+                    render_cached_chart(
+                        'admin_grade_pie', '全部',
+                        lambda: build_grade_pie_figure(grade_dist, '档位分布饼图')
+                    )
                 
-                # 执行批量更新
-                success_count = 0
-                for staff_name, updates in updates_list:
-                    if update_staff_data(staff_name, updates):
-                        success_count += 1
+                with col2:
+                    render_cached_chart(
+                        'admin_grade_bar', '全部',
+                        lambda: build_grade_bar_figure(grade_dist, '档位分布柱状图', 'Blues')
+                    )
+            else:
+                st.info("暂无档位分布数据")
+        
+        # 地区分析
+        if '地市' in st.session_state.performance_data.columns and '总分' in st.session_state.performance_data.columns:
+            st.subheader("🏙️ 地区绩效分析")
+            city_stats = cached_city_stats(
+                st.session_state.data_version,
+                st.session_state.performance_data
+            )
+            
+            if not city_stats.empty:
+                col1, col2 = st.columns(2)
+                with col1:
+                    render_cached_chart(
+                        'admin_city_top', '全部',
+                        lambda: build_city_top_figure(city_stats)
+                    )
                 
-                st.success(f"✅ 已重置{success_count}位事务员的综合评分为{reset_score}分")
-                st.rerun()
-        
-        # 导出地区数据
-        st.divider()
-        st.markdown("### 导出地区数据")
-        
-        csv_data = city_data.to_csv(index=False).encode('utf-8')
+                with col2:
+                    render_cached_chart(
+                        'admin_city_scatter', '全部',
+                        lambda: build_city_scatter_figure(city_stats)
+                    )
+            else:
+                st.info("暂无地区分析数据")
+    else:
+        st.info("暂无全局分析数据")
+
+@session_fragment
+def render_audit_log_viewer():
+    """操作日志查询（按地市、事务员、操作人、时间范围筛选，分页显示）"""
+    st.markdown("### 📜 操作日志")
+    audit_log = get_audit_log()
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        cities = ['全部'] + audit_log.values('c')
+        city = st.selectbox("地市", cities, key="audit_city_filter")
+    with col2:
+        staff_name = st.text_input("事务员姓名", key="audit_staff_filter").strip()
+    with col3:
+        operators = ['全部'] + audit_log.values('by')
+        operator = st.selectbox("操作人", operators, key="audit_operator_filter")
+    with col4:
+        today = datetime.now().date()
+        date_range = st.date_input(
+            "时间范围",
+            value=(today - pd.Timedelta(days=30), today),
+            key="audit_date_filter"
+        )
+    
+    start = end = None
+    if isinstance(date_range, (tuple, list)) and len(date_range) == 2:
+        start = int(datetime.combine(date_range[0], datetime.min.time()).timestamp() * 1000)
+        end = int((datetime.combine(date_range[1], datetime.min.time()) + pd.Timedelta(days=1)).timestamp() * 1000)
+    
+    page_size = st.selectbox("每页条数", PAGE_SIZE_OPTIONS, index=2, key="audit_page_size")
+    filters = dict(
+        staff=staff_name or None,
+        city=None if city == '全部' else city,
+        operator=None if operator == '全部' else operator,
+        start=start,
+        end=end
+    )
+    total, _ = audit_log.query(page_size=1, **filters)
+    page = render_pager(total, page_size, key="audit_page")
+    _, records = audit_log.query(page=page, page_size=page_size, **filters)
+    
+    if records:
+        st.dataframe(format_audit_records(records), use_container_width=True, hide_index=True)
+    else:
+        st.info("暂无符合条件的操作日志")
+        return
+    
+    # 按批次回滚（只回滚当前筛选条件内的记录）
+    with st.expander("↩️ 回滚修改", expanded=False):
+        matched = audit_log.find(**filters)
+        batches = {}
+        for record in matched:
+            batch = batches.setdefault(record['id'], {'t': record['t'], 'by': record.get('by'), 'op': record.get('op'), 'count': 0})
+            batch['count'] += 1
+        batch_ids = sorted(batches, key=lambda batch_id: batches[batch_id]['t'], reverse=True)
+        selected_batches = st.multiselect(
+            "选择要回滚的修改批次",
+            batch_ids,
+            format_func=lambda batch_id: (
+                f"{datetime.fromtimestamp(batches[batch_id]['t'] / 1000).strftime('%Y-%m-%d %H:%M:%S')} "
+                f"{batches[batch_id]['by']} {batches[batch_id]['op']}（{batches[batch_id]['count']}条）"
+            ),
+            key="rollback_batch_select"
+        )
+        if not selected_batches:
+            st.caption("可先用上方条件按操作人、事务员或时间范围筛选，再选择批次")
+            return
+        
+        chosen = set(selected_batches)
+        rollback_records = [record for record in matched if record['id'] in chosen]
+        updates, skipped = plan_rollback(rollback_records)
+        st.write(f"将恢复 **{len(updates)}** 位事务员的 **{sum(len(fields) for fields in updates.values())}** 个字段")
+        if skipped:
+            st.warning(f"以下{len(skipped)}个字段在之后又被修改过，回滚会覆盖后续工作，已跳过")
+            st.dataframe(pd.DataFrame(skipped), use_container_width=True, hide_index=True)
+        
+        if st.button("确认回滚", type="primary", disabled=not updates, key="rollback_confirm_btn"):
+            # 恢复原值后只重新计算涉及的行，每个地市只写入一次
+            restored = batch_update_staff_data(updates, operation='回滚修改')
+            st.success(f"✅ 已回滚{restored}位事务员的修改")
+            st.rerun()
+
+@session_fragment
+def render_profiling_panel():
+    """性能监控：最近各项操作的耗时分位数（本进程内所有会话）"""
+    st.markdown("### ⏱️ 性能监控")
+    recorder = get_span_recorder()
+    summary = recorder.summary()
+    st.caption(f"统计本服务进程最近{recorder.maxlen}次操作的耗时：加载、保存、绩效计算、页面渲染和导入导出")
+
+    if summary.empty:
+        st.info("暂无耗时记录")
+        return
+    st.dataframe(summary, use_container_width=True, hide_index=True)
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.button("刷新", use_container_width=True, key="profiling_refresh_btn")
+    with col2:
         st.download_button(
-            label=f"📥 下载{managed_city}地区数据",
-            data=csv_data,
-            file_name=f"{managed_city}_绩效数据_{st.session_state.current_quarter}.csv",
-            mime="text/csv",
+            label="📥 导出耗时记录（JSON）",
+            data=recorder.dump_json().encode('utf-8'),
+            file_name=f"性能监控_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+            mime="application/json",
             use_container_width=True,
-            key="export_city_data_btn"
+            key="profiling_export_btn"
         )
+    with col3:
+        if st.button("清空记录", use_container_width=True, key="profiling_clear_btn"):
+            recorder.clear()
+            st.rerun()
+
+@session_fragment
+def render_memory_panel():
+    """内存统计：进程内存、各会话持有的数据和共享缓存，可释放闲置会话的数据"""
+    st.markdown("### 🧠 内存统计")
+    rss = process_rss_bytes()
+    sessions = get_session_registry().sessions()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("进程内存（RSS）", f"{rss / 1024 / 1024:.1f} MB" if rss is not None else "未知")
+    col2.metric("会话数", len(sessions))
+    col3.metric("已加载数据集", len(get_tenant_registry().loaded()))
+
+    # 逐个会话估算内存要遍历全部数据，点击后才统计
+    if st.button("统计内存占用", use_container_width=True, key="memory_report_btn"):
+        sessions_df = session_memory_report()
+        if sessions_df.empty:
+            st.info("暂无会话数据")
+        else:
+            st.markdown("**各会话持有的数据**")
+            st.caption("每个会话单独估算：同一版本的数据在会话之间共享的部分会重复计算，合计可能高于实际占用")
+            st.dataframe(sessions_df, use_container_width=True, hide_index=True)
+            versions = sessions_df.groupby('数据集').agg(会话数=('会话', 'count'), 持有数据版本数=('数据版本', 'nunique'))
+            st.dataframe(versions, use_container_width=True)
+        st.markdown("**进程内共享缓存**")
+        st.dataframe(shared_cache_report(), use_container_width=True, hide_index=True)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        idle_label = st.selectbox("释放闲置会话的数据", list(SESSION_IDLE_OPTIONS), index=1, key="evict_idle_select")
+        if st.button("释放闲置会话", use_container_width=True, key="evict_idle_btn"):
+            evicted = evict_idle_sessions(SESSION_IDLE_OPTIONS[idle_label], st.session_state.session_id)
+            st.success(f"✅ 已通知{evicted}个闲置会话释放数据：这些会话在下次同步检查或操作时释放，需要时重新加载")
+    with col2:
+        st.caption("导出文件按数据版本缓存，清空后下次导出时重新生成")
+        if st.button("清空导出缓存", use_container_width=True, key="clear_export_cache_btn"):
+            cached_excel_export.clear()
+            cached_csv_export.clear()
+            cached_history_export.clear()
+            st.success("✅ 导出缓存已清空")
+
+@session_fragment
+def render_as_of_view(cities, key_prefix):
+    """历史时点查询：还原指定时间点的绩效数据"""
+    st.subheader("🕒 历史时点查询")
+    st.caption("根据定期快照和操作日志还原指定时间点的数据，可用于核对薪酬争议")
+    
+    now = datetime.now()
+    # 默认时间为打开页面时的当前时间（精确到分钟）
+    st.session_state.setdefault(f"{key_prefix}_as_of_time", now.replace(second=0, microsecond=0).time())
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        as_of_date = st.date_input("日期", value=now.date(), max_value=now.date(), key=f"{key_prefix}_as_of_date")
+    with col2:
+        as_of_time = st.time_input("时间", key=f"{key_prefix}_as_of_time")
+    with col3:
+        staff_filter = st.text_input("事务员姓名（可选）", key=f"{key_prefix}_as_of_staff").strip()
+    
+    as_of = int(datetime.combine(as_of_date, as_of_time).timestamp() * 1000)
+    if as_of < audit_timestamp():
+        as_of_df = cached_as_of_view(st.session_state.tenant, as_of, tuple(cities))
+    else:
+        # 现在或将来的时间点就是当前数据，不必回放操作日志
+        data = st.session_state.performance_data
+        as_of_df = None if data is None else data[data['地市'].isin(cities)]
+    
+    if as_of_df is None:
+        st.info("该时间点之前没有数据快照，无法还原")
+        return
+    if staff_filter:
+        as_of_df = as_of_df[as_of_df['事务员'].str.contains(staff_filter, regex=False)]
+    
+    st.write(f"**{as_of_date} {as_of_time.strftime('%H:%M')} 的数据**（共{len(as_of_df)}人）")
+    st.dataframe(as_of_df, use_container_width=True, hide_index=True)
+    st.download_button(
+        label="📥 下载该时点数据",
+        data=as_of_df.to_csv(index=False).encode('utf-8-sig'),
+        file_name=f"绩效数据_{as_of_date}_{as_of_time.strftime('%H%M')}.csv",
+        mime="text/csv",
+        key=f"{key_prefix}_as_of_download"
+    )
+
+@session_fragment
+def render_admin_history_summary():
+    """季度历史记录查询（独立片段）"""
+    st.markdown("### 季度历史记录")
+    quarters = history_quarters()
+    if quarters:
+        selected_history = st.selectbox("查看历史季度", quarters, key="admin_history_select")
+        
+        if selected_history in quarters:
+            history_summary = history_city_summary(selected_history)
+            
+            st.dataframe(history_summary, use_container_width=True)
+    else:
+        st.info("暂无季度历史数据")
 
-# ========== 管理员页面 ==========
 def admin_dashboard():
     st.markdown('<h2 class="main-header">👑 管理员控制台</h2>', unsafe_allow_html=True)
     
     # 显示数据状态
-    if os.path.exists(DATA_FILE):
-        file_size = os.path.getsize(DATA_FILE) / 1024
-        st.markdown(f'<div class="sync-status">💾 数据文件大小: {file_size:.1f} KB | 上次修改: {datetime.fromtimestamp(os.path.getmtime(DATA_FILE)).strftime("%Y-%m-%d %H:%M:%S")}</div>', unsafe_allow_html=True)
-    
-    tab1, tab2, tab3, tab4, tab5 = st.tabs(["📋 数据管理", "📊 全局分析", "🔄 季度管理", "📤 数据导入导出", "⚙️ 系统设置"])
-    
-    with tab1:
-        st.subheader("全员数据管理")
-        
-        # 显示筛选选项
-        col1, col2 = st.columns(2)
-        with col1:
-            # 只显示当前季度数据
-            display_current_only = st.checkbox(
-                "只显示当前季度数据", 
-                value=True,
-                help="勾选后只显示当前季度的相关数据列",
-                key="display_current_only"
-            )
-        
-        with col2:
-            # 选择查看的地市
-            all_cities = st.session_state.performance_data['地市'].unique().tolist()
-            selected_city = st.selectbox(
-                "选择地市查看", 
-                ["全部"] + all_cities,
-                key="admin_city_select"
-            )
-        
-        # 获取要显示的数据
-        if display_current_only:
-            display_data = get_current_quarter_data(
-                st.session_state.performance_data, 
-                st.session_state.current_quarter
-            )
-        else:
-            display_data = st.session_state.performance_data.copy()
-        
-        # 按地市筛选
-        if selected_city != "全部":
-            display_data = display_data[display_data['地市'] == selected_city]
-        
-        # 显示庞雷的数据示例（用于验证）
-        if "庞雷" in display_data['事务员'].values:
-            pang_lei_data = display_data[display_data['事务员'] == "庞雷"].iloc[0]
-            
-            with st.expander("🔍 验证：庞雷的数据（示例）", expanded=True):
-                st.write("**当前季度数据：**")
-                quarter_months = get_quarter_months(st.session_state.current_quarter)
-                
-                cols = st.columns(len(quarter_months))
-                for i, month in enumerate(quarter_months):
-                    with cols[i]:
-                        month_num = int(month.replace('月', ''))
-                        dist_col = f'分销_{month_num}月'
-                        recycle_col = f'条盒_{month_num}月'
-                        
-                        if dist_col in pang_lei_data:
-                            st.metric(f"{month}分销", f"{pang_lei_data[dist_col]}条")
-                        if recycle_col in pang_lei_data:
-                            st.metric(f"{month}回收", f"{pang_lei_data[recycle_col]}条")
-                
-                st.write(f"**核心户数：** {pang_lei_data['核心户数'] if '核心户数' in pang_lei_data else 0}人")
-                st.write(f"**综合评分：** {pang_lei_data['综合评分'] if '综合评分' in pang_lei_data else 0}分")
-                st.write(f"**目标档位：** {pang_lei_data['季度目标档位'] if '季度目标档位' in pang_lei_data else 6}档")
-        
-        # 显示数据编辑界面
-        st.write(f"显示数据：{len(display_data)} 行")
-        
-        edited_df = st.data_editor(
-            display_data,
-            column_config={
-                '季度目标档位': st.column_config.NumberColumn(
-                    "目标档位",
-                    min_value=1,
-                    max_value=10,
-                    step=1
-                ),
-                '综合评分': st.column_config.NumberColumn(
-                    "综合评分",
-                    min_value=0,
-                    max_value=20,
-                    step=1
-                ),
-                '核心户数': st.column_config.NumberColumn(
-                    "核心户数",
-                    min_value=0,
-                    step=1
-                )
-            },
-            use_container_width=True,
-            height=500,
-            key="admin_editor"
-        )
-        
-        # 检查是否有数据被修改
-        if not edited_df.equals(display_data):
-            st.markdown('<div class="data-changed">📝 检测到数据修改，请保存以应用更改</div>', unsafe_allow_html=True)
-        
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            if st.button("保存修改", type="primary", use_container_width=True, key="save_all_changes_btn"):
-                # 保存修改到主数据
-                for idx, row in edited_df.iterrows():
-                    # 找到原始数据中的对应行
-                    original_idx = display_data.index[display_data['行号'] == row['行号']].tolist()
-                    if original_idx:
-                        original_idx = original_idx[0]
-                        
-                        # 准备更新数据
-                        updates = {}
-                        
-                        # 更新可编辑字段
-                        editable_fields = ['综合评分', '季度目标档位', '核心户数', '备注']
-                        for field in editable_fields:
-                            if field in row and field in st.session_state.performance_data.columns:
-                                updates[field] = row[field]
-                        
-                        # 更新月度数据
-                        month_range = get_current_quarter_month_range()
-                        for month_num in month_range:
-                            dist_col = f'分销_{month_num}月'
-                            recycle_col = f'条盒_{month_num}月'
-                            
-                            if dist_col in row:
-                                updates[dist_col] = row[dist_col]
-                            if recycle_col in row:
-                                updates[recycle_col] = row[recycle_col]
-                        
-                        # 执行更新
-                        staff_name = row['事务员']
-                        success = update_staff_data(staff_name, updates)
-                
-                st.success("✅ 数据保存成功！")
-                st.info("💾 数据已保存到本地文件")
-                st.rerun()
-        
-        with col2:
-            if st.button("重新计算绩效", type="secondary", use_container_width=True, key="recalculate_btn"):
-                st.session_state.performance_data = calculate_performance(
-                    st.session_state.performance_data, 
-                    st.session_state.current_quarter
-                )
-                save_data()
-                st.success("✅ 绩效重新计算完成！")
-                st.rerun()
-        
-        with col3:
-            if st.button("备份数据", type="secondary", use_container_width=True, key="backup_btn"):
-                backup_file, success, message = backup_data()
-                if success:
-                    st.success(f"✅ {message}")
-                else:
-                    st.error(f"❌ {message}")
+    shard_count, file_size, last_modified = data_storage_stats()
+    if last_modified is not None:
+        st.markdown(f'<div class="sync-status">💾 数据分片: {shard_count}个地市 | 总大小: {file_size:.1f} KB | 上次修改: {last_modified.strftime("%Y-%m-%d %H:%M:%S")}</div>', unsafe_allow_html=True)
+    render_live_sync()
     
-    with tab2:
-        st.subheader("全局分析")
-        
-        if st.session_state.performance_data is not None and not st.session_state.performance_data.empty:
-            # 总体统计
-            col1, col2, col3, col4 = st.columns(4)
-            with col1:
-                total_staff = len(st.session_state.performance_data)
-                st.metric("事务员总数", total_staff)
-            with col2:
-                if '总分' in st.session_state.performance_data.columns:
-                    avg_score = st.session_state.performance_data['总分'].mean()
-                    st.metric("平均总分", f"{avg_score:.1f}分")
-                else:
-                    st.metric("平均总分", "0分")
-            with col3:
-                if '档位' in st.session_state.performance_data.columns:
-                    avg_grade = st.session_state.performance_data['档位'].mean()
-                    st.metric("平均档位", f"{avg_grade:.1f}档")
-                else:
-                    st.metric("平均档位", "0档")
-            with col4:
-                if '是否达标' in st.session_state.performance_data.columns:
-                    da_biao_lv = st.session_state.performance_data['是否达标'].mean() * 100
-                    st.metric("整体达标率", f"{da_biao_lv:.1f}%")
-                else:
-                    st.metric("整体达标率", "0%")
-            
-            # 档位分布
-            if '档位' in st.session_state.performance_data.columns:
-                st.subheader("📊 档位分布情况")
-                grade_dist = st.session_state.performance_data['档位'].value_counts().sort_index()
-                
-                if not grade_dist.empty:
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        fig = px.pie(values=grade_dist.values, 
-                                    names=[f"{g}档" for g in grade_dist.index],
-                                    title='档位分布饼图')
-                        st.plotly_chart(fig, use_container_width=True)
-                    
-                    with col2:
-                        fig = px.bar(x=[f"{g}档" for g in grade_dist.index], 
-                                    y=grade_dist.values,
-                                    title='档位分布柱状图',
-                                    color=grade_dist.values,
-                                    color_continuous_scale='Blues')
-                        fig.update_layout(xaxis_title="档位", yaxis_title="人数")
-                        st.plotly_chart(fig, use_container_width=True)
-                else:
-                    st.info("暂无档位分布数据")
-            
-            # 地区分析
-            if '地市' in st.session_state.performance_data.columns and '总分' in st.session_state.performance_data.columns:
-                st.subheader("🏙️ 地区绩效分析")
-                city_stats = st.session_state.performance_data.groupby('地市').agg({
-                    '总分': 'mean',
-                    '档位': 'mean',
-                    '事务员': 'count'
-                }).round(1).reset_index()
-                
-                city_stats.columns = ['地市', '平均总分', '平均档位', '事务员数']
-                
-                if not city_stats.empty:
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        fig = px.bar(city_stats.sort_values('平均总分', ascending=False).head(10),
-                                    x='地市', y='平均总分',
-                                    title='平均总分前十地区',
-                                    color='平均总分',
-                                    color_continuous_scale='Viridis')
-                        fig.update_layout(xaxis_title="地市", yaxis_title="平均总分")
-                        st.plotly_chart(fig, use_container_width=True)
-                    
-                    with col2:
-                        fig = px.scatter(city_stats, x='事务员数', y='平均总分',
-                                        size='事务员数', hover_name='地市',
-                                        title='地区人数与绩效关系',
-                                        color='平均档位',
-                                        color_continuous_scale='RdYlGn')
-                        st.plotly_chart(fig, use_container_width=True)
-                else:
-                    st.info("暂无地区分析数据")
-        else:
-            st.info("暂无全局分析数据")
+    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(["📋 数据管理", "📊 全局分析", "🔄 季度管理", "📤 数据导入导出", "⚙️ 系统设置", "🕒 历史时点"])
     
-    with tab3:
+    with tab1, timed('页面:管理员/数据管理'):
+        render_admin_data_editor()
+
+    with tab2, timed('页面:管理员/全局分析'):
+        render_global_analysis()
+
+    with tab3, timed('页面:管理员/季度管理'):
         st.subheader("🔄 季度管理")
         
         col1, col2 = st.columns(2)
@@ -1802,12 +2661,11 @@ def admin_dashboard():
             default_target = st.slider("默认目标档位", 1, 10, 6, key="admin_target_slider")
             
             if st.button("全员设置季度目标", use_container_width=True, key="set_all_target_btn"):
-                success_count = 0
-                for idx in st.session_state.performance_data.index:
-                    staff_name = st.session_state.performance_data.at[idx, '事务员']
-                    updates = {'季度目标档位': default_target}
-                    if update_staff_data(staff_name, updates):
-                        success_count += 1
+                updates_by_staff = {
+                    staff_name: {'季度目标档位': default_target}
+                    for staff_name in st.session_state.performance_data['事务员']
+                }
+                success_count = batch_update_staff_data(updates_by_staff, operation='全员设置季度目标')
                 
                 st.success(f"✅ 已为{success_count}位事务员设置季度目标为{default_target}档")
                 st.rerun()
@@ -1824,40 +2682,22 @@ def admin_dashboard():
             # 手动重置当前季度
             if st.button("手动重置当前季度数据", type="primary", use_container_width=True, key="manual_reset_btn"):
                 if st.session_state.performance_data is not None:
-                    st.session_state.performance_data = reset_quarter_data(
-                        st.session_state.performance_data,
-                        target_grade=6
-                    )
+                    reset_quarter_data(st.session_state.performance_data, target_grade=6)
                     st.success(f"✅ {st.session_state.current_quarter} 数据已重置")
                     st.rerun()
             
             # 显示季度历史
-            st.markdown("### 季度历史记录")
-            if st.session_state.quarter_history:
-                quarters = list(st.session_state.quarter_history.keys())
-                if quarters:
-                    selected_history = st.selectbox("查看历史季度", quarters, key="admin_history_select")
-                    
-                    if selected_history in st.session_state.quarter_history:
-                        history_df = pd.DataFrame(st.session_state.quarter_history[selected_history])
-                        history_summary = history_df.groupby('地市').agg({
-                            '总分': 'mean',
-                            '档位': 'mean',
-                            '事务员': 'count'
-                        }).round(1)
-                        
-                        st.dataframe(history_summary, use_container_width=True)
-            else:
-                st.info("暂无季度历史数据")
+            render_admin_history_summary()
         
         # 历史季度数据管理
         st.markdown("### 📊 历史季度数据导出")
         
-        if st.session_state.quarter_history:
+        quarters = history_quarters()
+        if quarters:
             col1, col2 = st.columns(2)
             with col1:
                 # 导出所有历史数据
-                output, success, message = export_quarter_history()
+                output, success, message = cached_history_export(history_cache_key(), tuple(quarters))
                 if success:
                     st.download_button(
                         label="📥 下载所有历史季度数据",
@@ -1869,14 +2709,15 @@ def admin_dashboard():
                     )
             with col2:
                 if st.button("清空历史季度数据", type="secondary", use_container_width=True, key="clear_history_btn"):
-                    st.session_state.quarter_history = {}
-                    save_data()
+                    set_session_history({})
+                    clear_archived_quarters()
+                    save_data(operation='清空历史季度数据')
                     st.success("✅ 历史季度数据已清空")
                     st.rerun()
         else:
             st.info("暂无历史季度数据")
     
-    with tab4:
+    with tab4, timed('页面:管理员/数据导入导出'):
         st.subheader("📤 数据导入导出")
         
         col1, col2 = st.columns(2)
@@ -1893,7 +2734,8 @@ def admin_dashboard():
             if uploaded_file is not None:
                 try:
                     # 读取Excel文件
-                    df = pd.read_excel(uploaded_file)
+                    with timed('import_excel'):
+                        df = pd.read_excel(uploaded_file)
                     
                     # 显示数据预览
                     with st.expander("预览导入的数据", expanded=True):
@@ -1908,15 +2750,17 @@ def admin_dashboard():
                         st.error(f"缺少必要列: {missing_columns}")
                     else:
                         if st.button("确认导入数据", type="primary", use_container_width=True, key="confirm_import_btn"):
-                            # 合并数据
-                            df_merged = pd.concat([st.session_state.performance_data, df], ignore_index=True).drop_duplicates(subset=['事务员'], keep='last')
-                            
-                            # 重新计算绩效
-                            df_merged = calculate_performance(df_merged, st.session_state.current_quarter)
-                            
-                            # 更新session state
-                            st.session_state.performance_data = df_merged
-                            save_data()
+                            started = time.perf_counter()
+                            backup_data('导入前备份')
+                            # 以导入数据为准只写入文件中的事务员（只改写涉及的地市分片），
+                            # 其他事务员保留磁盘上的数据，不会被本会话加载的旧数据覆盖
+                            meta, cities = import_staff_rows(df, st.session_state.current_quarter, current_operator())
+                            st.session_state.roster = meta['roster']
+                            st.session_state.roster_version = meta['version']
+                            get_figure_cache().invalidate(set(cities) | {'全部'})
+                            # 通过变更日志拉取写入后的行
+                            sync_session_changes()
+                            record_import('web', len(df), time.perf_counter() - started)
                             
                             st.success(f"✅ 数据导入成功！共导入{len(df)}条记录")
                             st.rerun()
@@ -1928,7 +2772,10 @@ def admin_dashboard():
             st.markdown("### 数据导出")
             
             # 导出当前季度数据
-            output, success, message = export_to_excel(st.session_state.performance_data)
+            output, success, message = cached_excel_export(
+                st.session_state.data_version,
+                st.session_state.performance_data
+            )
             
             if success:
                 st.download_button(
@@ -1941,7 +2788,11 @@ def admin_dashboard():
                 )
             
             # 导出CSV格式
-            csv_data = st.session_state.performance_data.to_csv(index=False).encode('utf-8')
+            csv_data = cached_csv_export(
+                st.session_state.data_version,
+                None,
+                st.session_state.performance_data
+            )
             st.download_button(
                 label="📥 下载CSV格式数据",
                 data=csv_data,
@@ -1964,12 +2815,38 @@ def admin_dashboard():
                     st.success(f"✅ {message}")
                 else:
                     st.error(f"❌ {message}")
+            backup_count, stored_size = backup_storage_stats()
+            st.caption(f"共{backup_count}份备份，压缩去重后占用 {stored_size / 1024:.1f} KB")
+            
+            # 定时备份
+            scheduler = get_backup_scheduler()
+            interval_labels = list(BACKUP_INTERVAL_OPTIONS)
+            current_label = next(
+                (label for label, seconds in BACKUP_INTERVAL_OPTIONS.items() if seconds == scheduler.interval),
+                interval_labels[0]
+            )
+            interval_label = st.selectbox(
+                "定时备份间隔", interval_labels,
+                index=interval_labels.index(current_label),
+                key="backup_interval_select"
+            )
+            if BACKUP_INTERVAL_OPTIONS[interval_label] != scheduler.interval:
+                scheduler.set_interval(BACKUP_INTERVAL_OPTIONS[interval_label])
+            st.caption(f"下次定时备份：{datetime.fromtimestamp(scheduler.next_due()).strftime('%Y-%m-%d %H:%M')} | 等待写入：{scheduler.pending.qsize()}份")
+            if scheduler.last_result:
+                finished_at, ok, message = scheduler.last_result
+                st.caption(f"{'✅' if ok else '❌'} {finished_at.strftime('%H:%M:%S')} {message}")
         
         with col2:
             # 恢复备份
             backup_files = find_backup_files()
             if backup_files:
-                selected_backup = st.selectbox("选择备份文件恢复", backup_files, key="backup_select")
+                backup_labels = {manifest['id']: manifest['label'] for manifest in list_backups()}
+                selected_backup = st.selectbox(
+                    "选择备份恢复", backup_files,
+                    format_func=lambda backup_id: f"{describe_backup(backup_id)} {backup_labels.get(backup_id, '')}",
+                    key="backup_select"
+                )
                 
                 if st.button("恢复选中备份", type="secondary", use_container_width=True, key="restore_backup_btn"):
                     success, message = restore_backup(selected_backup)
@@ -1981,7 +2858,7 @@ def admin_dashboard():
             else:
                 st.info("暂无备份文件")
     
-    with tab5:
+    with tab5, timed('页面:管理员/系统设置'):
         st.subheader("⚙️ 系统设置")
         
         col1, col2 = st.columns(2)
@@ -1994,8 +2871,8 @@ def admin_dashboard():
             **系统状态：** 运行正常 ✅
             **当前季度：** {st.session_state.current_quarter}
             **数据记录数：** {len(st.session_state.performance_data) if st.session_state.performance_data is not None else 0}
-            **历史季度数：** {len(st.session_state.quarter_history)}
-            **数据文件：** {DATA_FILE}
+            **历史季度数：** {len(history_quarters())}
+            **数据目录：** {data_dir()}（按地市分片）
             """)
             
             # 系统健康检查
@@ -2004,10 +2881,10 @@ def admin_dashboard():
             check_items = []
             
             # 检查数据文件
-            if os.path.exists(DATA_FILE):
-                check_items.append(("数据文件", "✅ 正常", "文件大小正常"))
+            if os.path.exists(data_path(META_FILE)) and list_shard_cities():
+                check_items.append(("数据文件", "✅ 正常", f"{len(list_shard_cities())}个地市分片"))
             else:
-                check_items.append(("数据文件", "⚠️ 警告", "数据文件不存在"))
+                check_items.append(("数据文件", "⚠️ 警告", "数据分片不存在"))
             
             # 检查数据完整性
             if st.session_state.performance_data is not None:
@@ -2027,8 +2904,7 @@ def admin_dashboard():
             
             # 系统统计
             if st.session_state.performance_data is not None:
-                total_updates = sum(len(history) for history in st.session_state.data_history.values())
-                st.write(f"**数据更新次数：** {total_updates}次")
+                st.write(f"**数据更新次数：** {get_audit_log().count()}次")
                 st.write(f"**地市数量：** {st.session_state.performance_data['地市'].nunique()}个")
                 st.write(f"**事务员数量：** {st.session_state.performance_data['事务员'].nunique()}人")
         
@@ -2055,20 +2931,16 @@ def admin_dashboard():
                 if st.button(f"执行{reset_option}", type="primary", use_container_width=True, key="execute_reset_btn"):
                     if reset_option == "重置当前季度数据":
                         if st.session_state.performance_data is not None:
-                            st.session_state.performance_data = reset_quarter_data(
-                                st.session_state.performance_data,
-                                target_grade=6
-                            )
+                            reset_quarter_data(st.session_state.performance_data, target_grade=6)
                             st.success("✅ 当前季度数据已重置")
                     elif reset_option == "重置所有数据":
-                        st.session_state.performance_data = init_data_from_template()
-                        st.session_state.performance_data = calculate_performance(
-                            st.session_state.performance_data,
+                        backup_data('重置前备份')
+                        set_session_history({})
+                        clear_archived_quarters()
+                        save_data(force=True, operation='重置所有数据', df=calculate_performance(
+                            init_data_from_template(),
                             st.session_state.current_quarter
-                        )
-                        st.session_state.quarter_history = {}
-                        st.session_state.data_history = {}
-                        save_data()
+                        ))
                         st.success("✅ 所有数据已重置为初始状态")
                     elif reset_option == "重置登录状态":
                         # 只重置登录状态，保留数据
@@ -2080,20 +2952,24 @@ def admin_dashboard():
                     
                     st.rerun()
             
-            # 日志查看
-            st.markdown("#### 操作日志")
-            
-            if st.session_state.data_history:
-                with st.expander("查看操作日志", expanded=False):
-                    for staff_name, history in list(st.session_state.data_history.items())[:10]:  # 只显示前10条
-                        for record in history[-3:]:  # 只显示最近3条
-                            st.write(f"**{staff_name}** - {record['时间']}")
-                            st.write(f"操作: {record['操作']}")
-                            if '更新内容' in record:
-                                st.write(f"更新内容: {record['更新内容']}")
-                            st.divider()
-            else:
-                st.info("暂无操作日志")
+            # 审计日志归档
+            st.markdown("#### 审计日志归档")
+            retention_months = st.number_input(
+                "明细保留月数", min_value=1, max_value=120,
+                value=AUDIT_RETENTION_MONTHS, key="audit_retention_input"
+            )
+            if st.button("归档过期日志", use_container_width=True, key="audit_rollup_btn"):
+                rolled = rollup_audit_log(retention_months)
+                st.success(f"✅ 已将{rolled}个月的明细日志汇总归档")
+        
+        # 操作日志
+        render_audit_log_viewer()
+        
+        # 性能监控
+        render_profiling_panel()
+        
+        # 内存统计
+        render_memory_panel()
         
         # 密码管理
         st.markdown("### 🔑 密码管理")
@@ -2117,14 +2993,26 @@ def admin_dashboard():
             st.write("1. 密码长度至少8位")
             st.write("2. 包含大小写字母和数字")
             st.write("3. 定期更换密码")
+    
+    with tab6, timed('页面:管理员/历史时点'):
+        render_as_of_view(list_snapshot_cities(), "admin")
 
 # ========== 主程序 ==========
 def main():
+    touch_session()
+    get_metrics_writer()
+    
     # 检查登录状态
     if not st.session_state.authenticated:
         login_page()
         return
     
+    # 按登录身份加载所需的地市数据
+    ensure_session_data()
+    # 启动当前数据集的后台备份和季度切换线程（每个数据集只启动一次）
+    get_backup_scheduler()
+    get_quarter_rollover_job()
+    
     # 顶部导航栏
     col1, col2, col3 = st.columns([3, 1, 1])
     with col1:
@@ -2134,6 +3022,8 @@ def main():
             "admin": "👑 管理员控制台"
         }
         st.markdown(f'<h3>{role_display[st.session_state.user_role]}</h3>', unsafe_allow_html=True)
+        if st.session_state.tenant != DEFAULT_TENANT:
+            st.caption(f"数据集：{current_tenant().title}")
     
     with col2:
         quarter_badge = {
@@ -2153,15 +3043,20 @@ def main():
     
     with col3:
         if st.button("退出登录", use_container_width=True, key="logout_btn"):
-            # 保存数据
-            save_data()
-            # 清空session state
+            # 所有修改在提交时已写入，退出时不再整体覆盖保存
+            # 清空session state（保留所选数据集和会话ID）
+            tenant, session_id = st.session_state.tenant, st.session_state.session_id
             for key in list(st.session_state.keys()):
                 del st.session_state[key]
+            st.session_state.tenant = tenant
+            st.session_state.session_id = session_id
             st.rerun()
     
     st.divider()
     
+    # 保存冲突的合并视图
+    render_write_conflicts()
+    
     # 根据角色显示对应页面
     if st.session_state.user_role == "staff":
         staff_dashboard()
@@ -2171,4 +3066,5 @@ def main():
         admin_dashboard()
 
 if __name__ == "__main__":
-    main()
+    with timed('整页重跑'):
+        main()
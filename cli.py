@@ -0,0 +1,226 @@
+"""绩效管理命令行工具
+
+不启动浏览器、不导入streamlit，供定时任务和运维脚本使用，例如：
+
+    python cli.py recompute --workers 8
+    python cli.py rollover
+    python cli.py import 绩效数据.xlsx
+    python cli.py export -o 绩效数据.xlsx --history 季度历史.xlsx
+    python cli.py backup --label 夜间备份
+
+数据目录与网页应用相同（当前目录下的 data/），可用 -C 指定应用所在目录，
+用 -t 指定数据集（tenants/<名称>/，默认为 data/ 中的默认数据集），例如：
+
+    python cli.py create-tenant guangxi --title 广西 --rules 广西评分规则.json
+    python cli.py -t guangxi import 广西绩效.xlsx
+
+按地市分片的任务在多个进程中并行执行，与正在运行的网页应用之间通过分片文件锁互斥，
+写入后网页会话通过变更通知自动获取新数据。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+
+import core
+
+OPERATOR = '命令行'
+
+
+def _run_by_city(func, tasks, workers):
+    """按地市在多个进程中执行任务，返回 {地市: 结果}"""
+    if workers <= 1 or len(tasks) <= 1:
+        return {city: func(*args) for city, args in tasks.items()}
+    # 子进程先切换到当前数据集
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), initializer=core.activate_tenant,
+                             initargs=(core.current_tenant().name,)) as pool:
+        futures = {city: pool.submit(func, *args) for city, args in tasks.items()}
+        return {city: future.result() for city, future in futures.items()}
+
+
+def _current_quarter():
+    meta = core.load_meta() or {}
+    return meta.get('current_quarter') or core.get_current_quarter()
+
+
+def cmd_recompute(args):
+    """重新计算绩效"""
+    cities = args.cities or core.list_shard_cities()
+    quarter = _current_quarter()
+    change_set = core.new_change_set_id()
+    results = _run_by_city(
+        core.recompute_city,
+        {city: (city, quarter, OPERATOR, change_set) for city in cities},
+        args.workers
+    )
+    total = sum(count for count, _ in results.values())
+    conflicts = [row for _, city_conflicts in results.values() for row in city_conflicts]
+    print(f"{quarter}：已重新计算{len(results)}个地市、{total}位事务员的绩效")
+    if conflicts:
+        print(f"{len(conflicts)}个字段在计算期间被其他用户修改，已保留对方的数据：" +
+              '、'.join(f"{row['事务员']}/{row['字段']}" for row in conflicts[:10]))
+    return 0
+
+
+def cmd_rollover(args):
+    """季度切换"""
+    if core.run_quarter_rollover(target_grade=args.target_grade):
+        print(f"已切换到{core.get_current_quarter()}")
+    else:
+        print(f"{core.get_current_quarter()}无需切换（已切换或还没有数据）")
+    return 0
+
+
+def cmd_import(args):
+    """导入Excel数据"""
+    df, success, message = core.import_excel_data(args.file)
+    if not success:
+        print(message, file=sys.stderr)
+        return 1
+    missing_columns = [col for col in ['行号', '地市', '事务员'] if col not in df.columns]
+    if missing_columns:
+        print(f"缺少必要列: {missing_columns}", file=sys.stderr)
+        return 1
+    
+    quarter = _current_quarter()
+    # 以导入数据为准只写入文件中的事务员，只改写涉及的地市分片
+    imported, removed, cities = core.plan_import(df, (core.load_meta() or {}).get('roster'))
+    
+    core.backup_now('导入前备份')
+    change_set = core.new_change_set_id()
+    _run_by_city(
+        core.cas_import_shard,
+        {
+            city: (city, imported[imported['地市'] == city], removed.get(city, []), quarter, '导入数据', OPERATOR, change_set)
+            for city in cities
+        },
+        args.workers
+    )
+    core.update_roster_rows(imported, quarter)
+    print(f"导入成功：共导入{len(imported)}条记录，写入{len(cities)}个地市")
+    return 0
+
+
+def _write_output(output, path):
+    with open(path, 'wb') as f:
+        f.write(output.getvalue())
+
+
+def cmd_export(args):
+    """导出Excel数据"""
+    df = core.load_all_data()
+    if df is None:
+        print("没有数据", file=sys.stderr)
+        return 1
+    output_path = args.output or f"广东中烟绩效数据_{_current_quarter()}_{datetime.now().strftime('%Y%m%d')}.xlsx"
+    output, success, message = core.export_to_excel(df)
+    if not success:
+        print(message, file=sys.stderr)
+        return 1
+    _write_output(output, output_path)
+    print(f"已导出{len(df)}条记录：{output_path}")
+    
+    if args.history:
+        output, success, message = core.export_quarter_history(core.load_all_history())
+        if not success:
+            print(message, file=sys.stderr)
+            return 1
+        _write_output(output, args.history)
+        print(f"已导出季度历史：{args.history}")
+    return 0
+
+
+def cmd_backup(args):
+    """备份数据"""
+    manifest = core.backup_now(args.label)
+    print(
+        f"备份成功：{manifest['id']}（数据{manifest['size'] / 1024:.1f} KB，"
+        f"本次新增存储{manifest['stored'] / 1024:.1f} KB）"
+    )
+    return 0
+
+
+def cmd_tenants(args):
+    """列出数据集"""
+    for name in core.list_tenants():
+        print(f"{name}\t{core.tenant_title(name)}\t{core.tenant_root(name)}")
+    return 0
+
+
+def cmd_create_tenant(args):
+    """创建数据集"""
+    rules = None
+    if args.rules:
+        with open(args.rules, 'r', encoding='utf-8') as f:
+            rules = json.load(f)
+    try:
+        root = core.create_tenant(args.name, args.title, rules)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    print(f"已创建数据集{args.name}：{root}")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="广东中烟绩效管理系统命令行工具")
+    parser.add_argument('-C', '--directory', help="应用所在目录（数据在其下的 data/ 中），默认为当前目录")
+    parser.add_argument('-t', '--tenant', default=core.DEFAULT_TENANT, help="数据集名称（默认为默认数据集）")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    recompute = subparsers.add_parser('recompute', help="重新计算绩效")
+    recompute.add_argument('--cities', nargs='+', help="只计算这些地市（默认全部）")
+    recompute.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1, help="并行进程数")
+    recompute.set_defaults(func=cmd_recompute)
+    
+    rollover = subparsers.add_parser('rollover', help="季度切换（每个季度只执行一次）")
+    rollover.add_argument('--target-grade', type=int, default=6, help="新季度的目标档位")
+    rollover.set_defaults(func=cmd_rollover)
+    
+    importer = subparsers.add_parser('import', help="导入Excel数据")
+    importer.add_argument('file', help="Excel文件")
+    importer.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1, help="并行进程数")
+    importer.set_defaults(func=cmd_import)
+    
+    exporter = subparsers.add_parser('export', help="导出Excel数据")
+    exporter.add_argument('-o', '--output', help="当前季度数据的输出文件")
+    exporter.add_argument('--history', metavar='FILE', help="同时导出季度历史到该文件")
+    exporter.set_defaults(func=cmd_export)
+    
+    backup = subparsers.add_parser('backup', help="备份数据")
+    backup.add_argument('--label', default='命令行备份', help="备份名称")
+    backup.set_defaults(func=cmd_backup)
+    
+    tenants = subparsers.add_parser('tenants', help="列出数据集")
+    tenants.set_defaults(func=cmd_tenants)
+    
+    create_tenant = subparsers.add_parser('create-tenant', help="创建数据集")
+    create_tenant.add_argument('name', help="数据集名称（文字、数字、下划线和连字符）")
+    create_tenant.add_argument('--title', help="显示名称")
+    create_tenant.add_argument('--rules', metavar='FILE', help="评分规则覆盖项（JSON文件，键为规则表名）")
+    create_tenant.set_defaults(func=cmd_create_tenant)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.directory:
+        os.chdir(args.directory)
+    try:
+        core.activate_tenant(args.tenant)
+    except KeyError as e:
+        print(e.args[0], file=sys.stderr)
+        return 1
+    core.migrate_legacy_data()
+    started = time.time()
+    code = args.func(args)
+    print(f"用时{time.time() - started:.1f}秒", file=sys.stderr)
+    return code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,3022 @@
+"""绩效管理核心库
+
+数据存储（地市分片、变更通知、审计日志、快照、季度历史归档、备份）、评分计算、
+季度切换和导入导出，不依赖Streamlit会话，可供网页应用和命令行批处理共用。
+不导入streamlit和plotly，命令行启动快；模块级的锁和缓存在进程内共享。
+一个进程可托管多个数据集，存储函数都作用于上下文中的当前数据集（见 use_tenant）。
+"""
+import pandas as pd
+from datetime import datetime
+from io import BytesIO
+import numpy as np
+import json
+import os
+import pickle
+import queue
+import shutil
+import sys
+import bisect
+import contextvars
+import hashlib
+import re
+import threading
+import time
+import warnings
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from functools import lru_cache
+from urllib.parse import quote, unquote
+
+try:
+    import fcntl
+except ImportError:  # Windows下没有fcntl，只使用进程内锁
+    fcntl = None
+
+# 写时复制：列子集和浅拷贝与原数据共享列数据，修改时才复制被修改的列。
+# 会话数据按版本发布、发布后不再修改，依赖此行为（pandas 3起始终开启）。
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
+
+# ========== 数据持久化存储 ==========
+DATA_FILE = "performance_data.pkl"    # 旧版单文件存储，仅用于迁移
+HISTORY_FILE = "quarter_history.pkl"
+DATA_DIR = "data"                     # 默认数据集的数据目录
+# 以下路径都相对于当前数据集的数据目录，通过 data_path() 取得实际路径
+SHARD_DIR = "shards"
+META_FILE = "meta.pkl"
+SHARD_SUFFIX = ".pkl"
+SHARD_HISTORY_SUFFIX = ".history.pkl"
+SHARD_IO_WORKERS = 8
+FEED_FILE = "changes.log"
+FEED_MAX_BYTES = 64 * 1024 * 1024     # 变更日志超过此大小时轮换
+FEED_POLL_SECONDS = 5
+AUDIT_DIR = "audit"
+AUDIT_ROLLUP_FILE = os.path.join(AUDIT_DIR, "rollup.json")
+AUDIT_RETENTION_MONTHS = 24           # 明细日志保留月数，更早的按月汇总
+AUDIT_PAGE_SIZE = 50
+SNAPSHOT_DIR = "snapshots"
+BACKUP_DIR = "backups"
+BACKUP_CHUNK_DIR = os.path.join(BACKUP_DIR, "chunks")
+BACKUP_MANIFEST_DIR = os.path.join(BACKUP_DIR, "manifests")
+BACKUP_CHUNK_SIZE = 256 * 1024
+# 备份保留策略：最近24个小时、30天、8个季度各保留每个时段最新的一份，
+# 另外手动备份和操作前备份保留最近20份
+BACKUP_RETENTION = {'hourly': 24, 'daily': 30, 'quarterly': 8}
+BACKUP_KEEP_MANUAL = 20
+BACKUP_SCHEDULED_LABEL = '定时备份'
+BACKUP_INTERVAL_SECONDS = 3600
+BACKUP_INTERVAL_OPTIONS = {'每小时': 3600, '每3小时': 3 * 3600, '每6小时': 6 * 3600, '每12小时': 12 * 3600, '每天': 24 * 3600}
+SNAPSHOT_INTERVAL_MS = 6 * 3600 * 1000   # 同一地市两次快照的最短间隔，决定时点还原最多回放多少日志
+
+# ========== 性能监控 ==========
+# 加载、保存、评分计算、页面渲染和导入导出的耗时记入进程内的环形缓冲区，
+# 管理员控制台按操作汇总分位数，也可导出为JSON离线分析。
+PROFILE_BUFFER_SIZE = 4096            # 保留最近的耗时记录条数
+PROFILE_PERCENTILES = (50, 90, 99)
+
+class SpanRecorder:
+    """最近若干次操作耗时的环形缓冲区（进程内共享，线程安全）"""
+
+    def __init__(self, maxlen=PROFILE_BUFFER_SIZE):
+        self._spans = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    @property
+    def maxlen(self):
+        return self._spans.maxlen
+
+    def record(self, name, seconds):
+        with self._lock:
+            self._spans.append((name, seconds, time.time()))
+
+    def spans(self):
+        """缓冲区中的记录 [(操作, 耗时秒数, 结束时间戳)]，按时间先后"""
+        with self._lock:
+            return list(self._spans)
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+    def summary(self):
+        """按操作汇总：次数、平均、各分位数和最大耗时（毫秒），按总耗时降序"""
+        spans = self.spans()
+        columns = ['操作', '次数', '平均(ms)'] + [f'P{p}(ms)' for p in PROFILE_PERCENTILES] + ['最大(ms)', '总耗时(s)', '最近一次']
+        if not spans:
+            return pd.DataFrame(columns=columns)
+        frame = pd.DataFrame(spans, columns=['操作', '耗时', '时间'])
+        rows = []
+        for name, group in frame.groupby('操作', sort=False):
+            ms = group['耗时'].to_numpy() * 1000
+            rows.append([name, len(ms), ms.mean(), *np.percentile(ms, PROFILE_PERCENTILES), ms.max(),
+                         ms.sum() / 1000, datetime.fromtimestamp(group['时间'].max())])
+        result = pd.DataFrame(rows, columns=columns).sort_values('总耗时(s)', ascending=False, ignore_index=True)
+        return result.round({column: 2 for column in columns[2:-1]})
+
+    def dump_json(self):
+        """导出汇总和全部原始记录（JSON文本）"""
+        return json.dumps({
+            'generated_at': audit_timestamp(),
+            'pid': os.getpid(),
+            'buffer_size': self.maxlen,
+            'summary': self.summary().to_dict('records'),
+            'spans': [{'name': name, 'ms': round(seconds * 1000, 3), 'at': at} for name, seconds, at in self.spans()]
+        }, ensure_ascii=False, indent=2, default=_json_default)
+
+@lru_cache(maxsize=None)
+def get_span_recorder():
+    """进程内共享的耗时记录器"""
+    return SpanRecorder()
+
+@contextmanager
+def timed(name):
+    """记录代码块耗时（出错时也记录），也可作为函数装饰器：@timed('save_data')"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        get_span_recorder().record(name, seconds)
+        get_metrics().observe('performance_operation_duration_seconds', seconds, (('operation', name),))
+
+# ========== 运行指标（Prometheus） ==========
+# 计数器和直方图在进程内累加，每次记录只是加锁后的几次加法（约1微秒）；数据文件大小、审计日志条数、
+# 在线会话数等状态量在生成指标文本时才通过采集函数读取，不占用保存等热路径。
+# 网页应用定时把指标写入文本文件（可由node_exporter的textfile采集），接入服务提供 GET /metrics。
+METRICS_FILE = os.path.join("metrics", "app.prom")   # 相对于工作目录，不属于任何数据集
+METRICS_WRITE_SECONDS = 15
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# 指标名称 -> (类型, 说明)，输出时按此顺序
+METRICS = {
+    'performance_operation_duration_seconds': ('histogram', '各项操作耗时（加载、保存、绩效计算、页面渲染、导入导出）'),
+    'performance_saves_total': ('counter', '地市分片写入次数（patch为字段修改，write为整体写入，import为导入）'),
+    'performance_file_writes_total': ('counter', '数据文件写入次数'),
+    'performance_file_write_bytes_total': ('counter', '数据文件写入字节数'),
+    'performance_import_rows_total': ('counter', '导入和推送的记录数'),
+    'performance_import_seconds_total': ('counter', '导入和推送的耗时'),
+    'performance_import_rows_per_second': ('gauge', '最近一次导入的速度（行/秒）'),
+    'performance_export_bytes_total': ('counter', '生成的导出文件字节数'),
+    'performance_active_sessions': ('gauge', '最近活动的网页会话数'),
+    'performance_persisted_bytes': ('gauge', '数据分片和全局信息文件的总大小'),
+    'performance_audit_records': ('gauge', '审计日志明细记录数'),
+    'performance_loaded_tenants': ('gauge', '内存中已加载的数据集数量'),
+    'performance_process_resident_bytes': ('gauge', '进程占用的物理内存'),
+}
+
+def _format_labels(labels):
+    """标签元组格式化为 {名称="值",...}（值中的反斜杠、引号和换行需要转义）"""
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    ) + '}'
+
+def _format_value(value):
+    if isinstance(value, float) and value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class MetricsRegistry:
+    """进程内的计数器、直方图和状态量采集函数，生成Prometheus文本格式
+
+    标签为 ((名称, 值), ...) 元组，由调用方按固定顺序给出，记录时不再排序和复制。
+    """
+
+    def __init__(self, buckets=METRICS_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._values = {}        # (指标, 标签) -> 数值
+        self._histograms = {}    # (指标, 标签) -> [各桶计数..., 超出最大桶的计数, 总和]
+        self._collectors = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, labels=()):
+        key = (name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, value, labels=()):
+        with self._lock:
+            self._values[(name, labels)] = value
+
+    def observe(self, name, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        key = (name, labels)
+        with self._lock:
+            counts = self._histograms.get(key)
+            if counts is None:
+                counts = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def value(self, name, labels=()):
+        """计数器或状态量的当前值（未记录过时为0）"""
+        with self._lock:
+            return self._values.get((name, labels), 0)
+
+    def add_collector(self, key, func):
+        """注册状态量采集函数（同一key只保留最后一个），func返回 [(指标, 标签, 数值)]"""
+        with self._lock:
+            self._collectors[key] = func
+
+    def render(self):
+        """生成Prometheus文本格式（version 0.0.4）"""
+        with self._lock:
+            values = dict(self._values)
+            histograms = {key: list(counts) for key, counts in self._histograms.items()}
+            collectors = list(self._collectors.values())
+        for collector in collectors:
+            try:
+                for name, labels, value in collector():
+                    values[(name, labels)] = value
+            except Exception:
+                # 采集失败（如数据目录正在恢复）时跳过，不影响其他指标
+                continue
+        
+        samples = {}
+        for (name, labels), value in values.items():
+            samples.setdefault(name, []).append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        for (name, labels), counts in histograms.items():
+            lines = samples.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts[:-1]):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", _format_value(bound)),))} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(counts[-1])}')
+            lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+        
+        output = []
+        for name, (kind, help_text) in METRICS.items():
+            if name in samples:
+                output.append(f'# HELP {name} {help_text}')
+                output.append(f'# TYPE {name} {kind}')
+                output.extend(samples[name])
+        return '\n'.join(output) + '\n'
+
+@lru_cache(maxsize=None)
+def get_metrics():
+    """进程内共享的运行指标"""
+    metrics = MetricsRegistry()
+    metrics.add_collector('storage', _storage_metrics)
+    metrics.add_collector('process', _process_metrics)
+    return metrics
+
+def _storage_metrics():
+    """已加载数据集的数据文件大小和审计日志条数"""
+    registry = get_tenant_registry()
+    samples = [('performance_loaded_tenants', (), len(registry.loaded()))]
+    for name in registry.loaded():
+        with use_tenant(name):
+            _, size_kb, _ = data_storage_stats()
+            labels = (('tenant', name),)
+            samples.append(('performance_persisted_bytes', labels, int(size_kb * 1024)))
+            samples.append(('performance_audit_records', labels, get_audit_log().count()))
+    return samples
+
+def record_import(source, rows, seconds):
+    """记录一次导入（source为web、cli或api）"""
+    metrics = get_metrics()
+    labels = (('source', source),)
+    metrics.inc('performance_import_rows_total', rows, labels)
+    metrics.inc('performance_import_seconds_total', seconds, labels)
+    if seconds > 0:
+        metrics.set('performance_import_rows_per_second', rows / seconds, labels)
+
+def record_export(kind, size):
+    """记录生成的导出文件大小（kind为xlsx、csv等）"""
+    get_metrics().inc('performance_export_bytes_total', size, (('format', kind),))
+
+def write_metrics_file(path=METRICS_FILE):
+    """把当前指标原子写入文本文件"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(get_metrics().render())
+    os.replace(tmp_path, path)
+
+class MetricsFileWriter:
+    """后台线程每隔interval秒写一次指标文件（进程内只需启动一个）"""
+
+    def __init__(self, path=METRICS_FILE, interval=METRICS_WRITE_SECONDS):
+        self.path = path
+        self.interval = interval
+        self._stopping = threading.Event()
+        self._thread = start_thread(self._run, name='metrics-file-writer')
+
+    def _run(self):
+        while True:
+            try:
+                write_metrics_file(self.path)
+            except OSError:
+                pass
+            if self._stopping.wait(self.interval):
+                return
+
+    def stop(self):
+        self._stopping.set()
+        self._thread.join()
+
+# ========== 内存统计 ==========
+def deep_sizeof(obj, _seen=None):
+    """估算对象及其引用的数据占用的字节数
+
+    DataFrame按列数据（含字符串）计算，容器和普通对象递归计算，同一对象只计一次。
+    写时复制的DataFrame可能与其他版本共享列数据，多个对象分别统计时会重复计算共享部分。
+    """
+    seen = set() if _seen is None else _seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True, deep=True).sum())
+    if isinstance(obj, (pd.Series, pd.Index)):
+        return int(obj.memory_usage(deep=True))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(key, seen) + deep_sizeof(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, '__dict__') and not isinstance(obj, type):
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+def process_rss_bytes():
+    """本进程当前占用的物理内存（字节），无法读取时为None"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    # 取不到当前值时退而使用峰值（macOS单位为字节，Linux为KB）
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def _process_metrics():
+    rss = process_rss_bytes()
+    return [] if rss is None else [('performance_process_resident_bytes', (), rss)]
+
+# ========== 多数据集（租户） ==========
+# 一个进程可以托管多个相互独立的数据集（如不同省份、业务单元）：每个数据集有自己的数据目录
+# （分片、审计日志、快照、归档和备份）、评分规则和后台线程。默认数据集使用 data/，
+# 其他数据集在 tenants/<名称>/ 下，目录中的 tenant.json 记录名称和评分规则的覆盖项。
+# 当前数据集保存在上下文变量中，每个请求/会话各自切换，互不影响。数据集按需加载，
+# 进程内最多保留 TENANT_CACHE_SIZE 个，超出时或闲置超过 TENANT_IDLE_SECONDS 后释放审计索引和
+# 归档缓存（数据都在磁盘上），再次访问时重新加载。备份、季度切换等后台线程按数据集登记在淘汰表之外，
+# 数据集被淘汰后照常运行。
+DEFAULT_TENANT = 'default'
+TENANTS_DIR = 'tenants'
+TENANT_CONFIG_FILE = 'tenant.json'
+TENANT_CACHE_SIZE = 4
+TENANT_IDLE_SECONDS = 1800
+
+def tenant_root(name):
+    """数据集的数据目录"""
+    if name == DEFAULT_TENANT:
+        return DATA_DIR
+    if not re.fullmatch(r'[\w-]+', name or ''):
+        raise ValueError(f"数据集名称只能包含文字、数字、下划线和连字符：{name}")
+    return os.path.join(TENANTS_DIR, name)
+
+def tenant_exists(name):
+    """数据集是否存在（默认数据集总是存在）"""
+    try:
+        root = tenant_root(name)
+    except ValueError:
+        return False
+    return name == DEFAULT_TENANT or os.path.exists(os.path.join(root, TENANT_CONFIG_FILE))
+
+def list_tenants():
+    """全部数据集名称，默认数据集在最前"""
+    names = []
+    if os.path.isdir(TENANTS_DIR):
+        names = sorted(name for name in os.listdir(TENANTS_DIR) if tenant_exists(name))
+    return [DEFAULT_TENANT] + names
+
+def _load_tenant_config(root):
+    path = os.path.join(root, TENANT_CONFIG_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def tenant_title(name):
+    """数据集的显示名称（只读配置，不加载数据集）"""
+    config = _load_tenant_config(tenant_root(name))
+    return config.get('title') or ('默认数据集' if name == DEFAULT_TENANT else name)
+
+def _tenant_rules(overrides):
+    """默认评分规则加上数据集的覆盖项（JSON中的数组转换为元组）"""
+    rules = default_scoring_rules()
+    for name, table in (overrides or {}).items():
+        if name not in rules:
+            raise ValueError(f"未知的评分规则：{name}")
+        rules[name] = tuple(table) if name == 'LOWEST_GRADE' else [tuple(row) for row in table]
+    return rules
+
+def create_tenant(name, title=None, rules=None):
+    """创建数据集（只写配置，数据在首次使用时初始化），rules为评分规则的覆盖项"""
+    if name == DEFAULT_TENANT or tenant_exists(name):
+        raise ValueError(f"数据集已存在：{name}")
+    root = tenant_root(name)
+    _tenant_rules(rules)
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, TENANT_CONFIG_FILE), 'w', encoding='utf-8') as f:
+        json.dump({'title': title or name, 'rules': rules or {}}, f, ensure_ascii=False, indent=2)
+    return root
+
+class Tenant:
+    """已加载到内存的数据集：配置、评分规则、审计日志读取器和归档缓存"""
+
+    def __init__(self, name):
+        self.name = name
+        self.root = tenant_root(name)
+        self.title = tenant_title(name)
+        self.rules = _tenant_rules(_load_tenant_config(self.root).get('rules'))
+        self.audit_log = AuditLog()
+        self.archive_cache = lru_cache(maxsize=HISTORY_CACHE_QUARTERS)(_read_archived_quarter)
+        self.columns_cache = lru_cache(maxsize=64)(_open_quarter_columns)
+        self.last_used = time.monotonic()
+        self._resources = {}
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def resource(self, key, factory):
+        """数据集内唯一的对象，首次使用时创建，随数据集一起释放（数据集已释放时报错）"""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"数据集已从内存中释放：{self.name}")
+            if key not in self._resources:
+                self._resources[key] = factory()
+            return self._resources[key]
+
+    def close(self):
+        """释放数据集的对象和内存中的缓存（后台线程登记在数据集表中，不在这里停止）"""
+        with self._lock:
+            self._closed = True
+            resources, self._resources = self._resources, {}
+        for resource in resources.values():
+            if hasattr(resource, 'stop'):
+                resource.stop()
+        self.audit_log.clear()
+        self.archive_cache.cache_clear()
+        self.columns_cache.cache_clear()
+
+    def memory_usage(self):
+        """数据集在进程内缓存的数据：{名称: (字节数, 说明)}，字节数未知时为None"""
+        archive = self.archive_cache.cache_info()
+        columns = self.columns_cache.cache_info()
+        return {
+            '审计日志索引': (self.audit_log.memory_bytes(), f"{self.audit_log.count()}条明细"),
+            '归档季度缓存': (None, f"{archive.currsize}个季度（已解压）"),
+            '归档列文件': (None, f"{columns.currsize}个季度（内存映射，按需读入）"),
+        }
+
+class TenantRegistry:
+    """已加载数据集的LRU表：超出容量时淘汰最久未用的数据集，闲置过久的数据集也一并淘汰
+
+    各数据集的后台线程另行登记，不参与淘汰。
+    """
+
+    def __init__(self, capacity=TENANT_CACHE_SIZE, idle_seconds=TENANT_IDLE_SECONDS):
+        self.capacity = capacity
+        self.idle_seconds = idle_seconds
+        self._tenants = OrderedDict()
+        self._lock = threading.Lock()
+        self._background = {}
+        self._background_lock = threading.Lock()
+
+    def get(self, name):
+        """取得数据集，未加载时从磁盘加载"""
+        with self._lock:
+            tenant = self._tenants.get(name)
+            if tenant is None:
+                tenant = Tenant(name)
+                self._tenants[name] = tenant
+            self._tenants.move_to_end(name)
+            tenant.last_used = time.monotonic()
+            evicted = self._pop_evicted()
+        for stale in evicted:
+            stale.close()
+        return tenant
+
+    def _pop_evicted(self):
+        now = time.monotonic()
+        evicted = []
+        # 从最久未用的开始检查，刚访问的数据集不淘汰
+        for name, tenant in list(self._tenants.items())[:-1]:
+            if len(self._tenants) > self.capacity or now - tenant.last_used > self.idle_seconds:
+                evicted.append(self._tenants.pop(name))
+        return evicted
+
+    def evict(self, name):
+        """立即淘汰一个数据集（如删除或恢复数据后）"""
+        with self._lock:
+            tenant = self._tenants.pop(name, None)
+        if tenant is not None:
+            tenant.close()
+
+    def loaded(self):
+        """当前在内存中的数据集，按最近使用排序"""
+        with self._lock:
+            return list(reversed(self._tenants))
+
+    def background(self, name, key, factory):
+        """数据集内唯一的后台线程（如备份、季度切换），首次使用时创建，数据集被淘汰后继续运行"""
+        with self._background_lock:
+            jobs = self._background.setdefault(name, {})
+            if key not in jobs:
+                jobs[key] = factory()
+            return jobs[key]
+
+    def stop_background(self, name=None):
+        """停止一个数据集（name为None时为全部数据集）的后台线程，如删除数据或进程退出前"""
+        with self._background_lock:
+            names = list(self._background) if name is None else [name]
+            stopping = [self._background.pop(item, {}) for item in names]
+        # 停止线程可能要等备份写完，不在锁内进行
+        for jobs in stopping:
+            for job in jobs.values():
+                job.stop()
+
+@lru_cache(maxsize=None)
+def get_tenant_registry():
+    """进程内共享的数据集表"""
+    return TenantRegistry()
+
+_current_tenant = contextvars.ContextVar('current_tenant', default=None)
+
+def activate_tenant(name):
+    """把当前上下文（请求、会话的本次运行）切换到指定数据集，返回该数据集"""
+    if not tenant_exists(name):
+        raise KeyError(f"数据集不存在：{name}")
+    tenant = get_tenant_registry().get(name)
+    _current_tenant.set(tenant)
+    return tenant
+
+@contextmanager
+def use_tenant(name):
+    """在with块内使用指定数据集，退出时恢复原来的数据集"""
+    if not tenant_exists(name):
+        raise KeyError(f"数据集不存在：{name}")
+    token = _current_tenant.set(get_tenant_registry().get(name))
+    try:
+        yield _current_tenant.get()
+    finally:
+        _current_tenant.reset(token)
+
+def current_tenant():
+    """当前上下文的数据集，未指定时为默认数据集"""
+    tenant = _current_tenant.get()
+    if tenant is None:
+        tenant = activate_tenant(DEFAULT_TENANT)
+    return tenant
+
+def data_dir():
+    """当前数据集的数据目录"""
+    return current_tenant().root
+
+def data_path(*parts):
+    """当前数据集数据目录下的路径"""
+    return os.path.join(current_tenant().root, *parts)
+
+def parallel_map(func, items):
+    """在线程池中并行执行func，按顺序返回结果；工作线程使用调用方的当前数据集"""
+    items = list(items)
+    if not items:
+        return []
+    context = contextvars.copy_context()
+    with ThreadPoolExecutor(max_workers=min(SHARD_IO_WORKERS, len(items))) as pool:
+        return list(pool.map(lambda item: context.copy().run(func, item), items))
+
+def start_thread(target, name):
+    """启动后台守护线程，线程使用启动时的当前数据集"""
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(target,), name=name, daemon=True)
+    thread.start()
+    return thread
+
+def new_data_version():
+    """生成新的数据版本号（用于按版本缓存计算结果）"""
+    return time.time_ns()
+
+def compose_data_version(shard_versions):
+    """由已加载各地市分片的版本号组合出会话的数据版本号"""
+    digest = hashlib.blake2b(
+        repr(sorted(shard_versions.items())).encode('utf-8'),
+        digest_size=8
+    ).digest()
+    return int.from_bytes(digest, 'big')
+
+def _shard_path(city, suffix=SHARD_SUFFIX):
+    """地市分片文件路径（地市名转义后作为文件名）"""
+    return data_path(SHARD_DIR, quote(str(city), safe='') + suffix)
+
+def _dump_atomic(obj, path):
+    """先写临时文件再原子替换，读取方永远看不到写了一半的文件"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        size = f.tell()
+    os.replace(tmp_path, path)
+    labels = (('tenant', current_tenant().name),)
+    metrics = get_metrics()
+    metrics.inc('performance_file_writes_total', 1, labels)
+    metrics.inc('performance_file_write_bytes_total', size, labels)
+
+def _load_pickle(path, default=None):
+    """读取pickle文件，文件不存在时返回默认值"""
+    if not os.path.exists(path):
+        return default
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+class KeyedLocks:
+    """按键分配的锁表，每个键一把锁"""
+
+    def __init__(self):
+        self._guard = threading.Lock()
+        self._locks = {}
+
+    def get(self, key):
+        with self._guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+@lru_cache(maxsize=None)
+def get_shard_locks():
+    """进程内共享的地市分片锁表"""
+    return KeyedLocks()
+
+@contextmanager
+def _exclusive_lock(key, lock_path):
+    """进程内线程锁加跨进程文件锁"""
+    with get_shard_locks().get((data_dir(), key)):
+        if fcntl is None:
+            yield
+            return
+        with open(lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def shard_lock(city):
+    """地市分片写锁，不同地市之间互不阻塞"""
+    return _exclusive_lock(city, _shard_path(city, '.lock'))
+
+def list_shard_cities():
+    """列出已有分片的地市"""
+    if not os.path.isdir(data_path(SHARD_DIR)):
+        return []
+    return sorted(
+        unquote(name[:-len(SHARD_SUFFIX)])
+        for name in os.listdir(data_path(SHARD_DIR))
+        if name.endswith(SHARD_SUFFIX) and not name.endswith(SHARD_HISTORY_SUFFIX)
+    )
+
+def read_shard(city):
+    """读取单个地市分片（当前季度数据、变更记录和季度历史）"""
+    shard = _load_pickle(_shard_path(city))
+    if shard is None:
+        return None
+    shard['quarter_history'] = _load_pickle(_shard_path(city, SHARD_HISTORY_SUFFIX), {})
+    return shard
+
+def read_shards(cities):
+    """并行读取多个地市分片，返回 {地市: 分片}"""
+    if not cities:
+        return {}
+    shards = dict(zip(cities, parallel_map(read_shard, cities)))
+    return {city: shard for city, shard in shards.items() if shard is not None}
+
+def _read_shard_for_write(city):
+    """在持有分片锁时读取磁盘上的最新分片（不含季度历史）"""
+    shard = _load_pickle(_shard_path(city))
+    if shard is None:
+        shard = {'performance_data': None, 'version': 0}
+    shard.setdefault('row_versions', {})
+    return shard
+
+def _dump_shard(city, shard, quarter_history=None):
+    """在持有分片锁时写入分片并生成新的分片版本号
+
+    quarter_history为None时不改写该地市的季度历史文件。
+    """
+    shard['version'] = new_data_version()
+    _dump_atomic({
+        'performance_data': shard['performance_data'],
+        'row_versions': shard['row_versions'],
+        'snapshot_at': shard.get('snapshot_at', 0),
+        'quarter': shard.get('quarter'),
+        'version': shard['version']
+    }, _shard_path(city))
+    if quarter_history is not None:
+        _dump_atomic(quarter_history, _shard_path(city, SHARD_HISTORY_SUFFIX))
+    return shard['version']
+
+def write_shard(city, city_df, quarter_history=None, quarter=None):
+    """直接写入单个地市分片（不做版本比较，用于数据迁移），返回新的分片版本号"""
+    with shard_lock(city):
+        return _dump_shard_with_snapshot(city, {
+            'performance_data': city_df,
+            'row_versions': {},
+            'quarter': quarter
+        }, quarter_history)
+
+def delete_shard(city):
+    """删除地市分片（该地市已没有事务员时）"""
+    with shard_lock(city):
+        for suffix in (SHARD_SUFFIX, SHARD_HISTORY_SUFFIX):
+            if os.path.exists(_shard_path(city, suffix)):
+                os.remove(_shard_path(city, suffix))
+        publish_change(city, None)
+
+def load_meta():
+    """读取全局信息（当前季度、重置记录、事务员名册）"""
+    return _load_pickle(data_path(META_FILE))
+
+def write_meta(meta):
+    """写入全局信息"""
+    _dump_atomic(meta, data_path(META_FILE))
+
+def split_by_city(df, quarter_history, cities=None):
+    """把全量数据按地市拆分成分片内容，返回 {地市: (数据, 季度历史)}"""
+    if cities is not None:
+        df = df[df['地市'].isin(cities)]
+    
+    quarters_by_city = None
+    if quarter_history is not None:
+        quarters_by_city = {}
+        for quarter, frame in quarter_history.items():
+            for city, city_frame in _history_frame(frame).groupby('地市', sort=False):
+                quarters_by_city.setdefault(city, {})[quarter] = city_frame.reset_index(drop=True)
+    
+    parts = {}
+    for city, city_df in df.groupby('地市', sort=False):
+        parts[city] = (
+            city_df,
+            None if quarters_by_city is None else quarters_by_city.get(city, {})
+        )
+    return parts
+
+def migrate_legacy_data():
+    """把旧版单文件数据拆分为地市分片（只执行一次）"""
+    if current_tenant().name != DEFAULT_TENANT:
+        return
+    if os.path.exists(data_path(META_FILE)) or not os.path.exists(DATA_FILE):
+        return
+    legacy = _load_pickle(DATA_FILE)
+    if not legacy or legacy.get('performance_data') is None:
+        return
+    os.makedirs(data_path(SHARD_DIR), exist_ok=True)
+    df = legacy['performance_data']
+    parts = split_by_city(df, legacy.get('quarter_history', {}))
+    for city, (city_df, city_quarters) in parts.items():
+        write_shard(city, city_df, city_quarters, legacy.get('current_quarter'))
+    # 旧版变更记录转入审计日志
+    import_legacy_history(legacy.get('data_history', {}), dict(zip(df['事务员'], df['地市'])))
+    write_meta({
+        'current_quarter': legacy.get('current_quarter'),
+        'last_reset': legacy.get('last_reset'),
+        'roster': df[['行号', '地市', '事务员']],
+        'version': new_data_version()
+    })
+
+def data_storage_stats():
+    """统计数据目录：分片数、总大小（KB）和最后修改时间"""
+    if not os.path.isdir(data_path(SHARD_DIR)):
+        return 0, 0.0, None
+    paths = [data_path(SHARD_DIR, name) for name in os.listdir(data_path(SHARD_DIR)) if name.endswith('.pkl')]
+    if os.path.exists(data_path(META_FILE)):
+        paths.append(data_path(META_FILE))
+    if not paths:
+        return 0, 0.0, None
+    total_size = sum(os.path.getsize(path) for path in paths) / 1024
+    last_modified = datetime.fromtimestamp(max(os.path.getmtime(path) for path in paths))
+    return len(list_shard_cities()), total_size, last_modified
+
+# ========== 季度历史分层存储 ==========
+# 今年的季度（热数据）按地市保存在分片历史文件中，随分片加载为列式DataFrame；
+# 往年的季度（冷数据）每个季度一个压缩归档文件，首次查看时才解压，进程内按LRU缓存，
+# 不随分片加载，也不随保存改写，多年运行不会拖慢启动和保存。
+HISTORY_ARCHIVE_DIR = 'history'
+HISTORY_ARCHIVE_SUFFIX = '.pkl.z'
+HISTORY_CACHE_QUARTERS = 8
+
+def _quarter_year(quarter):
+    """季度所属年份（无法识别时视为今年）"""
+    return int(quarter[:4]) if quarter[:4].isdigit() else datetime.now().year
+
+def _history_frame(data):
+    """季度历史统一为DataFrame（兼容旧版的记录列表）"""
+    return data if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
+
+def merge_hot_history(histories):
+    """把各地市的热数据合并为 {季度: DataFrame}"""
+    frames = {}
+    for history in histories:
+        for quarter, data in history.items():
+            frames.setdefault(quarter, []).append(_history_frame(data))
+    return {quarter: pd.concat(parts, ignore_index=True) for quarter, parts in frames.items()}
+
+def _archive_path(quarter):
+    return data_path(HISTORY_ARCHIVE_DIR, quarter + HISTORY_ARCHIVE_SUFFIX)
+
+def list_archived_quarters():
+    """已移入压缩归档的季度"""
+    if not os.path.isdir(data_path(HISTORY_ARCHIVE_DIR)):
+        return []
+    return sorted(
+        name[:-len(HISTORY_ARCHIVE_SUFFIX)] for name in os.listdir(data_path(HISTORY_ARCHIVE_DIR))
+        if name.endswith(HISTORY_ARCHIVE_SUFFIX)
+    )
+
+def write_archived_quarter(quarter, frame):
+    """压缩写入一个季度的归档（原子替换），同时写出分析用的列文件"""
+    os.makedirs(data_path(HISTORY_ARCHIVE_DIR), exist_ok=True)
+    path = _archive_path(quarter)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(zlib.compress(pickle.dumps(frame, protocol=pickle.HIGHEST_PROTOCOL)))
+    os.replace(tmp_path, path)
+    write_quarter_columns(quarter, frame)
+
+def _read_archived_quarter(quarter, archive_mtime):
+    with open(_archive_path(quarter), 'rb') as f:
+        return pickle.loads(zlib.decompress(f.read()))
+
+def load_archived_quarter(quarter, archive_mtime):
+    """解压一个归档季度（按修改时间区分版本，在当前数据集内按LRU缓存，多个会话共享，只读）"""
+    return current_tenant().archive_cache(quarter, archive_mtime)
+
+def archive_cold_quarters(current_year=None):
+    """把往年的季度从各地市分片的历史文件移入压缩归档，返回移动的季度
+
+    先写归档再从分片中删除，中途中断时数据至少保留一份；归档已有的季度合并后重写。
+    """
+    current_year = current_year or datetime.now().year
+    cities = list_shard_cities()
+    cold = {}
+    for city in cities:
+        history = _load_pickle(_shard_path(city, SHARD_HISTORY_SUFFIX), {})
+        for quarter, data in history.items():
+            if _quarter_year(quarter) < current_year:
+                cold.setdefault(quarter, {})[city] = _history_frame(data)
+    
+    for quarter, city_frames in cold.items():
+        parts = list(city_frames.values())
+        if os.path.exists(_archive_path(quarter)):
+            archived = load_archived_quarter(quarter, os.path.getmtime(_archive_path(quarter)))
+            parts.insert(0, archived[~archived['地市'].isin(city_frames)])
+        write_archived_quarter(quarter, pd.concat(parts, ignore_index=True))
+    
+    for city in cities:
+        if not any(city in city_frames for city_frames in cold.values()):
+            continue
+        with shard_lock(city):
+            history_path = _shard_path(city, SHARD_HISTORY_SUFFIX)
+            history = _load_pickle(history_path, {})
+            _dump_atomic({
+                quarter: data for quarter, data in history.items()
+                if _quarter_year(quarter) >= current_year
+            }, history_path)
+    return sorted(cold)
+
+def clear_archived_quarters():
+    """删除全部归档季度"""
+    for quarter in list_archived_quarters():
+        os.remove(_archive_path(quarter))
+    shutil.rmtree(data_path(HISTORY_COLUMNS_DIR), ignore_errors=True)
+
+# ========== 归档季度列文件 ==========
+# 每个归档季度另存一份定宽列文件：数值列为 .npy，文本列（地市、事务员等）字典编码为
+# int32 代码加字符串表。分析时用 np.load(mmap_mode='r') 内存映射，只读取用到的列，
+# 不解压、不复制，多个进程通过页缓存共享同一份数据。
+HISTORY_COLUMNS_DIR = os.path.join(HISTORY_ARCHIVE_DIR, 'columns')
+
+HISTORY_COLUMNS_MANIFEST = 'columns.json'
+
+def _columns_dir(quarter):
+    return data_path(HISTORY_COLUMNS_DIR, quarter)
+
+def write_quarter_columns(quarter, frame):
+    """把一个归档季度写成列文件（先写临时目录再整体替换）"""
+    os.makedirs(data_path(HISTORY_COLUMNS_DIR), exist_ok=True)
+    columns_dir = _columns_dir(quarter)
+    tmp_dir = f"{columns_dir}.{os.getpid()}.{threading.get_ident()}.tmp"
+    os.makedirs(tmp_dir)
+    manifest = {'rows': len(frame), 'columns': {}}
+    for i, column in enumerate(frame.columns):
+        values = frame[column].to_numpy()
+        file_name = f"c{i}.npy"
+        if np.issubdtype(values.dtype, np.number) or values.dtype == bool:
+            np.save(os.path.join(tmp_dir, file_name), values)
+            manifest['columns'][column] = {'file': file_name}
+        else:
+            codes, strings = pd.factorize(frame[column].astype(str))
+            np.save(os.path.join(tmp_dir, file_name), codes.astype(np.int32))
+            manifest['columns'][column] = {'file': file_name, 'strings': [str(value) for value in strings]}
+    with open(os.path.join(tmp_dir, HISTORY_COLUMNS_MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    
+    old_dir = f"{tmp_dir}.old"
+    if os.path.isdir(columns_dir):
+        os.replace(columns_dir, old_dir)
+    os.replace(tmp_dir, columns_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+class QuarterColumns:
+    """一个归档季度的列文件（内存映射，只读），按需打开用到的列"""
+
+    def __init__(self, quarter):
+        self.path = _columns_dir(quarter)
+        with open(os.path.join(self.path, HISTORY_COLUMNS_MANIFEST), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        self.rows = manifest['rows']
+        self.columns = manifest['columns']
+        self._arrays = {}
+        self._strings = {}
+        self._string_codes = {}
+
+    def raw(self, column):
+        """列的原始数组（数值或字典代码），内存映射不复制"""
+        if column not in self._arrays:
+            self._arrays[column] = np.load(os.path.join(self.path, self.columns[column]['file']), mmap_mode='r')
+        return self._arrays[column]
+
+    def strings(self, column):
+        """文本列的字符串表"""
+        if column not in self._strings:
+            self._strings[column] = np.array(self.columns[column]['strings'], dtype=object)
+        return self._strings[column]
+
+    def code_of(self, column, value):
+        """文本值在字符串表中的代码，不存在时返回-1"""
+        if column not in self._string_codes:
+            self._string_codes[column] = {string: code for code, string in enumerate(self.columns[column]['strings'])}
+        return self._string_codes[column].get(value, -1)
+
+    def values(self, column, positions=None):
+        """列的值（文本列解码为字符串），positions指定时只取这些行"""
+        raw = self.raw(column)
+        if positions is not None:
+            raw = raw[positions]
+        return self.strings(column)[raw] if 'strings' in self.columns[column] else raw
+
+    def row(self, position):
+        """一行的全部字段"""
+        return {column: self.values(column, [position])[0] for column in self.columns}
+
+def _open_quarter_columns(quarter, archive_mtime):
+    manifest_path = os.path.join(_columns_dir(quarter), HISTORY_COLUMNS_MANIFEST)
+    if not os.path.exists(manifest_path) or os.path.getmtime(manifest_path) < archive_mtime:
+        write_quarter_columns(quarter, load_archived_quarter(quarter, archive_mtime))
+    return QuarterColumns(quarter)
+
+def open_quarter_columns(quarter, archive_mtime):
+    """打开归档季度的列文件（按归档修改时间区分版本）；缺少列文件时从归档生成"""
+    return current_tenant().columns_cache(quarter, archive_mtime)
+
+def quarter_columns(quarter):
+    """归档季度的列文件，季度未归档时返回None"""
+    path = _archive_path(quarter)
+    if not os.path.exists(path):
+        return None
+    return open_quarter_columns(quarter, os.path.getmtime(path))
+
+def archived_city_summary(quarter, cities=None):
+    """用列文件按地市汇总归档季度：平均总分、平均档位和人数"""
+    columns = quarter_columns(quarter)
+    city_codes = columns.raw('地市')
+    city_names = columns.strings('地市')
+    counts = np.bincount(city_codes, minlength=len(city_names))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        summary = pd.DataFrame({
+            '总分': np.bincount(city_codes, weights=columns.raw('总分'), minlength=len(city_names)) / counts,
+            '档位': np.bincount(city_codes, weights=columns.raw('档位'), minlength=len(city_names)) / counts,
+            '事务员': counts
+        }, index=pd.Index(city_names, name='地市'))
+    summary = summary[summary['事务员'] > 0]
+    if cities is not None:
+        summary = summary[summary.index.isin(cities)]
+    return summary.sort_index().round(1)
+
+def archived_staff_positions(columns, staff_name):
+    """事务员在归档季度中的行位置（只比较整数代码）"""
+    code = columns.code_of('事务员', staff_name)
+    if code < 0:
+        return np.array([], dtype=np.int64)
+    return np.flatnonzero(columns.raw('事务员') == code)
+
+# ========== 审计日志 ==========
+# 每次修改按月追加到 data/audit/YYYY-MM.jsonl，每位事务员一行紧凑记录：
+# id 变更批次、t 时间（毫秒）、by 操作人、op 操作、c 地市、s 事务员、u 修改内容、o 修改前的值。
+# 只追加不改写，日志再大也不影响保存单条数据的开销。
+def audit_timestamp():
+    """审计记录时间戳（毫秒）"""
+    return time.time_ns() // 1_000_000
+
+def new_change_set_id():
+    """生成变更批次编号，同一次保存的所有记录共用一个编号"""
+    return f"{time.time_ns():x}"
+
+def _json_default(value):
+    """把numpy、时间等类型转换为JSON可写入的值"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (datetime, pd.Timestamp)):
+        return value.isoformat()
+    return str(value)
+
+def make_audit_record(change_set, timestamp, operator, operation, city, staff_name=None, updates=None, original=None):
+    """生成一条审计记录"""
+    return {
+        'id': change_set,
+        't': timestamp,
+        'by': operator,
+        'op': operation,
+        'c': city,
+        's': staff_name,
+        'u': updates or {},
+        'o': original or {}
+    }
+
+def _audit_month(timestamp):
+    """审计记录所属月份（日志按月分段）"""
+    return datetime.fromtimestamp(timestamp / 1000).strftime('%Y-%m')
+
+def _audit_segment_path(month):
+    return data_path(AUDIT_DIR, f"{month}.jsonl")
+
+def append_audit_records(records):
+    """追加审计记录"""
+    if not records:
+        return
+    lines_by_month = {}
+    for record in records:
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=_json_default)
+        lines_by_month.setdefault(_audit_month(record['t']), []).append(line + '\n')
+    
+    os.makedirs(data_path(AUDIT_DIR), exist_ok=True)
+    with _exclusive_lock('__audit__', data_path(AUDIT_DIR, '.lock')):
+        for month, lines in lines_by_month.items():
+            with open(_audit_segment_path(month), 'a', encoding='utf-8') as f:
+                f.write(''.join(lines))
+
+def import_legacy_history(data_history, name_to_city):
+    """把旧版按事务员保存的变更记录转为审计记录"""
+    records = []
+    for staff_name, history in data_history.items():
+        for item in history:
+            updated_at = datetime.strptime(item['时间'], '%Y-%m-%d %H:%M:%S')
+            timestamp = int(updated_at.timestamp() * 1000)
+            records.append(make_audit_record(
+                f"legacy-{timestamp:x}", timestamp, '未知', item.get('操作', '更新数据'),
+                name_to_city.get(staff_name), staff_name,
+                item.get('更新内容'), item.get('原始数据')
+            ))
+    records.sort(key=lambda record: record['t'])
+    append_audit_records(records)
+
+class AuditSegment:
+    """单个月份的日志段：增量读取新追加的行，维护按事务员、地市、操作人、变更批次的位置索引"""
+
+    INDEXED_FIELDS = ('s', 'c', 'by', 'id')
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.records = []
+        self.times = np.empty(0, dtype=np.int64)
+        self.indexes = {field: {} for field in self.INDEXED_FIELDS}
+
+    def refresh(self):
+        """读取上次之后追加的完整行"""
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            size = 0
+        if size < self.offset:
+            self.__init__(self.path)
+        if size == self.offset:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            chunk = f.read(size - self.offset)
+        # 只处理完整的行，写了一半的行留到下次读取
+        end = chunk.rfind(b'\n') + 1
+        new_times = []
+        for line in chunk[:end].splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            position = len(self.records)
+            self.records.append(record)
+            new_times.append(record['t'])
+            for field in self.INDEXED_FIELDS:
+                self.indexes[field].setdefault(record.get(field), []).append(position)
+        self.times = np.concatenate([self.times, np.asarray(new_times, dtype=np.int64)])
+        self.offset += end
+
+    def match(self, filters, start=None, end=None):
+        """按索引字段和时间范围筛选，返回按写入顺序排列的位置数组"""
+        positions = None
+        for field, value in filters.items():
+            if value is None:
+                continue
+            found = np.asarray(self.indexes[field].get(value, []), dtype=np.int64)
+            positions = found if positions is None else np.intersect1d(positions, found, assume_unique=True)
+        if positions is None:
+            positions = np.arange(len(self.records))
+        if start is not None or end is not None:
+            times = self.times[positions]
+            keep = np.ones(len(positions), dtype=bool)
+            if start is not None:
+                keep &= times >= start
+            if end is not None:
+                keep &= times < end
+            positions = positions[keep]
+        return positions
+
+class AuditLog:
+    """进程内共享的审计日志读取器，按月缓存各日志段及其索引"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._segments = {}
+
+    def _segments_between(self, start=None, end=None):
+        if not os.path.isdir(data_path(AUDIT_DIR)):
+            return []
+        first = _audit_month(start) if start is not None else None
+        last = _audit_month(end) if end is not None else None
+        months = sorted(
+            name[:-len('.jsonl')] for name in os.listdir(data_path(AUDIT_DIR))
+            if name.endswith('.jsonl')
+        )
+        segments = []
+        with self._lock:
+            for month in months:
+                if (first and month < first) or (last and month > last):
+                    continue
+                path = _audit_segment_path(month)
+                segment = self._segments.setdefault(path, AuditSegment(path))
+                segment.refresh()
+                segments.append(segment)
+        return segments
+
+    def query(self, staff=None, city=None, operator=None, change_set=None,
+              start=None, end=None, page=1, page_size=AUDIT_PAGE_SIZE):
+        """分页查询审计记录（最新的在前），返回 (总条数, 当页记录)"""
+        filters = {'s': staff, 'c': city, 'by': operator, 'id': change_set}
+        matches = [
+            (segment, segment.match(filters, start, end))
+            for segment in reversed(self._segments_between(start, end))
+        ]
+        total = sum(len(positions) for _, positions in matches)
+        
+        skip = (page - 1) * page_size
+        records = []
+        for segment, positions in matches:
+            if skip >= len(positions):
+                skip -= len(positions)
+                continue
+            positions = positions[::-1][skip:skip + page_size - len(records)]
+            records.extend(segment.records[position] for position in positions)
+            skip = 0
+            if len(records) >= page_size:
+                break
+        return total, records
+
+    def find(self, staff=None, city=None, operator=None, change_set=None, start=None, end=None):
+        """返回全部符合条件的记录（按写入顺序）"""
+        filters = {'s': staff, 'c': city, 'by': operator, 'id': change_set}
+        records = []
+        for segment in self._segments_between(start, end):
+            records.extend(segment.records[position] for position in segment.match(filters, start, end))
+        return records
+
+    def replay(self, city, start, end):
+        """按写入顺序返回某地市在 [start, end) 时间范围内的事务员修改记录"""
+        records = []
+        for segment in self._segments_between(start, end):
+            positions = segment.match({'c': city}, start, end)
+            records.extend(
+                segment.records[position] for position in positions
+                if segment.records[position].get('s') is not None
+            )
+        return records
+
+    def clear(self):
+        """丢弃已读入的日志段和索引，下次查询时重新读取"""
+        with self._lock:
+            self._segments = {}
+
+    def values(self, field):
+        """某个索引字段出现过的所有取值（用于筛选下拉框）"""
+        found = set()
+        for segment in self._segments_between():
+            found.update(key for key in segment.indexes[field] if key is not None)
+        return sorted(found)
+
+    def memory_bytes(self):
+        """已读入的日志段和索引占用的内存"""
+        with self._lock:
+            segments = list(self._segments.values())
+        return deep_sizeof(segments)
+
+    def count(self):
+        """明细记录总数"""
+        return sum(len(segment.records) for segment in self._segments_between())
+
+    def forget(self, path):
+        with self._lock:
+            self._segments.pop(path, None)
+
+def get_audit_log():
+    """当前数据集在进程内共享的审计日志读取器"""
+    return current_tenant().audit_log
+
+def rollup_audit_log(retention_months=AUDIT_RETENTION_MONTHS):
+    """把超过保留期限的明细日志按月汇总（地市、操作人、操作的记录数），并删除明细，返回归档的月数"""
+    now = datetime.now()
+    month_index = now.year * 12 + now.month - 1 - retention_months
+    cutoff = f"{month_index // 12:04d}-{month_index % 12 + 1:02d}"
+    if not os.path.isdir(data_path(AUDIT_DIR)):
+        return 0
+    expired = sorted(
+        name[:-len('.jsonl')] for name in os.listdir(data_path(AUDIT_DIR))
+        if name.endswith('.jsonl') and name[:-len('.jsonl')] <= cutoff
+    )
+    if not expired:
+        return 0
+    
+    with _exclusive_lock('__audit__', data_path(AUDIT_DIR, '.lock')):
+        rollup = {}
+        rollup_file = data_path(AUDIT_ROLLUP_FILE)
+        if os.path.exists(rollup_file):
+            with open(rollup_file, 'r', encoding='utf-8') as f:
+                rollup = json.load(f)
+        for month in expired:
+            segment = AuditSegment(_audit_segment_path(month))
+            segment.refresh()
+            frame = pd.DataFrame({
+                '地市': [record.get('c') for record in segment.records],
+                '操作人': [record.get('by') for record in segment.records],
+                '操作': [record.get('op') for record in segment.records],
+                '事务员': [record.get('s') for record in segment.records]
+            })
+            summary = frame.groupby(['地市', '操作人', '操作'], dropna=False).agg(
+                记录数=('操作', 'size'),
+                事务员数=('事务员', 'nunique')
+            ).reset_index()
+            rollup[month] = summary.to_dict('records')
+        
+        tmp_path = f"{rollup_file}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(rollup, f, ensure_ascii=False, default=_json_default)
+        os.replace(tmp_path, rollup_file)
+        for month in expired:
+            os.remove(_audit_segment_path(month))
+            get_audit_log().forget(_audit_segment_path(month))
+    
+    # 明细已归档的时间段无法再回放，只保留每个地市在此之前的最后一个快照
+    cutoff_ms = int(datetime(month_index // 12 + (month_index % 12 + 1) // 12,
+                             (month_index % 12 + 1) % 12 + 1, 1).timestamp() * 1000)
+    for city in list_snapshot_cities():
+        expired_snapshots = [t for t in list_snapshot_times(city) if t < cutoff_ms][:-1]
+        for timestamp in expired_snapshots:
+            os.remove(_snapshot_path(city, timestamp))
+    return len(expired)
+
+def format_audit_records(records):
+    """把审计记录转换为表格显示"""
+    return pd.DataFrame([{
+        '时间': datetime.fromtimestamp(record['t'] / 1000).strftime('%Y-%m-%d %H:%M:%S'),
+        '操作人': record.get('by'),
+        '操作': record.get('op'),
+        '地市': record.get('c'),
+        '事务员': record.get('s') or '（整体操作）',
+        '修改内容': json.dumps(record.get('u') or {}, ensure_ascii=False, default=_json_default),
+        '修改前': json.dumps(record.get('o') or {}, ensure_ascii=False, default=_json_default),
+        '批次': record.get('id')
+    } for record in records])
+
+def _changed_fields(record):
+    """审计记录中值确实发生变化的字段，返回 {字段: 修改前的值}"""
+    updates = record.get('u') or {}
+    return {
+        field: value for field, value in (record.get('o') or {}).items()
+        if field in updates and updates[field] != value
+    }
+
+def plan_rollback(records):
+    """根据选中的审计记录生成回滚方案
+
+    每个字段恢复为选中记录中最早一次修改前的值；如果该字段之后还被未选中的修改改动过，
+    回滚会抹掉别人的后续工作，因此跳过。返回 ({事务员: {字段: 恢复值}}, 跳过的字段列表)。
+    """
+    selected = {(record['id'], record['s']) for record in records}
+    first_change = {}
+    for record in sorted(records, key=lambda item: item['t']):
+        if record.get('s') is None:
+            continue
+        fields = first_change.setdefault(record['s'], {})
+        for field, value in _changed_fields(record).items():
+            fields.setdefault(field, (record['t'], value))
+    
+    audit_log = get_audit_log()
+    updates = {}
+    skipped = []
+    for staff_name, fields in first_change.items():
+        earliest = min(t for t, _ in fields.values())
+        later_fields = {}
+        for record in audit_log.find(staff=staff_name, start=earliest):
+            if (record['id'], record['s']) not in selected:
+                for field in _changed_fields(record):
+                    later_fields.setdefault(field, []).append(record)
+        for field, (t, value) in fields.items():
+            later = next((record for record in later_fields.get(field, []) if record['t'] >= t), None)
+            if later is not None:
+                skipped.append({
+                    '事务员': staff_name,
+                    '字段': field,
+                    '原因': f"{datetime.fromtimestamp(later['t'] / 1000).strftime('%m-%d %H:%M')} 已被{later.get('by')}再次修改"
+                })
+                continue
+            updates.setdefault(staff_name, {})[field] = value
+    return updates, skipped
+
+# ========== 数据快照与时点还原 ==========
+# 每个地市定期（以及每次整体写入时）保存一份快照，还原某一时刻的数据时
+# 取该时刻之前最近的快照，再回放其后的审计记录，回放量不超过一个快照间隔。
+def _snapshot_dir(city):
+    return data_path(SNAPSHOT_DIR, quote(str(city), safe=''))
+
+def _snapshot_path(city, timestamp):
+    return os.path.join(_snapshot_dir(city), f"{timestamp}.pkl")
+
+def _link_or_copy(src, dst):
+    """硬链接文件（不支持硬链接时复制）
+
+    数据文件都是写临时文件后原子替换的，已链接出去的旧文件内容不会再变，
+    硬链接就是零拷贝的只读快照。
+    """
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def link_snapshot(city):
+    """把地市分片的当前文件链接为快照（在分片锁内调用），返回快照时间戳"""
+    timestamp = audit_timestamp()
+    _link_or_copy(_shard_path(city), _snapshot_path(city, timestamp))
+    return timestamp
+
+def link_snapshot_if_due(city, shard):
+    """距上次快照已超过间隔时，把修改前的分片文件链接为快照
+
+    在分片锁内、取本次审计记录的时间戳之前调用，时点还原从快照开始回放之后的记录。
+    """
+    if audit_timestamp() - shard.get('snapshot_at', 0) >= SNAPSHOT_INTERVAL_MS:
+        shard['snapshot_at'] = link_snapshot(city)
+
+def _dump_shard_with_snapshot(city, shard, quarter_history=None):
+    """写入分片并把新文件链接为快照（在分片锁内调用），返回新的分片版本号"""
+    shard['snapshot_at'] = audit_timestamp()
+    version = _dump_shard(city, shard, quarter_history)
+    _link_or_copy(_shard_path(city), _snapshot_path(city, shard['snapshot_at']))
+    return version
+
+def list_snapshot_cities():
+    """列出有快照的地市（包括已删除的地市）"""
+    if not os.path.isdir(data_path(SNAPSHOT_DIR)):
+        return []
+    return sorted(unquote(name) for name in os.listdir(data_path(SNAPSHOT_DIR)))
+
+def list_snapshot_times(city):
+    """某地市所有快照的时间戳（升序）"""
+    if not os.path.isdir(_snapshot_dir(city)):
+        return []
+    return sorted(
+        int(name[:-len('.pkl')]) for name in os.listdir(_snapshot_dir(city))
+        if name.endswith('.pkl')
+    )
+
+def reconstruct_city(city, as_of):
+    """还原某地市在as_of时刻（毫秒）的数据，该时刻之前没有快照时返回None"""
+    times = list_snapshot_times(city)
+    i = bisect.bisect_right(times, as_of) - 1
+    if i < 0:
+        return None
+    snapshot = _load_pickle(_snapshot_path(city, times[i]))
+    quarter = snapshot.get('quarter')
+    # 浅拷贝：回放只复制被修改的列
+    df = snapshot['performance_data'].copy(deep=False)
+    labels = dict(zip(df['事务员'], df.index))
+    
+    # 回放快照之后的修改（记录保存的是修改后的值，重复回放结果不变）
+    touched_rows = set()
+    for record in get_audit_log().replay(city, times[i], as_of + 1):
+        label = labels.get(record['s'])
+        if label is None:
+            continue
+        for key, value in record['u'].items():
+            if key in df.columns:
+                df.at[label, key] = value
+        touched_rows.add(label)
+    
+    if touched_rows and quarter:
+        df = calculate_performance(df, quarter, rows=sorted(touched_rows))
+    return df
+
+def reconstruct_as_of(as_of, cities):
+    """还原多个地市在as_of时刻的数据"""
+    frames = [reconstruct_city(city, as_of) for city in cities]
+    frames = [frame for frame in frames if frame is not None]
+    return pd.concat(frames).sort_index() if frames else None
+
+# ========== 并发写入（行版本 + 比较交换） ==========
+def _same_value(a, b):
+    """比较两个单元格的值（都为空也视为相同）"""
+    if pd.isna(a) and pd.isna(b):
+        return True
+    return a == b
+
+def _row_changes(new_df, old_df):
+    """逐行比较new_df与old_df，返回 {事务员: (变化后的值, 变化前的值)}，新增的行变化前的值为空"""
+    new = new_df.set_index('事务员')
+    old = new.iloc[0:0] if old_df is None else old_df.set_index('事务员')
+    changes = {
+        name: (new.loc[name].to_dict(), {})
+        for name in new.index.difference(old.index)
+    }
+    
+    common = new.index.intersection(old.index)
+    columns = new.columns.intersection(old.columns)
+    a = new.loc[common, columns]
+    b = old.loc[common, columns]
+    differs = ~((a == b) | (a.isna() & b.isna()))
+    for row, col in zip(*np.nonzero(differs.to_numpy())):
+        updates, original = changes.setdefault(common[row], ({}, {}))
+        updates[columns[col]] = a.iat[row, col]
+        original[columns[col]] = b.iat[row, col]
+    
+    # 新增的列视为从空值修改
+    for column in new.columns.difference(old.columns):
+        for name in common:
+            updates, original = changes.setdefault(name, ({}, {}))
+            updates[column] = new.at[name, column]
+            original[column] = None
+    return changes
+
+@timed('shard_patch')
+def cas_patch_shard(city, patches, operation, operator, change_set, quarter):
+    """在地市分片锁内按行版本比较后应用字段修改，写入的每位事务员记一条审计记录
+
+    patches为 {事务员: {'updates': 修改, 'base_version': 读取时的行版本, 'base_values': 读取时的原值}}。
+    base_version为None时不做比较直接写入（外部系统推送的数据以推送方为准）。
+    行版本未变的直接写入；行已被他人修改时，只要本次修改的字段没有被对方改动就自动合并，
+    否则记为冲突，不写入该事务员。返回 (最新分片, 写入人数, 冲突列表)。
+    """
+    conflicts = []
+    applied_rows = []
+    audit_records = []
+    with shard_lock(city):
+        shard = _read_shard_for_write(city)
+        df = shard['performance_data']
+        if df is None:
+            return shard, 0, conflicts
+        link_snapshot_if_due(city, shard)
+        shard['quarter'] = quarter
+        timestamp = audit_timestamp()
+        labels = dict(zip(df['事务员'], df.index))
+        row_versions = shard['row_versions']
+        
+        for staff_name, patch in patches.items():
+            label = labels.get(staff_name)
+            if label is None:
+                continue
+            updates = patch['updates']
+            if patch['base_version'] is not None and row_versions.get(staff_name, 0) != patch['base_version']:
+                clashes = [
+                    key for key in updates
+                    if not _same_value(df.at[label, key], patch['base_values'].get(key))
+                    and not _same_value(df.at[label, key], updates[key])
+                ]
+                if clashes:
+                    for key in clashes:
+                        conflicts.append({
+                            '事务员': staff_name,
+                            '地市': city,
+                            '字段': key,
+                            '修改前': patch['base_values'].get(key),
+                            '我的修改': updates[key],
+                            '当前已保存值': df.at[label, key]
+                        })
+                    continue
+            
+            original_data = {key: df.at[label, key] for key in updates}
+            for key, value in updates.items():
+                df.at[label, key] = value
+            row_versions[staff_name] = row_versions.get(staff_name, 0) + 1
+            audit_records.append(make_audit_record(
+                change_set, timestamp, operator, operation, city,
+                staff_name, updates, original_data
+            ))
+            applied_rows.append(label)
+        
+        if applied_rows:
+            # 只重新计算写入的行
+            shard['performance_data'] = calculate_performance(df, quarter, rows=applied_rows)
+            _dump_shard(city, shard)
+            get_metrics().inc('performance_saves_total', 1, (('tenant', current_tenant().name), ('kind', 'patch')))
+            append_audit_records(audit_records)
+            changed_rows = shard['performance_data'].loc[applied_rows]
+            publish_change(
+                city, shard['version'], changed_rows,
+                {name: row_versions[name] for name in changed_rows['事务员']}
+            )
+    return shard, len(applied_rows), conflicts
+
+def _merge_stale_rows(city, rows, base_df, disk_rows):
+    """把整体写入中加载后已被他人修改的行按字段合并到磁盘上的最新数据
+
+    本次修改的字段为与加载时（base_df）不同的输入字段，计算结果列写入后重新计算，不参与比较。
+    对方没有改动（或改成了相同值）的字段合并写入，双方都改动的字段记为冲突并保留磁盘上的值。
+    返回 (合并后的行（沿用磁盘上的行标签）, 冲突列表)。
+    """
+    merged = disk_rows.copy()
+    conflicts = []
+    base = (rows.iloc[0:0] if base_df is None else base_df).drop_duplicates('事务员', keep='last').set_index('事务员')
+    labels = dict(zip(disk_rows['事务员'], disk_rows.index))
+    columns = [
+        col for col in rows.columns
+        if col in disk_rows.columns and col != '事务员' and col not in PERFORMANCE_RESULT_COLUMNS
+    ]
+    for staff_name, row in rows.set_index('事务员')[columns].iterrows():
+        label = labels[staff_name]
+        base_row = base.loc[staff_name] if staff_name in base.index else None
+        for key in columns:
+            base_value = None if base_row is None else base_row[key]
+            if base_row is not None and _same_value(row[key], base_value):
+                continue
+            disk_value = merged.at[label, key]
+            if _same_value(disk_value, row[key]):
+                continue
+            if _same_value(disk_value, base_value):
+                merged.at[label, key] = row[key]
+            else:
+                conflicts.append({
+                    '事务员': staff_name,
+                    '地市': city,
+                    '字段': key,
+                    '修改前': base_value,
+                    '我的修改': row[key],
+                    '当前已保存值': disk_value
+                })
+    return merged, conflicts
+
+@timed('shard_write')
+def cas_write_shard(city, city_df, base_versions, quarter_history=None, force=False, quarter=None,
+                    operation=None, operator=None, change_set=None, base_df=None):
+    """在地市分片锁内整体写入一个地市的数据
+
+    加载后已被其他用户修改的行（行版本与加载时不同）按字段合并：base_df为加载时的数据，
+    本次修改而对方未改动的字段写入，双方都改动的字段保留磁盘上的值并记为冲突。
+    返回 (最新分片, 冲突列表)；force=True时直接以city_df为准。
+    指定operation时，每个有变化的行按字段记一条审计记录（可回放、可回滚）。
+    """
+    with shard_lock(city):
+        shard = _read_shard_for_write(city)
+        disk_df = shard['performance_data']
+        disk_versions = shard['row_versions']
+        
+        if disk_df is None or force:
+            conflicts = []
+            merged = city_df
+            changes = _row_changes(city_df, disk_df)
+        else:
+            stale = disk_df['事务员'].isin(city_df['事务员']) & (
+                disk_df['事务员'].map(lambda name: disk_versions.get(name, 0) != base_versions.get(name, 0))
+            )
+            stale_names = disk_df.loc[stale, '事务员']
+            written = city_df[~city_df['事务员'].isin(stale_names)]
+            stale_rows, conflicts = _merge_stale_rows(
+                city, city_df[city_df['事务员'].isin(stale_names)], base_df, disk_df[stale]
+            )
+            if quarter and not stale_rows.empty:
+                # 合并后的行按合并结果重新计算
+                stale_rows = calculate_performance(stale_rows, quarter)
+            written = pd.concat([written, stale_rows])
+            merged = pd.concat([written, disk_df[~disk_df['事务员'].isin(city_df['事务员'])]]).sort_index()
+            changes = _row_changes(written, disk_df)
+        
+        row_versions = {name: disk_versions.get(name, 0) for name in merged['事务员']}
+        for name in changes:
+            row_versions[name] = row_versions.get(name, 0) + 1
+        
+        # 修改都记了审计记录且事务员没有增减时可以从上一个快照回放，按间隔保存快照；
+        # 否则时点还原无法回放这次写入，写入后立即保存快照
+        replayable = bool(operation) and disk_df is not None and set(merged['事务员']) == set(disk_df['事务员'])
+        if replayable:
+            link_snapshot_if_due(city, shard)
+        timestamp = audit_timestamp()
+        shard['performance_data'] = merged
+        shard['row_versions'] = row_versions
+        shard['quarter'] = quarter
+        if replayable:
+            _dump_shard(city, shard, quarter_history)
+        else:
+            _dump_shard_with_snapshot(city, shard, quarter_history)
+        get_metrics().inc('performance_saves_total', 1, (('tenant', current_tenant().name), ('kind', 'write')))
+        if operation:
+            append_audit_records([
+                make_audit_record(change_set, timestamp, operator, operation, city, name, updates, original)
+                for name, (updates, original) in changes.items()
+            ])
+        publish_change(city, shard['version'])
+    return shard, conflicts
+
+@timed('shard_import')
+def cas_import_shard(city, rows, removed_names, quarter, operation, operator, change_set):
+    """在地市分片锁内以导入数据为准写入指定事务员，返回最新分片（地市已没有事务员时删除分片并返回None）
+
+    rows中的事务员不比较行版本：已在分片中的只覆盖导入数据中有值的列，新事务员追加到分片
+    （rows的行标签即新行的标签）；removed_names为已调到其他地市的事务员，从本分片移出。
+    其他事务员保持磁盘上的数据和行版本，只重新计算导入的行。
+    """
+    with shard_lock(city):
+        shard = _read_shard_for_write(city)
+        disk_df = shard['performance_data']
+        if disk_df is None:
+            disk_df = rows.iloc[0:0]
+        row_versions = shard['row_versions']
+        
+        # 已在分片中的事务员沿用分片中的行标签
+        labels = dict(zip(disk_df['事务员'], disk_df.index))
+        rows = rows.set_axis([labels.get(name, label) for name, label in zip(rows['事务员'], rows.index)])
+        imported = disk_df['事务员'].isin(rows['事务员'])
+        columns = list(disk_df.columns) + [col for col in rows.columns if col not in disk_df.columns]
+        updated = rows.combine_first(disk_df[imported])[columns]
+        # 导入数据中没有的数值按未填报（0）处理，能无损转换时保持分片原有的列类型
+        for col in disk_df.columns:
+            if pd.api.types.is_numeric_dtype(disk_df[col]):
+                values = updated[col].fillna(0)
+                cast = values.astype(disk_df[col].dtype)
+                updated[col] = cast if (cast == values).all() else values
+        merged = pd.concat([disk_df[~imported & ~disk_df['事务员'].isin(removed_names)], updated]).sort_index()
+        
+        if merged.empty:
+            shard = None
+        else:
+            merged = calculate_performance(merged, quarter, rows=updated.index)
+            changes = _row_changes(merged.loc[updated.index], disk_df)
+            for name in removed_names:
+                row_versions.pop(name, None)
+            for name in changes:
+                row_versions[name] = row_versions.get(name, 0) + 1
+            
+            # 只覆盖已有事务员时可以从上一个快照回放，按间隔保存快照；有事务员调入调出时立即保存快照
+            replayable = not removed_names and imported.sum() == len(updated)
+            if replayable:
+                link_snapshot_if_due(city, shard)
+            timestamp = audit_timestamp()
+            shard['performance_data'] = merged
+            shard['quarter'] = quarter
+            if replayable:
+                _dump_shard(city, shard)
+            else:
+                _dump_shard_with_snapshot(city, shard)
+            get_metrics().inc('performance_saves_total', 1, (('tenant', current_tenant().name), ('kind', 'import')))
+            append_audit_records([
+                make_audit_record(change_set, timestamp, operator, operation, city, name, updates, original)
+                for name, (updates, original) in changes.items()
+            ])
+            # 有事务员调出时会话需要重新读取整个分片
+            changed_rows = merged.loc[updated.index]
+            publish_change(
+                city, shard['version'], None if removed_names else changed_rows,
+                {name: row_versions[name] for name in changed_rows['事务员']}
+            )
+    if shard is None:
+        delete_shard(city)
+    return shard
+
+# ========== 变更通知 ==========
+def publish_change(city, shard_version, rows=None, row_versions=None):
+    """向变更日志追加一条地市变更（在分片锁内调用，日志顺序与写入顺序一致）
+
+    rows为该次写入后的变化行；为None表示整个地市已被整体改写，读取方需重新读取该地市分片。
+    """
+    entry = pickle.dumps({
+        'city': city,
+        'version': shard_version,
+        'rows': rows,
+        'row_versions': row_versions or {}
+    }, protocol=pickle.HIGHEST_PROTOCOL)
+    feed_file = data_path(FEED_FILE)
+    with _exclusive_lock('__feed__', feed_file + '.lock'):
+        if os.path.exists(feed_file) and os.path.getsize(feed_file) > FEED_MAX_BYTES:
+            # 日志过大时轮换，读取方发现文件变化后整体重新加载
+            os.replace(feed_file, feed_file + '.1')
+        with open(feed_file, 'ab') as f:
+            f.write(entry)
+
+def feed_position():
+    """变更日志当前位置（文件标识, 长度），长度只增不减，可作为全局数据版本号"""
+    try:
+        stat = os.stat(data_path(FEED_FILE))
+    except FileNotFoundError:
+        return (None, 0)
+    return (stat.st_ino, stat.st_size)
+
+def read_changes(position):
+    """从上次读到的位置读取新的变更，返回 (变更列表, 新位置)
+
+    日志已轮换时变更列表为None，调用方需要整体重新加载。
+    """
+    last_ino, last_offset = position
+    try:
+        f = open(data_path(FEED_FILE), 'rb')
+    except FileNotFoundError:
+        return [], position
+    with f:
+        stat = os.fstat(f.fileno())
+        if (last_ino is not None and stat.st_ino != last_ino) or stat.st_size < last_offset:
+            return None, (stat.st_ino, stat.st_size)
+        entries = []
+        f.seek(last_offset)
+        while f.tell() < stat.st_size:
+            start = f.tell()
+            try:
+                entries.append(pickle.load(f))
+            except (EOFError, pickle.UnpicklingError):
+                # 正在写入的记录留到下次读取
+                f.seek(start)
+                break
+        return entries, (stat.st_ino, f.tell())
+
+# ========== 季度管理函数 ==========
+def get_current_quarter():
+    """获取当前季度"""
+    today = datetime.now()
+    month = today.month
+    year = today.year
+    
+    if month in [1, 2, 3]:
+        return f"{year}年Q1季度"
+    elif month in [4, 5, 6]:
+        return f"{year}年Q2季度"
+    elif month in [7, 8, 9]:
+        return f"{year}年Q3季度"
+    else:
+        return f"{year}年Q4季度"
+
+def get_quarter_months(quarter):
+    """获取季度对应的月份"""
+    quarter_map = {
+        "Q1季度": ["1月", "2月", "3月"],
+        "Q2季度": ["4月", "5月", "6月"],
+        "Q3季度": ["7月", "8月", "9月"],
+        "Q4季度": ["10月", "11月", "12月"]
+    }
+    for key, months in quarter_map.items():
+        if key in quarter:
+            return months
+    return []
+
+def archive_quarter_records(df, quarter):
+    """把一个季度的数据压缩为历史记录（只保留关键字段）"""
+    key_columns = ['行号', '地市', '事务员', '分销均季度', '条盒均季度', 
+                  '分销得分', '条盒回收得分', '核心户得分', '综合得分', 
+                  '总分', '档位', '预估月薪', '季度目标档位']
+    return df[key_columns].assign(季度=quarter).reset_index(drop=True)
+
+def reset_quarter_columns(df, quarter, target_grade=6):
+    """原地清零指定季度的月度数据、可编辑字段和计算结果，并设置目标档位"""
+    reset_columns = []
+    for month in get_quarter_months(quarter):
+        reset_columns.extend([f'分销_{month}', f'条盒_{month}'])
+    # 其他可编辑字段和计算结果（重新计算时会生成）
+    reset_columns += ['核心户数', '综合评分', '分销均季度', '条盒均季度', '分销得分', '条盒回收得分', 
+                     '核心户得分', '综合得分', '总分', '档位', '预估月薪']
+    for col in reset_columns:
+        if col in df.columns:
+            df[col] = 0
+    df['季度目标档位'] = target_grade
+    return df
+
+# ========== 季度切换任务 ==========
+ROLLOVER_DIR = 'rollover'
+ROLLOVER_CHECK_SECONDS = 60
+
+def _rollover_done_path(quarter):
+    return data_path(ROLLOVER_DIR, f"{quarter}.done")
+
+def rollover_done(quarter):
+    """该季度的切换是否已完成"""
+    return os.path.exists(_rollover_done_path(quarter))
+
+def rollover_shard(city, outgoing, incoming, target_grade, operator, change_set):
+    """在地市分片锁内把一个地市切换到新季度：归档离开的季度，原地清零月度数据
+
+    分片已是新季度时跳过，中途中断后重新执行不会重复清零。
+    """
+    with shard_lock(city):
+        shard = _read_shard_for_write(city)
+        df = shard['performance_data']
+        if df is None or shard.get('quarter') == incoming:
+            return None
+        
+        quarter_history = _load_pickle(_shard_path(city, SHARD_HISTORY_SUFFIX), {})
+        if outgoing:
+            quarter_history[outgoing] = archive_quarter_records(df, outgoing)
+        
+        before = df.copy(deep=False)
+        reset_quarter_columns(df, outgoing, target_grade)
+        changes = _row_changes(df, before)
+        row_versions = shard['row_versions']
+        for name in changes:
+            row_versions[name] = row_versions.get(name, 0) + 1
+        
+        timestamp = audit_timestamp()
+        shard['quarter'] = incoming
+        _dump_shard_with_snapshot(city, shard, quarter_history)
+        append_audit_records([
+            make_audit_record(change_set, timestamp, operator, '季度重置', city, name, updates, original)
+            for name, (updates, original) in changes.items()
+        ])
+        publish_change(city, shard['version'])
+    return shard
+
+def run_quarter_rollover(target_grade=6, backup=None):
+    """季度切换：每个季度边界只执行一次，返回本次是否执行了切换
+
+    文件锁保证同一时刻只有一个进程执行，<季度>.done 标记保证完成后不再重复；
+    各地市分片并行切换，完成后更新全局信息，会话通过变更流和季度标记获取新数据。
+    backup为切换前的备份函数（参数为备份名称），默认在当前线程内直接备份。
+    """
+    incoming = get_current_quarter()
+    if rollover_done(incoming):
+        return False
+    os.makedirs(data_path(ROLLOVER_DIR), exist_ok=True)
+    with _exclusive_lock('__rollover__', data_path(ROLLOVER_DIR, 'rollover.lock')):
+        if rollover_done(incoming):
+            return False
+        meta = load_meta()
+        if not meta:
+            # 还没有数据，初始化时直接使用当前季度
+            return False
+        
+        outgoing = meta.get('current_quarter')
+        cities = []
+        if outgoing != incoming:
+            (backup or backup_now)('季度重置前备份')
+            change_set = new_change_set_id()
+            
+            def roll(city):
+                return rollover_shard(city, outgoing, incoming, target_grade, '系统', change_set)
+            
+            all_cities = list_shard_cities()
+            cities = [city for city, shard in zip(all_cities, parallel_map(roll, all_cities)) if shard is not None]
+            
+            meta['current_quarter'] = incoming
+            meta['last_reset'] = incoming
+            write_meta(meta)
+            # 往年的季度移入压缩归档
+            archive_cold_quarters(_quarter_year(incoming))
+        
+        with open(_rollover_done_path(incoming), 'w', encoding='utf-8') as f:
+            json.dump({
+                'quarter': incoming,
+                'previous': outgoing,
+                'cities': cities,
+                'finished_at': datetime.now().isoformat(timespec='seconds')
+            }, f, ensure_ascii=False)
+    return outgoing != incoming
+
+class QuarterRolloverJob:
+    """后台季度切换线程（处理创建时的当前数据集）：定期检查季度边界，登录时也可立即唤醒"""
+
+    def __init__(self, backup=None):
+        self.backup = backup
+        self.last_result = None
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = start_thread(self._run, 'quarter-rollover')
+
+    def trigger(self):
+        self._wakeup.set()
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                if run_quarter_rollover(backup=self.backup):
+                    self.last_result = (datetime.now(), True, f"已切换到{get_current_quarter()}")
+            except Exception as e:
+                self.last_result = (datetime.now(), False, f"季度切换失败：{str(e)}")
+            self._wakeup.wait(timeout=ROLLOVER_CHECK_SECONDS)
+            self._wakeup.clear()
+
+def check_grade_warning(current_grade, target_grade):
+    """检查档位是否需要提醒"""
+    if current_grade > target_grade:
+        return "danger", f"⚠️ 警告：当前档位为{current_grade}档，低于目标{target_grade}档！"
+    elif current_grade == target_grade:
+        return "warning", f"📊 注意：当前档位为{current_grade}档，刚好达到目标。"
+    else:
+        return "success", f"✅ 优秀：当前档位为{current_grade}档，超过目标{target_grade}档！"
+
+# ========== 评分计算函数 ==========
+# 评分规则表：(下限, 得分)，按下限从高到低排列，取第一个满足的档次
+DISTRIBUTION_SCORE_TABLE = [(1000, 25), (601, 20), (301, 15), (151, 10), (61, 5)]
+RECYCLING_SCORE_TABLE = [(1000, 35), (801, 30), (601, 25), (401, 20), (301, 15), (201, 10), (181, 5)]
+CORE_CUSTOMER_SCORE_TABLE = [(31, 20), (26, 15), (21, 10), (16, 5)]
+# 档位规则表：(总分下限, 档位, 月薪)，低于所有下限时为10档
+SALARY_GRADE_TABLE = [
+    (91, 1, 6000), (81, 2, 5500), (71, 3, 5000), (61, 4, 4700), (51, 5, 4400),
+    (46, 6, 4100), (41, 7, 3900), (36, 8, 3700), (31, 9, 3500)
+]
+LOWEST_GRADE = (10, 3300)
+
+def default_scoring_rules():
+    """默认评分规则（数据集未单独配置时使用），数据集配置中可按相同的名称覆盖"""
+    return {
+        'DISTRIBUTION_SCORE_TABLE': DISTRIBUTION_SCORE_TABLE,
+        'RECYCLING_SCORE_TABLE': RECYCLING_SCORE_TABLE,
+        'CORE_CUSTOMER_SCORE_TABLE': CORE_CUSTOMER_SCORE_TABLE,
+        'SALARY_GRADE_TABLE': SALARY_GRADE_TABLE,
+        'LOWEST_GRADE': LOWEST_GRADE
+    }
+
+def scoring_rules():
+    """当前数据集的评分规则 {规则表名: 规则表}"""
+    return current_tenant().rules
+
+def _lookup_score(value, table, default=0):
+    """按规则表查找单个数值对应的得分"""
+    for threshold, score in table:
+        if value >= threshold:
+            return score
+    return default
+
+def _score_by_table(values, table, default=0):
+    """按规则表批量计算得分（向量化）"""
+    values = np.asarray(values, dtype=float)
+    conditions = [values >= threshold for threshold, _ in table]
+    choices = [score for _, score in table]
+    return np.select(conditions, choices, default=default)
+
+def calculate_distribution_score(average):
+    """计算分销得分"""
+    return _lookup_score(average, scoring_rules()['DISTRIBUTION_SCORE_TABLE'])
+
+def calculate_recycling_score(average):
+    """计算条盒回收得分"""
+    return _lookup_score(average, scoring_rules()['RECYCLING_SCORE_TABLE'])
+
+def calculate_core_customer_score(customer_count):
+    """计算核心户得分"""
+    return _lookup_score(customer_count, scoring_rules()['CORE_CUSTOMER_SCORE_TABLE'])
+
+def calculate_salary_grade(total_score):
+    """计算档位和工资"""
+    rules = scoring_rules()
+    for threshold, grade, salary in rules['SALARY_GRADE_TABLE']:
+        if total_score >= threshold:
+            return grade, salary
+    return rules['LOWEST_GRADE']
+
+def calculate_quarter_average(monthly_data, quarter):
+    """计算季度平均值（处理4个月的特殊情况）"""
+    # 过滤掉为0的月份（未填报）
+    valid_data = [x for x in monthly_data if x > 0]
+    
+    if not valid_data:
+        return 0
+    
+    # 如果是Q4季度，且填报了4个月的数据
+    if "Q4" in quarter and len(valid_data) == 4:
+        # 4个月的数据转换为季度平均值（乘以3/4）
+        return sum(valid_data) * 0.75
+    else:
+        # 其他季度按实际填报月数计算平均值
+        avg_monthly = sum(valid_data) / len(valid_data)
+        return avg_monthly * 3
+
+def calculate_realtime_score_for_staff(dist_values, recycle_values, core_customers, comp_score, quarter, target_grade=6):
+    """为事务员计算实时得分"""
+    # 计算季度平均值
+    dist_avg = calculate_quarter_average(dist_values, quarter)
+    recycle_avg = calculate_quarter_average(recycle_values, quarter)
+    
+    # 计算各项得分
+    dist_score = calculate_distribution_score(dist_avg)
+    recycle_score = calculate_recycling_score(recycle_avg)
+    core_score = calculate_core_customer_score(core_customers)
+    
+    # 限制综合评分为0-20
+    comp_score = min(20, max(0, comp_score))
+    
+    # 总分和档位
+    total_score = dist_score + recycle_score + core_score + comp_score
+    grade, salary = calculate_salary_grade(total_score)
+    
+    # 检查档位提醒
+    warning_level, warning_msg = check_grade_warning(grade, target_grade)
+    
+    return {
+        '分销均季度': round(dist_avg, 1),
+        '条盒均季度': round(recycle_avg, 1),
+        '分销得分': dist_score,
+        '条盒回收得分': recycle_score,
+        '核心户得分': core_score,
+        '综合得分': comp_score,
+        '总分': total_score,
+        '档位': grade,
+        '预估月薪': salary,
+        '档位提醒级别': warning_level,
+        '档位提醒信息': warning_msg,
+        '是否达标': grade <= target_grade
+    }
+
+def get_grade_improvement_tips(current_scores, target_grade):
+    """获取提升档位的建议"""
+    tips = []
+    
+    # 计算当前总分对应的档位
+    current_total = current_scores['总分']
+    current_grade, _ = calculate_salary_grade(current_total)
+    
+    if current_grade <= target_grade:
+        return ["✅ 已达到目标档位，继续保持！"]
+    
+    # 需要提升的分数
+    needed_improvement = 0
+    needed_score = next(
+        (threshold for threshold, grade, _ in scoring_rules()['SALARY_GRADE_TABLE'] if grade == target_grade), 0
+    )
+    
+    needed_improvement = max(0, needed_score - current_total)
+    
+    if needed_improvement == 0:
+        return ["✅ 已达到目标档位，继续保持！"]
+    
+    tips.append(f"📈 需要提升 {needed_improvement} 分才能达到 {target_grade} 档")
+    
+    # 各项得分分析
+    if current_scores['分销得分'] < 25:
+        tips.append(f"📦 分销得分：{current_scores['分销得分']}/25，可以提升 {25 - current_scores['分销得分']} 分")
+        if current_scores['分销均季度'] < 61:
+            tips.append(f"   → 建议将分销季度平均值提升到 61条以上（当前 {current_scores['分销均季度']}条）")
+        elif current_scores['分销均季度'] < 151:
+            tips.append(f"   → 建议将分销季度平均值提升到 151条以上（当前 {current_scores['分销均季度']}条）")
+        elif current_scores['分销均季度'] < 301:
+            tips.append(f"   → 建议将分销季度平均值提升到 301条以上（当前 {current_scores['分销均季度']}条）")
+        elif current_scores['分销均季度'] < 601:
+            tips.append(f"   → 建议将分销季度平均值提升到 601条以上（当前 {current_scores['分销均季度']}条）")
+        else:
+            tips.append(f"   → 建议将分销季度平均值提升到 1000条以上（当前 {current_scores['分销均季度']}条）")
+    
+    if current_scores['条盒回收得分'] < 35:
+        tips.append(f"📊 条盒回收得分：{current_scores['条盒回收得分']}/35，可以提升 {35 - current_scores['条盒回收得分']} 分")
+        if current_scores['条盒均季度'] < 181:
+            tips.append(f"   → 建议将条盒回收季度平均值提升到 181条以上（当前 {current_scores['条盒均季度']}条）")
+        elif current_scores['条盒均季度'] < 201:
+            tips.append(f"   → 建议将条盒回收季度平均值提升到 201条以上（当前 {current_scores['条盒均季度']}条）")
+        elif current_scores['条盒均季度'] < 301:
+            tips.append(f"   → 建议将条盒回收季度平均值提升到 301条以上（当前 {current_scores['条盒均季度']}条）")
+        elif current_scores['条盒均季度'] < 401:
+            tips.append(f"   → 建议将条盒回收季度平均值提升到 401条以上（当前 {current_scores['条盒均季度']}条）")
+        elif current_scores['条盒均季度'] < 601:
+            tips.append(f"   → 建议将条盒回收季度平均值提升到 601条以上（当前 {current_scores['条盒均季度']}条）")
+        elif current_scores['条盒均季度'] < 801:
+            tips.append(f"   → 建议将条盒回收季度平均值提升到 801条以上（当前 {current_scores['条盒均季度']}条）")
+        else:
+            tips.append(f"   → 建议将条盒回收季度平均值提升到 1000条以上（当前 {current_scores['条盒均季度']}条）")
+    
+    if current_scores['核心户得分'] < 20:
+        tips.append(f"👥 核心户得分：{current_scores['核心户得分']}/20，可以提升 {20 - current_scores['核心户得分']} 分")
+        if current_scores['核心户得分'] < 5:
+            tips.append(f"   → 建议将核心户数增加到 16人以上")
+        elif current_scores['核心户得分'] < 10:
+            tips.append(f"   → 建议将核心户数增加到 21人以上")
+        elif current_scores['核心户得分'] < 15:
+            tips.append(f"   → 建议将核心户数增加到 26人以上")
+        else:
+            tips.append(f"   → 建议将核心户数增加到 31人以上")
+    
+    if current_scores['综合得分'] < 20:
+        tips.append(f"⭐ 综合得分：{current_scores['综合得分']}/20，可以提升 {20 - current_scores['综合得分']} 分")
+        tips.append(f"   → 请加强与地市经理的沟通，提高工作表现评分")
+    
+    return tips
+
+# ========== 数据初始化 ==========
+def init_data_from_template():
+    """从模板初始化数据"""
+    data = []
+    staff_list = [
+        ('石家庄', '庞雷'), ('保定', '方亚辉'), ('保定', '李建英'), ('保定', '史亚卿'),
+        ('保定', '甄喜梅'), ('沧州', '郝亮'), ('沧州', '张卿'), ('张家口', '李晓峰'),
+        ('石家庄', '孙霆'), ('石家庄', '李凤霞'), ('石家庄', '赵晴'), ('石家庄', '刘东青'),
+        ('邯郸', '冯斌'), ('邯郸', '谷巧霞'), ('邢台', '黄小刚'), ('唐山', '张丽颖'),
+        ('廊坊', '王玉刚'), ('秦皇岛', '陈晔'), ('天津', '夏美佳'), ('天津', '刘波'),
+        ('北京', '段体春'), ('北京', '胡颖'), ('临沂', '王培娟'), ('临沂', '朱森'),
+        ('潍坊', '李雪兰'), ('潍坊', '王军军'), ('枣庄', '黄成志'), ('淄博', '杨秀霞'),
+        ('济南', '陈蕾'), ('济南', '杨晶晶'), ('威海', '马晓燕'), ('青岛', '田亮'),
+        ('烟台', '岳东玉'), ('烟台', '高韶伟'), ('太原', '辛伟'), ('太原', '樊芳'),
+        ('晋中', '聂江波')
+    ]
+    
+    for i, (city, name) in enumerate(staff_list, 1):
+        data.append({
+            '行号': i,
+            '地市': city,
+            '事务员': name,
+            # 月度数据 - 所有月份都保留
+            '分销_1月': 0, '分销_2月': 0, '分销_3月': 0,
+            '分销_4月': 0, '分销_5月': 0, '分销_6月': 0,
+            '分销_7月': 0, '分销_8月': 0, '分销_9月': 0,
+            '分销_10月': 0, '分销_11月': 0, '分销_12月': 0,
+            '条盒_1月': 0, '条盒_2月': 0, '条盒_3月': 0,
+            '条盒_4月': 0, '条盒_5月': 0, '条盒_6月': 0,
+            '条盒_7月': 0, '条盒_8月': 0, '条盒_9月': 0,
+            '条盒_10月': 0, '条盒_11月': 0, '条盒_12月': 0,
+            # 其他数据
+            '核心户数': 0,
+            '综合评分': 0,
+            '季度目标档位': 6,
+            '备注': ''
+        })
+    
+    df = pd.DataFrame(data)
+    return df
+
+def calculate_quarter_average_vectorized(matrix, quarter):
+    """批量计算季度平均值（规则与calculate_quarter_average一致）"""
+    valid = matrix > 0
+    valid_count = valid.sum(axis=1)
+    valid_total = np.where(valid, matrix, 0).sum(axis=1)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        average = valid_total / valid_count * 3
+    average = np.where(valid_count == 0, 0, average)
+    
+    # Q4季度填报了4个月数据时按3/4折算
+    if "Q4" in quarter:
+        average = np.where(valid_count == 4, valid_total * 0.75, average)
+    
+    return average
+
+# calculate_performance生成的计算结果列（整体写入合并字段时不比较，合并后重新计算）
+PERFORMANCE_RESULT_COLUMNS = [
+    '分销均季度', '条盒均季度', '分销得分', '条盒回收得分', '核心户得分', '综合得分',
+    '总分', '档位', '预估月薪', '档位提醒级别', '档位提醒信息', '是否达标'
+]
+
+@timed('calculate_performance')
+def calculate_performance(df, quarter, rows=None):
+    """根据季度计算绩效，返回新的DataFrame（不修改df）
+
+    rows为需要重新计算的行索引，默认重新计算全部行。
+    """
+    # 确定月份范围
+    if "Q1" in quarter:
+        month_range = [1, 2, 3]
+    elif "Q2" in quarter:
+        month_range = [4, 5, 6]
+    elif "Q3" in quarter:
+        month_range = [7, 8, 9]
+    elif "Q4" in quarter:
+        month_range = [10, 11, 12]
+    else:
+        month_range = [1, 2, 3]
+    
+    target = df if rows is None else df.loc[rows]
+    if target.empty:
+        return df
+    
+    # 收集当前季度的分销和条盒回收数据（行 × 月）
+    dist_columns = [f'分销_{m}月' for m in month_range if f'分销_{m}月' in df.columns]
+    recycle_columns = [f'条盒_{m}月' for m in month_range if f'条盒_{m}月' in df.columns]
+    dist_matrix = target[dist_columns].to_numpy(dtype=float)
+    recycle_matrix = target[recycle_columns].to_numpy(dtype=float)
+    
+    # 计算季度平均值
+    dist_avg = calculate_quarter_average_vectorized(dist_matrix, quarter)
+    recycle_avg = calculate_quarter_average_vectorized(recycle_matrix, quarter)
+    
+    # 计算各项得分
+    rules = scoring_rules()
+    dist_score = _score_by_table(dist_avg, rules['DISTRIBUTION_SCORE_TABLE'])
+    recycle_score = _score_by_table(recycle_avg, rules['RECYCLING_SCORE_TABLE'])
+    core_score = _score_by_table(target['核心户数'], rules['CORE_CUSTOMER_SCORE_TABLE'])
+    comp_values = target['综合评分'].to_numpy()
+    comp_score = np.where(comp_values <= 20, comp_values, 20)
+    
+    # 总分和档位
+    total_score = dist_score + recycle_score + core_score + comp_score
+    salary_table = rules['SALARY_GRADE_TABLE']
+    grade_conditions = [total_score >= threshold for threshold, _, _ in salary_table]
+    grade = np.select(grade_conditions, [g for _, g, _ in salary_table], default=rules['LOWEST_GRADE'][0])
+    salary = np.select(grade_conditions, [s for _, _, s in salary_table], default=rules['LOWEST_GRADE'][1])
+    
+    # 检查档位提醒（规则与check_grade_warning一致）
+    if '季度目标档位' in target.columns:
+        target_grade = target['季度目标档位']
+    else:
+        target_grade = pd.Series(6, index=target.index)
+    grade_text = pd.Series(grade, index=target.index).astype(str)
+    target_text = target_grade.astype(str)
+    below = grade > target_grade.to_numpy()
+    equal = grade == target_grade.to_numpy()
+    warning_level = np.where(below, 'danger', np.where(equal, 'warning', 'success'))
+    warning_msg = np.where(
+        below,
+        "⚠️ 警告：当前档位为" + grade_text + "档，低于目标" + target_text + "档！",
+        np.where(
+            equal,
+            "📊 注意：当前档位为" + grade_text + "档，刚好达到目标。",
+            "✅ 优秀：当前档位为" + grade_text + "档，超过目标" + target_text + "档！"
+        )
+    )
+    
+    results = {
+        '分销均季度': np.round(dist_avg, 1),
+        '条盒均季度': np.round(recycle_avg, 1),
+        '分销得分': dist_score,
+        '条盒回收得分': recycle_score,
+        '核心户得分': core_score,
+        '综合得分': comp_score,
+        '总分': total_score,
+        '档位': grade,
+        '预估月薪': salary,
+        '档位提醒级别': warning_level,
+        '档位提醒信息': warning_msg,
+        '是否达标': grade <= target_grade.to_numpy(),
+    }
+    
+    # 结果写入浅拷贝，返回新的DataFrame：调用方手中的数据保持不变，
+    # 写时复制下只有计算列占用新内存，其余列与原数据共享
+    df = df.copy(deep=False)
+    for column, values in results.items():
+        if rows is None:
+            df[column] = values
+        else:
+            df.loc[target.index, column] = values
+    
+    return df
+
+def get_current_quarter_data(df, quarter):
+    """获取当前季度的数据（只显示当前季度的相关列）"""
+    if df.empty:
+        return df
+    
+    # 确定当前季度月份范围
+    if "Q1" in quarter:
+        month_range = [1, 2, 3]
+    elif "Q2" in quarter:
+        month_range = [4, 5, 6]
+    elif "Q3" in quarter:
+        month_range = [7, 8, 9]
+    elif "Q4" in quarter:
+        month_range = [10, 11, 12]
+    else:
+        month_range = [1, 2, 3]
+    
+    # 基本列
+    base_columns = ['行号', '地市', '事务员', '核心户数', '综合评分', 
+                   '季度目标档位', '备注']
+    
+    # 当前季度月份列
+    month_columns = []
+    for month_num in month_range:
+        month_columns.extend([f'分销_{month_num}月', f'条盒_{month_num}月'])
+    
+    # 计算列
+    calc_columns = ['分销均季度', '条盒均季度', '分销得分', '条盒回收得分',
+                   '核心户得分', '综合得分', '总分', '档位', '预估月薪',
+                   '是否达标']
+    
+    # 合并所有需要显示的列（计算列在后），只保留存在的列
+    display_columns = base_columns + month_columns + calc_columns
+    available_columns = [col for col in display_columns if col in df.columns]
+    
+    # 逐列引用组成新表，与原数据共享列数据（写时复制），渲染时不复制数据；
+    # df[列列表] 会把同类型的列从合并的二维块中复制出来
+    return pd.DataFrame({col: df[col] for col in available_columns}, copy=False)
+
+# ========== 异常填报检测 ==========
+ANOMALY_Z_THRESHOLD = 3.5      # 稳健z分数阈值
+ANOMALY_RATIO_THRESHOLD = 10   # 环比倍数阈值
+ANOMALY_MIN_SAMPLES = 3        # 计算中位数/MAD所需的最少样本数
+ANOMALY_MAD_FLOOR = 0.1        # MAD下限（占中位数的比例），避免数据过于平稳时误报
+ANOMALY_METRICS = ['分销', '条盒']
+ANOMALY_HISTORY_QUARTERS = 4   # 个人基线使用的最近历史季度数
+
+def _robust_z(values, median, mad):
+    """计算稳健z分数（MAD为0或样本不足时返回NaN）"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mad = np.fmax(mad, ANOMALY_MAD_FLOOR * np.abs(median))
+        z = 0.6745 * (values - median) / mad
+    z[~np.isfinite(z)] = np.nan
+    return z
+
+def _history_monthly_matrix(df, history, metric):
+    """各事务员在历史季度中的月均值（行与df对齐，每个历史季度一列，未找到时为NaN）
+
+    历史记录只保存季度均值（月均值×3），这里折算回月均值，作为个人基线的样本。
+    """
+    column = f'{metric}均季度'
+    parts = []
+    for data in (history or {}).values():
+        frame = _history_frame(data)
+        if frame.empty or column not in frame.columns:
+            continue
+        averages = frame.drop_duplicates('事务员', keep='last').set_index('事务员')[column] / 3
+        parts.append(df['事务员'].map(averages).to_numpy(dtype=float))
+    if not parts:
+        return np.empty((len(df), 0))
+    return np.column_stack(parts)
+
+def detect_anomalies(df, quarter, history=None):
+    """批量检测月度填报异常
+
+    对“月份 × 指标”矩阵一次性做向量化扫描：
+    - 个人维度：与该事务员的历史水平比较（稳健z分数）。基线为其他已填报月份加上
+      history（{季度: 历史记录}）中各季度的月均值，不含被检测的月份本身
+    - 地市维度：与同地市同月份的其他事务员比较（稳健z分数）
+    - 环比：与上月相比放大或缩小超过10倍
+    - 重复：当前季度内多个月份填报了完全相同的数值
+
+    返回与df索引对齐的DataFrame，包含“异常数”和“异常提示”两列。
+    """
+    if df is None:
+        return pd.DataFrame({'异常数': [], '异常提示': []})
+    result = pd.DataFrame({'异常数': 0, '异常提示': ''}, index=df.index)
+    if df.empty:
+        return result
+
+    # 当前季度月份在全年中的位置（0-11）
+    if "Q1" in quarter:
+        month_range = [1, 2, 3]
+    elif "Q2" in quarter:
+        month_range = [4, 5, 6]
+    elif "Q3" in quarter:
+        month_range = [7, 8, 9]
+    elif "Q4" in quarter:
+        month_range = [10, 11, 12]
+    else:
+        month_range = [1, 2, 3]
+    quarter_pos = np.array(month_range) - 1
+
+    city_codes = pd.factorize(df['地市'])[0] if '地市' in df.columns else np.zeros(len(df), dtype=int)
+
+    # 收集被标记的单元格：(行位置, 提示文字)
+    flagged_rows = []
+    flagged_msgs = []
+
+    for metric in ANOMALY_METRICS:
+        columns = [f'{metric}_{m}月' for m in range(1, 13)]
+        if not all(col in df.columns for col in columns):
+            continue
+
+        # 0表示未填报，按缺失处理
+        matrix = df[columns].to_numpy(dtype=float, copy=True)
+        matrix[matrix <= 0] = np.nan
+
+        # ---- 个人历史维度（逐月留一：基线不含被检测的月份） ----
+        past = _history_monthly_matrix(df, history, metric)
+        past[past <= 0] = np.nan
+        baseline = np.concatenate([matrix, past], axis=1)
+        staff_z = np.full(matrix.shape, np.nan)
+        for pos in quarter_pos:
+            sample = baseline.copy()
+            sample[:, pos] = np.nan
+            # 没有样本的行中位数为NaN，不需要警告
+            with np.errstate(all='ignore'), warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                median = np.nanmedian(sample, axis=1)
+                mad = np.nanmedian(np.abs(sample - median[:, None]), axis=1)
+            z = _robust_z(matrix[:, pos], median, mad)
+            z[(~np.isnan(sample)).sum(axis=1) < ANOMALY_MIN_SAMPLES] = np.nan
+            staff_z[:, pos] = z
+
+        # ---- 同地市横向维度 ----
+        frame = pd.DataFrame(matrix)
+        grouped = frame.groupby(city_codes)
+        city_median = grouped.transform('median').to_numpy()
+        city_mad = (frame - city_median).abs().groupby(city_codes).transform('median').to_numpy()
+        city_count = grouped.transform('count').to_numpy()
+        city_z = _robust_z(matrix, city_median, city_mad)
+        city_z[city_count < ANOMALY_MIN_SAMPLES] = np.nan
+
+        # ---- 环比突变（与上月相比） ----
+        ratio = np.full(matrix.shape, np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio[:, 1:] = matrix[:, 1:] / matrix[:, :-1]
+
+        # ---- 只对当前季度的月份给出标记 ----
+        for pos in quarter_pos:
+            month_label = f'{metric}_{pos + 1}月'
+
+            z = staff_z[:, pos]
+            for row in np.nonzero(np.abs(z) > ANOMALY_Z_THRESHOLD)[0]:
+                direction = "高于" if z[row] > 0 else "低于"
+                flagged_rows.append(row)
+                flagged_msgs.append(f"{month_label}{direction}个人历史(z={z[row]:.1f})")
+
+            z = city_z[:, pos]
+            for row in np.nonzero(np.abs(z) > ANOMALY_Z_THRESHOLD)[0]:
+                direction = "高于" if z[row] > 0 else "低于"
+                flagged_rows.append(row)
+                flagged_msgs.append(f"{month_label}{direction}同地市水平(z={z[row]:.1f})")
+
+            r = ratio[:, pos]
+            with np.errstate(invalid='ignore'):
+                jump = (r >= ANOMALY_RATIO_THRESHOLD) | (r <= 1 / ANOMALY_RATIO_THRESHOLD)
+            for row in np.nonzero(jump)[0]:
+                flagged_rows.append(row)
+                flagged_msgs.append(f"{month_label}环比×{r[row]:.1f}")
+
+        # ---- 当前季度内重复填报相同数值 ----
+        quarter_values = np.sort(matrix[:, quarter_pos], axis=1)
+        repeated = (quarter_values[:, 1:] == quarter_values[:, :-1]).any(axis=1)
+        for row in np.nonzero(repeated)[0]:
+            flagged_rows.append(row)
+            flagged_msgs.append(f"{metric}本季度多个月份数值相同")
+
+    if flagged_rows:
+        flags = pd.DataFrame({'行': flagged_rows, '提示': flagged_msgs})
+        summary = flags.groupby('行')['提示'].agg(['count', '; '.join])
+        positions = summary.index.to_numpy()
+        result.iloc[positions, 0] = summary['count'].to_numpy()
+        result.iloc[positions, 1] = summary['join'].to_numpy()
+
+    return result
+
+# ========== 数据导入导出函数 ==========
+@timed('import_excel')
+def import_excel_data(uploaded_file):
+    """从Excel文件导入数据"""
+    try:
+        df = pd.read_excel(uploaded_file)
+        return df, True, "导入成功"
+    except Exception as e:
+        return None, False, f"导入失败: {str(e)}"
+
+@timed('export_excel')
+def export_to_excel(df):
+    """导出数据到Excel"""
+    try:
+        output = BytesIO()
+        with pd.ExcelWriter(output, engine='openpyxl') as writer:
+            df.to_excel(writer, index=False, sheet_name='绩效数据')
+        output.seek(0)
+        record_export('xlsx', output.getbuffer().nbytes)
+        return output, True, "导出成功"
+    except Exception as e:
+        return None, False, f"导出失败: {str(e)}"
+
+@timed('export_history')
+def export_quarter_history(quarter_history):
+    """导出季度历史数据"""
+    try:
+        if not quarter_history:
+            return None, False, "没有历史数据"
+        
+        output = BytesIO()
+        with pd.ExcelWriter(output, engine='openpyxl') as writer:
+            for quarter, data in quarter_history.items():
+                df = _history_frame(data)
+                df.to_excel(writer, index=False, sheet_name=quarter[:10])  # 限制sheet名长度
+        
+        output.seek(0)
+        record_export('history_xlsx', output.getbuffer().nbytes)
+        return output, True, "历史数据导出成功"
+    except Exception as e:
+        return None, False, f"导出失败: {str(e)}"
+
+def _backup_source_files(source_dir=None):
+    """需要备份的数据文件（相对数据目录的路径，默认为当前数据集的数据目录）"""
+    source_dir = source_dir or data_dir()
+    files = []
+    if os.path.exists(os.path.join(source_dir, 'meta.pkl')):
+        files.append('meta.pkl')
+    shard_dir = os.path.join(source_dir, 'shards')
+    if os.path.isdir(shard_dir):
+        files.extend(
+            os.path.join('shards', name) for name in sorted(os.listdir(shard_dir))
+            if name.endswith(SHARD_SUFFIX)
+        )
+    history_dir = os.path.join(source_dir, 'history')
+    if os.path.isdir(history_dir):
+        files.extend(
+            os.path.join('history', name) for name in sorted(os.listdir(history_dir))
+            if name.endswith(HISTORY_ARCHIVE_SUFFIX)
+        )
+    return files
+
+def _chunk_path(digest):
+    return data_path(BACKUP_CHUNK_DIR, digest[:2], digest + '.z')
+
+def _store_chunk(data):
+    """按内容哈希保存一个压缩块，已存在时不重复写入；返回 (哈希, 新写入的字节数)"""
+    digest = hashlib.sha256(data).hexdigest()
+    path = _chunk_path(digest)
+    if os.path.exists(path):
+        return digest, 0
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    compressed = zlib.compress(data, 6)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(compressed)
+    os.replace(tmp_path, path)
+    return digest, len(compressed)
+
+def _load_chunk(digest):
+    """读取并校验一个备份块"""
+    with open(_chunk_path(digest), 'rb') as f:
+        data = zlib.decompress(f.read())
+    if hashlib.sha256(data).hexdigest() != digest:
+        raise ValueError(f"备份块校验失败：{digest[:12]}")
+    return data
+
+def _backup_lock():
+    os.makedirs(data_path(BACKUP_DIR), exist_ok=True)
+    return _exclusive_lock('__backup__', data_path(BACKUP_DIR, '.lock'))
+
+def create_backup(label='手动备份', source_dir=None):
+    """创建备份：数据文件按固定大小切块、压缩后按内容哈希保存，未变化的块只存一份
+
+    返回备份清单（包含每个文件的大小、校验和与块列表）。
+    """
+    source_dir = source_dir or data_dir()
+    created_at = datetime.now()
+    entries = []
+    total_size = 0
+    stored_size = 0
+    with _backup_lock():
+        for rel_path in _backup_source_files(source_dir):
+            with open(os.path.join(source_dir, rel_path), 'rb') as f:
+                data = f.read()
+            chunks = []
+            for offset in range(0, len(data), BACKUP_CHUNK_SIZE):
+                digest, written = _store_chunk(data[offset:offset + BACKUP_CHUNK_SIZE])
+                chunks.append(digest)
+                stored_size += written
+            entries.append({
+                'path': rel_path.replace(os.sep, '/'),
+                'size': len(data),
+                'sha256': hashlib.sha256(data).hexdigest(),
+                'chunks': chunks
+            })
+            total_size += len(data)
+        
+        manifest = {
+            'id': created_at.strftime('%Y%m%d_%H%M%S_%f'),
+            'created_at': created_at.isoformat(),
+            'label': label,
+            'files': entries,
+            'size': total_size,
+            'stored': stored_size
+        }
+        os.makedirs(data_path(BACKUP_MANIFEST_DIR), exist_ok=True)
+        manifest_path = data_path(BACKUP_MANIFEST_DIR, f"{manifest['id']}.json")
+        with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(manifest_path + '.tmp', manifest_path)
+        prune_backups()
+    return manifest
+
+def list_backups():
+    """所有备份清单，最新的在前"""
+    if not os.path.isdir(data_path(BACKUP_MANIFEST_DIR)):
+        return []
+    manifests = []
+    for name in os.listdir(data_path(BACKUP_MANIFEST_DIR)):
+        if name.endswith('.json'):
+            with open(data_path(BACKUP_MANIFEST_DIR, name), 'r', encoding='utf-8') as f:
+                manifests.append(json.load(f))
+    return sorted(manifests, key=lambda manifest: manifest['created_at'], reverse=True)
+
+def _retention_period(created_at, policy):
+    """备份所属的保留时段"""
+    if policy == 'hourly':
+        return created_at.strftime('%Y%m%d%H')
+    if policy == 'daily':
+        return created_at.strftime('%Y%m%d')
+    return f"{created_at.year}Q{(created_at.month - 1) // 3 + 1}"
+
+def prune_backups():
+    """按保留策略删除多余的备份清单，再清理不再被任何清单引用的块（在备份锁内调用）"""
+    manifests = list_backups()
+    if not manifests:
+        return 0
+    keep = {manifests[0]['id']}
+    manual = [manifest for manifest in manifests if manifest['label'] != BACKUP_SCHEDULED_LABEL]
+    keep.update(manifest['id'] for manifest in manual[:BACKUP_KEEP_MANUAL])
+    for policy, count in BACKUP_RETENTION.items():
+        periods = []
+        for manifest in manifests:
+            period = _retention_period(datetime.fromisoformat(manifest['created_at']), policy)
+            if period not in periods:
+                periods.append(period)
+                if len(periods) > count:
+                    break
+                keep.add(manifest['id'])
+    
+    removed = 0
+    referenced = set()
+    for manifest in manifests:
+        if manifest['id'] in keep:
+            for entry in manifest['files']:
+                referenced.update(entry['chunks'])
+        else:
+            os.remove(data_path(BACKUP_MANIFEST_DIR, f"{manifest['id']}.json"))
+            removed += 1
+    
+    if removed and os.path.isdir(data_path(BACKUP_CHUNK_DIR)):
+        for prefix in os.listdir(data_path(BACKUP_CHUNK_DIR)):
+            prefix_dir = data_path(BACKUP_CHUNK_DIR, prefix)
+            for name in os.listdir(prefix_dir):
+                if name.endswith('.z') and name[:-2] not in referenced:
+                    os.remove(os.path.join(prefix_dir, name))
+    return removed
+
+def read_backup_files(backup_id):
+    """读取备份中的全部文件并逐块、逐文件校验，返回 {相对路径: 内容}"""
+    with open(data_path(BACKUP_MANIFEST_DIR, f"{backup_id}.json"), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    files = {}
+    for entry in manifest['files']:
+        data = b''.join(_load_chunk(digest) for digest in entry['chunks'])
+        if len(data) != entry['size'] or hashlib.sha256(data).hexdigest() != entry['sha256']:
+            raise ValueError(f"备份文件校验失败：{entry['path']}")
+        files[entry['path']] = data
+    return files
+
+def freeze_data_view():
+    """在所有地市分片锁内把数据文件硬链接到临时目录，得到一致的只读视图
+
+    只建立链接不复制数据，持锁时间为毫秒级；之后的写入会替换成新文件，不影响冻结的视图。
+    """
+    frozen_dir = data_path(BACKUP_DIR, 'frozen', str(time.time_ns()))
+    with ExitStack() as stack:
+        for city in list_shard_cities():
+            stack.enter_context(shard_lock(city))
+        for rel_path in _backup_source_files():
+            _link_or_copy(data_path(rel_path), os.path.join(frozen_dir, rel_path))
+    return frozen_dir
+
+class BackupScheduler:
+    """后台备份线程（备份创建时的当前数据集）：按间隔定时备份，并处理风险操作前的备份请求
+
+    请求方只冻结数据视图（毫秒级），切块、压缩和写盘都在后台线程完成，用户请求不等待备份。
+    """
+
+    def __init__(self, interval=BACKUP_INTERVAL_SECONDS):
+        self.interval = interval
+        self.pending = queue.Queue()
+        self.last_result = None
+        self.last_scheduled = self._last_scheduled_time()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = start_thread(self._run, 'backup-scheduler')
+
+    def _last_scheduled_time(self):
+        # 间隔内已有任何备份（同一时段的定时备份可能已被保留策略清理）都不必再补做
+        backups = list_backups()
+        return datetime.fromisoformat(backups[0]['created_at']).timestamp() if backups else 0.0
+
+    def next_due(self):
+        return self.last_scheduled + self.interval
+
+    def set_interval(self, seconds):
+        self.interval = seconds
+        self._wakeup.set()
+
+    def request(self, label):
+        """冻结当前数据后交给后台线程备份"""
+        self.pending.put((label, freeze_data_view()))
+        self._wakeup.set()
+
+    def stop(self):
+        """停止线程（已请求的备份写完后退出）"""
+        self._stopping.set()
+        self._wakeup.set()
+
+    def _backup_frozen(self, label, frozen_dir):
+        try:
+            manifest = create_backup(label, source_dir=frozen_dir)
+            self.last_result = (datetime.now(), True, (
+                f"{label}完成：数据{manifest['size'] / 1024:.1f} KB，"
+                f"新增存储{manifest['stored'] / 1024:.1f} KB"
+            ))
+        except Exception as e:
+            self.last_result = (datetime.now(), False, f"{label}失败：{str(e)}")
+        finally:
+            shutil.rmtree(frozen_dir, ignore_errors=True)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(timeout=max(1.0, min(60.0, self.next_due() - time.time())))
+            self._wakeup.clear()
+            try:
+                if (not self._stopping.is_set() and time.time() >= self.next_due()
+                        and os.path.exists(data_path(META_FILE))):
+                    self.last_scheduled = time.time()
+                    self.pending.put((BACKUP_SCHEDULED_LABEL, freeze_data_view()))
+                while not self.pending.empty():
+                    self._backup_frozen(*self.pending.get())
+            except Exception as e:
+                self.last_result = (datetime.now(), False, f"后台备份出错：{str(e)}")
+
+def find_backup_files():
+    """查找备份：新版备份清单在前，旧版整文件备份在后"""
+    backups = [manifest['id'] for manifest in list_backups()]
+    legacy_files = sorted(
+        (file for file in os.listdir('.') if file.startswith('backup_') and file.endswith('.pkl')),
+        reverse=True
+    )
+    return backups + legacy_files
+
+def backup_storage_stats():
+    """备份份数和块存储占用的字节数"""
+    stored_size = 0
+    if os.path.isdir(data_path(BACKUP_CHUNK_DIR)):
+        for prefix in os.listdir(data_path(BACKUP_CHUNK_DIR)):
+            prefix_dir = data_path(BACKUP_CHUNK_DIR, prefix)
+            stored_size += sum(os.path.getsize(os.path.join(prefix_dir, name)) for name in os.listdir(prefix_dir))
+    return len(list_backups()), stored_size
+
+def describe_backup(backup_id):
+    """备份在下拉框中的显示文字"""
+    if backup_id.endswith('.pkl'):
+        return f"{backup_id}（旧版整文件备份）"
+    year, rest = backup_id[:4], backup_id[4:]
+    return f"{year}-{rest[:2]}-{rest[2:4]} {rest[5:7]}:{rest[7:9]}:{rest[9:11]}"
+
+# ========== 批处理任务 ==========
+# 命令行和定时任务使用：不依赖会话，按地市分片处理，可在多个进程中并行执行，
+# 跨进程的互斥由分片文件锁保证。
+def backup_now(label='手动备份'):
+    """在当前线程内冻结数据并写入备份，返回备份清单"""
+    frozen_dir = freeze_data_view()
+    try:
+        return create_backup(label, source_dir=frozen_dir)
+    finally:
+        shutil.rmtree(frozen_dir, ignore_errors=True)
+
+def recompute_city(city, quarter, operator='系统', change_set=None):
+    """重新计算一个地市的绩效并写回分片，返回 (计算的行数, 冲突列表)
+
+    读取后又被其他用户修改的行保留对方的数据，按合并后的数据重新计算。
+    """
+    shard = read_shard(city)
+    if shard is None or shard['performance_data'] is None:
+        return 0, []
+    df = calculate_performance(shard['performance_data'], quarter)
+    _, conflicts = cas_write_shard(
+        city, df, shard.get('row_versions', {}), quarter=quarter,
+        operation='重新计算绩效', operator=operator, change_set=change_set,
+        base_df=shard['performance_data']
+    )
+    return len(df), conflicts
+
+def load_all_data():
+    """读取全部地市分片，返回合并后的数据（没有数据时为None）"""
+    shards = read_shards(list_shard_cities())
+    frames = [shard['performance_data'] for shard in shards.values() if shard['performance_data'] is not None]
+    return pd.concat(frames).sort_index() if frames else None
+
+def plan_import(imported, roster):
+    """为导入数据分配行标签并找出需要写入的地市，返回 (导入数据, {地市: 调出的事务员}, 需要写入的地市)
+
+    同名事务员以最后一行为准并沿用名册中的行标签，新事务员的标签排在名册之后；需要写入的地市为
+    导入数据涉及的地市加上调出事务员的原地市，其他地市的分片不必重新计算和改写。
+    """
+    imported = imported.drop_duplicates(subset=['事务员'], keep='last')
+    if roster is None:
+        roster = imported[['行号', '地市', '事务员']].iloc[0:0]
+    labels = dict(zip(roster['事务员'], roster.index))
+    next_label = roster.index.max() + 1 if len(roster) else 0
+    imported_labels = []
+    for name in imported['事务员']:
+        if name not in labels:
+            labels[name] = next_label
+            next_label += 1
+        imported_labels.append(labels[name])
+    imported = imported.set_axis(imported_labels)
+    
+    previous_cities = dict(zip(roster['事务员'], roster['地市']))
+    removed = {}
+    for name, city in zip(imported['事务员'], imported['地市']):
+        previous = previous_cities.get(name)
+        if previous is not None and previous != city:
+            removed.setdefault(previous, []).append(name)
+    return imported, removed, sorted(set(imported['地市']) | set(removed))
+
+def update_roster_rows(rows, current_quarter=None):
+    """把导入的事务员更新到全局信息的名册中（同名的替换，新增的追加）"""
+    meta = load_meta() or {'current_quarter': current_quarter, 'last_reset': None}
+    roster = meta.get('roster')
+    rows = rows[['行号', '地市', '事务员']]
+    if roster is not None:
+        rows = pd.concat([roster[~roster['事务员'].isin(rows['事务员'])], rows]).sort_index()
+    meta['roster'] = rows
+    meta['version'] = new_data_version()
+    write_meta(meta)
+    return meta
+
+def import_staff_rows(imported, quarter, operator='系统', change_set=None):
+    """以导入数据为准写入导入文件中的事务员，返回 (更新后的全局信息, 写入的地市)
+
+    各地市分片并行写入，只覆盖文件中的事务员，其他事务员的数据不受导入方会话中旧数据的影响。
+    """
+    meta = load_meta() or {}
+    imported, removed, cities = plan_import(imported, meta.get('roster'))
+    change_set = change_set or new_change_set_id()
+    
+    def write_city(city):
+        return cas_import_shard(
+            city, imported[imported['地市'] == city], removed.get(city, []),
+            quarter, '导入数据', operator, change_set
+        )
+    
+    parallel_map(write_city, cities)
+    return update_roster_rows(imported, quarter), cities
+
+
+def load_all_history():
+    """读取全部季度历史（今年的热数据加往年的归档）"""
+    history = merge_hot_history(
+        _load_pickle(_shard_path(city, SHARD_HISTORY_SUFFIX), {}) for city in list_shard_cities()
+    )
+    for quarter in list_archived_quarters():
+        history.setdefault(quarter, load_archived_quarter(quarter, os.path.getmtime(_archive_path(quarter))))
+    return dict(sorted(history.items()))
+
+# ========== 外部数据接入 ==========
+# 上游销售系统按批推送每位事务员的月度分销、条盒数据：整批校验，通过后按地市分组，
+# 每个地市分片只重新计算一次、写入一次。每批带幂等键，重复推送直接返回第一次的结果。
+INGEST_DIR = 'ingest'
+INGEST_KEY_DIR = os.path.join(INGEST_DIR, 'keys')
+INGEST_KEY_TTL_SECONDS = 7 * 24 * 3600
+INGEST_MAX_ERRORS = 100
+INGEST_OPERATION = '接口导入'
+# 推送记录中的指标：分销、条盒为月度数据（需要月份），核心户数为季度数据
+INGEST_MONTHLY_FIELDS = ['分销', '条盒']
+INGEST_QUARTER_FIELDS = ['核心户数']
+
+def _is_count(value):
+    """是否为非负整数（不接受布尔值）"""
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return isinstance(value, (int, np.integer)) and value >= 0
+
+def validate_ingest_records(records, staff_cities):
+    """整批校验推送的记录，返回 ({事务员: 修改}, 错误列表)
+
+    同一事务员的多条记录合并，后面的记录覆盖前面的同名字段。
+    """
+    updates_by_staff = {}
+    errors = []
+    if not isinstance(records, list) or not records:
+        return updates_by_staff, [{'index': None, 'error': 'records必须是非空数组'}]
+    
+    for index, record in enumerate(records):
+        if not isinstance(record, dict):
+            errors.append({'index': index, 'error': '记录必须是对象'})
+            continue
+        staff_name = record.get('事务员')
+        if staff_name not in staff_cities:
+            errors.append({'index': index, 'error': f'未知的事务员：{staff_name}'})
+            continue
+        if record.get('地市') not in (None, staff_cities[staff_name]):
+            errors.append({'index': index, 'error': f"地市与名册不符：{record.get('地市')}"})
+            continue
+        
+        updates = {}
+        month = record.get('月份')
+        monthly = [field for field in INGEST_MONTHLY_FIELDS if field in record]
+        if monthly and not (isinstance(month, int) and not isinstance(month, bool) and 1 <= month <= 12):
+            errors.append({'index': index, 'error': f'月份必须是1-12的整数：{month}'})
+            continue
+        for field in monthly:
+            updates[f'{field}_{month}月'] = record[field]
+        for field in INGEST_QUARTER_FIELDS:
+            if field in record:
+                updates[field] = record[field]
+        if not updates:
+            errors.append({'index': index, 'error': '记录中没有可写入的指标'})
+            continue
+        invalid = [key for key, value in updates.items() if not _is_count(value)]
+        if invalid:
+            errors.append({'index': index, 'error': f"指标必须是非负整数：{'、'.join(invalid)}"})
+            continue
+        updates_by_staff.setdefault(staff_name, {}).update({key: int(value) for key, value in updates.items()})
+    return updates_by_staff, errors
+
+def commit_ingest_batch(records, operator):
+    """校验并写入一批推送数据，返回 (HTTP状态码, 结果)"""
+    meta = load_meta()
+    if not meta or meta.get('roster') is None:
+        return 503, {'error': '还没有数据，请先在网页端初始化'}
+    roster = meta['roster']
+    staff_cities = dict(zip(roster['事务员'], roster['地市']))
+    updates_by_staff, errors = validate_ingest_records(records, staff_cities)
+    if errors:
+        return 400, {'error': '数据校验未通过，整批未写入', 'error_count': len(errors), 'errors': errors[:INGEST_MAX_ERRORS]}
+    
+    patches_by_city = {}
+    for staff_name, updates in updates_by_staff.items():
+        patches_by_city.setdefault(staff_cities[staff_name], {})[staff_name] = {
+            'updates': updates, 'base_version': None, 'base_values': {}
+        }
+    quarter = meta.get('current_quarter') or get_current_quarter()
+    change_set = new_change_set_id()
+    
+    def write_city(item):
+        city, patches = item
+        _, written, _ = cas_patch_shard(city, patches, INGEST_OPERATION, operator, change_set, quarter)
+        return written
+    
+    written = sum(parallel_map(write_city, patches_by_city.items()))
+    return 200, {
+        'records': len(records),
+        'staff': written,
+        'skipped_staff': len(updates_by_staff) - written,
+        'cities': len(patches_by_city),
+        'quarter': quarter,
+        'change_set': change_set
+    }
+
+def _ingest_key_path(digest):
+    return data_path(INGEST_KEY_DIR, digest[:2], digest + '.json')
+
+def ingest_records(records, idempotency_key, operator='接口'):
+    """按幂等键写入一批推送数据，返回 (HTTP状态码, 结果)
+
+    同一幂等键已成功写入时直接返回当时的结果（replayed为True）；幂等键用于不同的数据时返回409。
+    校验失败的批次不记录幂等键，修正数据后可用同一个键重新推送。
+    """
+    key_digest = hashlib.sha256(idempotency_key.encode('utf-8')).hexdigest()
+    payload_digest = hashlib.sha256(
+        json.dumps(records, ensure_ascii=False, sort_keys=True, default=_json_default).encode('utf-8')
+    ).hexdigest()
+    key_path = _ingest_key_path(key_digest)
+    os.makedirs(os.path.dirname(key_path), exist_ok=True)
+    # 按哈希前缀分16把锁：同一个键的并发推送只执行一次，不同的键互不等待
+    with _exclusive_lock(f'__ingest_{key_digest[0]}__', data_path(INGEST_KEY_DIR, f'{key_digest[0]}.lock')):
+        if os.path.exists(key_path):
+            with open(key_path, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+            if stored['payload'] != payload_digest:
+                return 409, {'error': '该幂等键已用于不同的数据'}
+            return 200, {**stored['result'], 'replayed': True}
+        
+        status, result = commit_ingest_batch(records, operator)
+        if status == 200:
+            tmp_path = f"{key_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'key': idempotency_key,
+                    'payload': payload_digest,
+                    'result': result,
+                    'created_at': time.time()
+                }, f, ensure_ascii=False)
+            os.replace(tmp_path, key_path)
+        return status, {**result, 'replayed': False} if status == 200 else result
+
+def prune_ingest_keys(ttl_seconds=INGEST_KEY_TTL_SECONDS):
+    """删除过期的幂等键记录，返回删除的数量"""
+    if not os.path.isdir(data_path(INGEST_KEY_DIR)):
+        return 0
+    cutoff = time.time() - ttl_seconds
+    removed = 0
+    for root, _, names in os.walk(data_path(INGEST_KEY_DIR)):
+        for name in names:
+            path = os.path.join(root, name)
+            if name.endswith('.json') and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+    return removed
@@ -0,0 +1,464 @@
+"""绩效系统并发负载测试
+
+用 Streamlit AppTest 模拟多个事务员、地市经理和管理员会话（不启动服务器和浏览器），
+每个会话从登录页开始完整运行 app.py 的 main()。AppTest 不支持在同一进程内并发运行，
+每个虚拟用户在单独的进程中运行，全部登录后同时开始，并发执行：
+
+    事务员    填报月度分销数据并提交（字段级比较交换写入）
+    地市经理  批量设置本地市的目标档位（一次写入整个地市）
+    管理员    整体保存、导入Excel、刷新导入导出页（生成导出文件）
+
+结束后报告吞吐量、各操作的延迟分位数、服务端耗时、文件写入次数和丢失的修改，
+可在每个季度末之前评估容量、发现保存路径的性能退化，例如：
+
+    python loadtest.py --staff 20 --managers 4 --admins 1 --rounds 10
+    python loadtest.py --duration 120 --json 负载测试.json
+
+默认把当前目录的 data/ 和 tenants/ 复制到临时目录中运行，不影响正式数据；
+--in-place 时直接使用 -C 指定目录（默认为当前目录）中的数据。
+
+丢失的修改：已确认成功的写入，最终数据中不是写入的值，且最后改写该字段的审计记录不是来自
+针对该事务员发起的其他写入（事务员本人的提交、列出该事务员的导入、地市经理的批量设置）。
+被这些写入改写的记为“被覆盖”；被整体保存、重置或未列出该事务员的导入改写的，记为丢失。
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+from streamlit.testing.v1 import AppTest
+
+import core
+
+APP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+APP_TIMEOUT = 120
+START_TIMEOUT = 600                   # 等待全部虚拟用户登录的最长时间
+ADMIN_PASSWORD = 'admin123'
+MANAGER_PASSWORD = 'manager123'
+LATENCY_PERCENTILES = (50, 95, 99)
+# 报告中列出的服务端耗时（core.timed 记录的操作）
+SERVER_SPANS = ('save_data', 'shard_patch', 'shard_write', 'calculate_performance', 'load_data',
+                'shard_import', 'export_excel', 'export_csv', 'import_excel', '整页重跑')
+
+
+class LoadStats:
+    """各虚拟用户共享的统计：操作延迟、失败和已确认的写入"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.failures = {}
+        self.writes = {}      # (事务员, 字段) -> (写入的值, 开始时间戳)，只保留最后一次确认的写入
+        # (事务员, 字段) -> [(写入的值, 来源)]，发起过的全部写入，来源为(操作人, 操作)；
+        # 字段为None表示整行写入（导入文件中的事务员），值为None表示不限取值
+        self.intents = {}
+        self._lock = threading.Lock()
+
+    def run(self, operation, func):
+        """执行一次操作并记录延迟，失败时记录原因，返回是否成功"""
+        start = time.perf_counter()
+        try:
+            func()
+        except Exception as e:
+            with self._lock:
+                self.failures.setdefault(operation, []).append(str(e))
+            return False
+        with self._lock:
+            self.latencies.setdefault(operation, []).append(time.perf_counter() - start)
+        return True
+
+    def intend(self, writes, source):
+        """记录即将发起的写入 [(事务员, 字段, 值)]（不论是否成功，都可能已经落盘）"""
+        with self._lock:
+            for staff_name, column, value in writes:
+                self.intents.setdefault((staff_name, column), []).append((value, source))
+
+    def confirm_writes(self, writes, started_at):
+        """记录已确认成功的写入 [(事务员, 字段, 值)]"""
+        with self._lock:
+            for staff_name, column, value in writes:
+                self.writes[(staff_name, column)] = (value, started_at)
+
+    def export(self):
+        """可跨进程传递的统计数据"""
+        with self._lock:
+            return {'latencies': self.latencies, 'failures': self.failures, 'writes': self.writes,
+                    'intents': self.intents}
+
+    def merge(self, data):
+        """合并另一个虚拟用户的统计（同一字段保留较晚开始的写入）"""
+        for operation, seconds in data['latencies'].items():
+            self.latencies.setdefault(operation, []).extend(seconds)
+        for operation, reasons in data['failures'].items():
+            self.failures.setdefault(operation, []).extend(reasons)
+        for key, write in data['writes'].items():
+            if key not in self.writes or write[1] >= self.writes[key][1]:
+                self.writes[key] = write
+        for key, intents in data['intents'].items():
+            self.intents.setdefault(key, []).extend(intents)
+
+
+def _check(at, action):
+    """检查页面中的异常和错误提示，有则抛出"""
+    errors = [element.value for element in at.exception] + [element.value for element in at.error]
+    if errors:
+        raise RuntimeError(f"{action}：{errors[0]}")
+    return at
+
+
+def _new_session():
+    at = AppTest.from_file(APP_FILE, default_timeout=APP_TIMEOUT)
+    return _check(at.run(), "打开登录页")
+
+
+def login_staff(name):
+    at = _new_session()
+    at.text_input(key="staff_search").set_value(name).run()
+    at.selectbox(key=f"staff_select_{name.strip().lower()}").set_value(name)
+    return _check(at.button(key="staff_login_btn").click().run(), f"事务员{name}登录")
+
+
+def login_manager(city):
+    at = _new_session()
+    at.radio(key="role_radio").set_value("地市经理").run()
+    at.selectbox(key="city_select").set_value(city)
+    at.text_input(key="manager_pwd_input").set_value(MANAGER_PASSWORD)
+    return _check(at.button(key="manager_login_btn").click().run(), f"{city}地市经理登录")
+
+
+def login_admin():
+    at = _new_session()
+    at.radio(key="role_radio").set_value("管理员").run()
+    at.text_input(key="admin_pwd_input").set_value(ADMIN_PASSWORD)
+    return _check(at.button(key="admin_login_btn").click().run(), "管理员登录")
+
+
+def _rounds(rounds, deadline):
+    """虚拟用户的操作轮次：达到轮数或超过截止时间时结束"""
+    for round_no in range(rounds):
+        if deadline is not None and time.monotonic() >= deadline:
+            return
+        yield round_no
+
+
+def staff_rounds(at, name, stats, rounds, deadline):
+    """事务员：每轮修改一个月的分销数据并提交表单"""
+    months = core.get_quarter_months(at.session_state.current_quarter)
+    for round_no in _rounds(rounds, deadline):
+        month = int(months[round_no % len(months)].replace('月', ''))
+        value = 1000 + round_no
+
+        writes = [(name, f'分销_{month}月', value)]
+
+        def submit():
+            at.number_input(key=f"dist_{name}_{month}").set_value(value)
+            submit_button = next(button for button in at.button if button.label == "保存季度数据")
+            _check(submit_button.click().run(), "提交填报")
+
+        # 事务员会话的操作人为本人
+        stats.intend(writes, (name, '更新数据'))
+        started_at = core.audit_timestamp()
+        if stats.run('事务员提交', submit):
+            stats.confirm_writes(writes, started_at)
+
+
+def manager_rounds(at, city, stats, rounds, deadline):
+    """地市经理：每轮为本地市全部事务员设置一次目标档位"""
+    for round_no in _rounds(rounds, deadline):
+        grade = round_no % 10 + 1
+        names = at.session_state.performance_data.query('地市 == @city')['事务员'].tolist()
+        writes = [(name, '季度目标档位', grade) for name in names]
+
+        def batch_save():
+            at.slider(key="batch_target_grade").set_value(grade)
+            _check(at.button(key="set_batch_target_btn").click().run(), "批量设置目标档位")
+
+        stats.intend(writes, (at.session_state.user_name, '批量设置目标档位'))
+        started_at = core.audit_timestamp()
+        if stats.run('地市经理批量保存', batch_save):
+            stats.confirm_writes(writes, started_at)
+
+
+def _import_file(df, names, score):
+    """生成导入用的Excel：指定事务员的当前数据，综合评分改为score"""
+    rows = df[df['事务员'].isin(names)].assign(综合评分=score)
+    output = BytesIO()
+    rows.to_excel(output, index=False)
+    return output.getvalue()
+
+
+def admin_rounds(at, import_names, stats, rounds, deadline):
+    """管理员：每轮整体保存一次、导入一次，并刷新页面（重新生成导出文件）"""
+    for round_no in _rounds(rounds, deadline):
+        stats.run('管理员整体保存', lambda: _check(at.button(key="save_all_changes_btn").click().run(), "整体保存"))
+        stats.run('管理员刷新（含导出）', lambda: _check(at.run(), "刷新"))
+        if not import_names:
+            continue
+        score = round_no % 20 + 1
+        writes = [(name, '综合评分', score) for name in import_names]
+
+        def import_data():
+            data = _import_file(at.session_state.performance_data, import_names, score)
+            at.file_uploader[0].set_value(
+                ("负载测试导入.xlsx", data, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+            )
+            _check(at.run(), "上传导入文件")
+            _check(at.button(key="confirm_import_btn").click().run(), "确认导入")
+
+        # 导入文件包含这些事务员的整行数据
+        stats.intend([(name, None, None) for name in import_names], (at.session_state.user_name, '导入数据'))
+        started_at = core.audit_timestamp()
+        if stats.run('管理员导入', import_data):
+            stats.confirm_writes(writes, started_at)
+
+
+# 身份 -> (登录操作名, 登录函数, 每轮操作)；管理员的参数为导入的事务员名单
+USER_ROLES = {
+    'staff': ('事务员登录', login_staff, staff_rounds),
+    'manager': ('地市经理登录', login_manager, manager_rounds),
+    'admin': ('管理员登录', lambda import_names: login_admin(), admin_rounds),
+}
+
+
+def _metric_totals():
+    """本进程的文件写入次数、字节数和分片保存次数"""
+    metrics = core.get_metrics()
+    labels = (('tenant', core.current_tenant().name),)
+    return {
+        'file_writes': metrics.value('performance_file_writes_total', labels),
+        'file_write_bytes': metrics.value('performance_file_write_bytes_total', labels),
+        'shard_saves': sum(metrics.value('performance_saves_total', labels + (('kind', kind),))
+                           for kind in ('patch', 'write', 'import'))
+    }
+
+
+def load_roster():
+    """打开一次登录页（没有数据时由应用初始化），返回全部事务员和地市"""
+    _new_session()
+    roster = core.load_meta()['roster']
+    return roster['事务员'].tolist(), roster['地市'].unique().tolist()
+
+
+def run_user(role, target, rounds, duration, barrier):
+    """在子进程中运行一个虚拟用户：登录后等待其他用户，再同时开始各轮操作，返回统计结果"""
+    login_name, login, play = USER_ROLES[role]
+    stats = LoadStats()
+    sessions = []
+    stats.run(login_name, lambda: sessions.append(login(target)))
+    try:
+        barrier.wait(START_TIMEOUT)
+    except threading.BrokenBarrierError:
+        pass
+    # 只统计并发阶段的服务端耗时和写入
+    core.get_span_recorder().clear()
+    before = _metric_totals()
+    started = time.time()
+    try:
+        if sessions:
+            deadline = time.monotonic() + duration if duration else None
+            play(sessions[0], target, stats, rounds, deadline)
+    finally:
+        finished = time.time()
+        after = _metric_totals()
+        spans = [(name, seconds) for name, seconds, _ in core.get_span_recorder().spans()]
+        # 停止本进程中各数据集的后台线程
+        core.get_tenant_registry().stop_background()
+        for name in core.get_tenant_registry().loaded():
+            core.get_tenant_registry().evict(name)
+    return {
+        'stats': stats.export(),
+        'spans': spans,
+        'counts': {key: after[key] - before[key] for key in after},
+        'started': started,
+        'finished': finished
+    }
+
+
+def _same(a, b):
+    try:
+        return float(a) == float(b)
+    except (TypeError, ValueError):
+        return a == b
+
+
+def verify_writes(writes, intents):
+    """对照最终数据和审计日志，返回 (保留的写入数, 被之后的写入覆盖的数量, 丢失的写入列表)
+
+    最终值不是写入的值时，看最后改写该字段的审计记录：它的来源（操作人、操作）和取值与某个针对
+    该事务员该字段发起的写入（列出该事务员的导入针对其全部字段）一致才算正常覆盖，否则
+    （整体保存、重置、未列出该事务员的导入等用旧数据改写）算作丢失。
+    """
+    final = core.load_all_data()
+    values = final.set_index('事务员') if final is not None else pd.DataFrame()
+    audit_log = core.get_audit_log()
+    kept, overwritten, lost = 0, 0, []
+    for (staff_name, column), (value, started_at) in writes.items():
+        current = values.at[staff_name, column] if staff_name in values.index else None
+        if _same(current, value):
+            kept += 1
+            continue
+        records = [record for record in audit_log.find(staff=staff_name, start=started_at) if column in record['u']]
+        last = records[-1] if records else None
+        targeted = intents.get((staff_name, column), []) + intents.get((staff_name, None), [])
+        if last is not None and _same(last['u'][column], current) and any(
+            (other is None or _same(last['u'][column], other)) and (last['by'], last['op']) == source
+            for other, source in targeted
+        ):
+            overwritten += 1
+        else:
+            lost.append({'事务员': staff_name, '字段': column, '写入值': value, '最终值': current})
+    return kept, overwritten, lost
+
+
+def _percentiles(seconds):
+    ms = np.asarray(seconds) * 1000
+    return {f'P{p}(ms)': round(float(np.percentile(ms, p)), 1) for p in LATENCY_PERCENTILES} | {
+        '最大(ms)': round(float(ms.max()), 1)
+    }
+
+
+def build_report(results, users):
+    """汇总各虚拟用户的统计结果"""
+    stats = LoadStats()
+    spans = core.SpanRecorder(maxlen=None)
+    counts = {}
+    for result in results:
+        stats.merge(result['stats'])
+        for name, seconds in result['spans']:
+            spans.record(name, seconds)
+        for key, value in result['counts'].items():
+            counts[key] = counts.get(key, 0) + value
+    elapsed = max(result['finished'] for result in results) - min(result['started'] for result in results)
+
+    operations = []
+    for operation, seconds in stats.latencies.items():
+        operations.append({
+            '操作': operation,
+            '完成': len(seconds),
+            '失败': len(stats.failures.get(operation, [])),
+            '每秒': round(len(seconds) / elapsed, 2),
+            **_percentiles(seconds)
+        })
+    for operation, reasons in stats.failures.items():
+        if operation not in stats.latencies:
+            operations.append({'操作': operation, '完成': 0, '失败': len(reasons), '每秒': 0.0})
+
+    summary = spans.summary()
+    server = summary[summary['操作'].isin(SERVER_SPANS)].drop(columns=['最近一次'])
+    kept, overwritten, lost = verify_writes(stats.writes, stats.intents)
+    completed = sum(len(seconds) for seconds in stats.latencies.values())
+    return {
+        'users': users,
+        'elapsed_seconds': round(elapsed, 1),
+        'throughput_per_second': round(completed / elapsed, 2),
+        'operations': operations,
+        'server_spans': server.to_dict('records'),
+        'file_writes': counts.get('file_writes', 0),
+        'file_write_bytes': counts.get('file_write_bytes', 0),
+        'shard_saves': counts.get('shard_saves', 0),
+        'writes_checked': len(stats.writes),
+        'writes_kept': kept,
+        'writes_overwritten': overwritten,
+        'lost_updates': lost,
+        'failures': {operation: reasons[:5] for operation, reasons in stats.failures.items()}
+    }
+
+
+def print_report(report):
+    users = report['users']
+    print(f"\n虚拟用户：事务员{users['staff']}、地市经理{users['managers']}、管理员{users['admins']}，"
+          f"用时{report['elapsed_seconds']}秒，吞吐量{report['throughput_per_second']}次操作/秒")
+    print("\n客户端延迟（含页面渲染）：")
+    print(pd.DataFrame(report['operations']).to_string(index=False))
+    if report['server_spans']:
+        print("\n服务端耗时：")
+        print(pd.DataFrame(report['server_spans']).to_string(index=False))
+    print(f"\n文件写入：{report['file_writes']}次，共{report['file_write_bytes'] / 1024 / 1024:.1f} MB；"
+          f"地市分片保存{report['shard_saves']}次")
+    print(f"写入核对：{report['writes_checked']}项，保留{report['writes_kept']}项，"
+          f"被之后的写入覆盖{report['writes_overwritten']}项，丢失{len(report['lost_updates'])}项")
+    for item in report['lost_updates'][:10]:
+        print(f"  丢失：{item['事务员']} {item['字段']} 写入{item['写入值']}，最终为{item['最终值']}")
+    for operation, reasons in report['failures'].items():
+        print(f"失败：{operation}：{reasons[0]}")
+
+
+def prepare_directory(source, in_place):
+    """切换到运行目录，返回需要清理的临时目录（in_place时为None）"""
+    if in_place:
+        os.chdir(source)
+        return None
+    workdir = tempfile.mkdtemp(prefix='loadtest_')
+    for name in (core.DATA_DIR, core.TENANTS_DIR):
+        if os.path.isdir(os.path.join(source, name)):
+            shutil.copytree(os.path.join(source, name), os.path.join(workdir, name))
+    os.chdir(workdir)
+    return workdir
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="绩效系统并发负载测试")
+    parser.add_argument('-C', '--directory', default='.', help="应用数据所在目录，默认为当前目录")
+    parser.add_argument('--in-place', action='store_true', help="直接使用该目录的数据（默认复制到临时目录）")
+    parser.add_argument('--staff', type=int, default=8, help="事务员会话数")
+    parser.add_argument('--managers', type=int, default=2, help="地市经理会话数（每个地市最多一个）")
+    parser.add_argument('--admins', type=int, default=1, help="管理员会话数")
+    parser.add_argument('--rounds', type=int, default=5, help="每个会话的操作轮数")
+    parser.add_argument('--duration', type=float, help="最长运行秒数（到时后不再开始新的轮次）")
+    parser.add_argument('--import-rows', type=int, default=5, help="管理员每次导入的事务员数（0为不导入）")
+    parser.add_argument('--json', metavar='FILE', help="同时把报告写入JSON文件")
+    args = parser.parse_args(argv)
+
+    original_dir = os.getcwd()
+    json_path = os.path.abspath(args.json) if args.json else None
+    source = os.path.abspath(args.directory)
+    workdir = prepare_directory(source, args.in_place)
+    # 压测产生的指标只在本进程内统计，不写指标文件
+    os.environ['METRICS_FILE'] = ''
+    try:
+        # 子进程用spawn启动，不继承本进程中的锁和后台线程。AppTest运行时会替换 __main__ 模块，
+        # 之后该进程无法再接收本模块的函数，因此本进程不运行AppTest，每个子进程也只执行一个任务
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            staff_names, cities = pool.submit(load_roster).result()
+
+        workers = min(args.staff, len(staff_names)) + min(args.managers, len(cities)) + args.admins
+        with context.Manager() as manager, ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            # 事务员各自填报不同的人，导入只涉及没有事务员会话的人，便于核对
+            driven = staff_names[:args.staff]
+            import_names = staff_names[args.staff:args.staff + args.import_rows] if args.admins else []
+            managed = cities[:args.managers]
+            users = {'staff': len(driven), 'managers': len(managed), 'admins': args.admins}
+            tasks = [('staff', name) for name in driven] + [('manager', city) for city in managed]
+            tasks += [('admin', import_names)] * args.admins
+
+            barrier = manager.Barrier(len(tasks))
+            futures = [pool.submit(run_user, role, target, args.rounds, args.duration, barrier) for role, target in tasks]
+            results = [future.result() for future in futures]
+        report = build_report(results, users)
+    finally:
+        # 停止各数据集的后台备份、季度切换线程后再删除临时目录
+        core.get_tenant_registry().stop_background()
+        for name in core.get_tenant_registry().loaded():
+            core.get_tenant_registry().evict(name)
+        os.chdir(original_dir)
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(report)
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, default=core._json_default)
+    return 1 if report['lost_updates'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,38 @@
+import os
+
+import pytest
+
+import core
+
+@pytest.fixture
+def quarter():
+    return '2025年Q2季度'
+
+
+@pytest.fixture
+def data_root(tmp_path, monkeypatch):
+    """在临时目录中使用默认数据集，测试结束后停止后台线程并释放内存中的数据集"""
+    monkeypatch.chdir(tmp_path)
+    registry = core.get_tenant_registry()
+    registry.evict(core.DEFAULT_TENANT)
+    with core.use_tenant(core.DEFAULT_TENANT):
+        yield tmp_path
+    registry.stop_background()
+    registry.evict(core.DEFAULT_TENANT)
+
+
+@pytest.fixture
+def seeded(data_root, quarter):
+    """按模板初始化全部地市分片和名册，返回初始数据"""
+    df = core.calculate_performance(core.init_data_from_template(), quarter)
+    os.makedirs(core.data_path(core.SHARD_DIR), exist_ok=True)
+    for city, (city_df, _) in core.split_by_city(df, None).items():
+        core.write_shard(city, city_df, quarter=quarter)
+    core.write_meta({
+        'current_quarter': quarter,
+        'last_reset': None,
+        'roster': df[['行号', '地市', '事务员']],
+        'version': core.new_data_version()
+    })
+    return df
+
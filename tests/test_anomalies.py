@@ -0,0 +1,69 @@
+import pandas as pd
+
+import core
+
+
+def _frame(rows):
+    """rows为 [(地市, 事务员, {月份: 分销})]，未给出的月份和条盒为0（未填报）"""
+    data = []
+    for city, staff_name, values in rows:
+        row = {'地市': city, '事务员': staff_name}
+        for month in range(1, 13):
+            row[f'分销_{month}月'] = values.get(month, 0)
+            row[f'条盒_{month}月'] = 0
+        data.append(row)
+    return pd.DataFrame(data)
+
+
+def test_no_data_returns_empty_result():
+    result = core.detect_anomalies(None, '2025年Q2季度')
+    assert result.empty
+    assert list(result.columns) == ['异常数', '异常提示']
+
+
+def test_flags_spike_against_personal_history():
+    df = _frame([('保定', '张三', {1: 100, 2: 105, 3: 95, 4: 98, 5: 102, 6: 1000})])
+
+    result = core.detect_anomalies(df, '2025年Q2季度')
+
+    assert result.at[0, '异常数'] == 1
+    assert result.at[0, '异常提示'].startswith('分销_6月高于个人历史')
+
+
+def test_tested_month_is_not_part_of_its_own_baseline():
+    df = _frame([('保定', '张三', {1: 100, 2: 102, 3: 1000})])
+
+    # 去掉被检测的月份后只剩两个样本，不足以判断
+    assert core.detect_anomalies(df, '2025年Q1季度').at[0, '异常数'] == 0
+
+    history = {'2024年Q4季度': pd.DataFrame({'事务员': ['张三', '李四'], '分销均季度': [303, 9000]})}
+    result = core.detect_anomalies(df, '2025年Q1季度', history)
+    assert result.at[0, '异常数'] == 1
+    assert result.at[0, '异常提示'].startswith('分销_3月高于个人历史')
+
+
+def test_flags_outlier_within_city():
+    df = _frame([
+        ('保定', '张三', {4: 100}),
+        ('保定', '李四', {4: 110}),
+        ('保定', '王五', {4: 90}),
+        ('保定', '赵六', {4: 2000}),
+        ('石家庄', '孙七', {4: 2000}),
+    ])
+
+    result = core.detect_anomalies(df, '2025年Q2季度')
+
+    assert result['异常数'].tolist() == [0, 0, 0, 1, 0]
+    assert result.at[3, '异常提示'].startswith('分销_4月高于同地市水平')
+
+
+def test_flags_month_over_month_jump_and_repeated_values():
+    df = _frame([
+        ('保定', '张三', {4: 100, 5: 5}),
+        ('保定', '李四', {4: 80, 5: 80, 6: 90}),
+    ])
+
+    result = core.detect_anomalies(df, '2025年Q2季度')
+
+    assert result.at[0, '异常提示'] == '分销_5月环比×0.1'
+    assert result.at[1, '异常提示'] == '分销本季度多个月份数值相同'
@@ -0,0 +1,36 @@
+import os
+
+from streamlit.testing.v1 import AppTest
+
+import core
+
+APP_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+
+
+def _admin_session():
+    at = AppTest.from_file(APP_FILE, default_timeout=60)
+    at.run()
+    at.radio(key='role_radio').set_value('管理员').run()
+    at.text_input(key='admin_pwd_input').set_value('admin123').run()
+    at.button(key='admin_login_btn').click().run()
+    assert not at.exception
+    return at
+
+
+def test_manual_quarter_switch_survives_reruns(data_root):
+    at = _admin_session()
+    # 当前季度的切换已完成（没有跨季度时也会写入完成标记）
+    core.run_quarter_rollover(backup=lambda label: None)
+    assert core.rollover_done(core.get_current_quarter())
+    at.run()
+
+    selected = next(option for option in at.selectbox(key='admin_select_quarter').options
+                    if option != at.session_state.current_quarter)
+    at.selectbox(key='admin_select_quarter').set_value(selected).run()
+    at.button(key='switch_quarter_btn').click().run()
+    assert at.session_state.current_quarter == selected
+
+    at.run()
+    at.run()
+    assert not at.exception
+    assert at.session_state.current_quarter == selected
@@ -0,0 +1,64 @@
+import os
+import pickle
+import zlib
+
+import pandas as pd
+import pytest
+
+import core
+
+
+def _disk_files():
+    files = {}
+    for rel_path in core._backup_source_files():
+        with open(core.data_path(rel_path), 'rb') as f:
+            files[rel_path.replace(os.sep, '/')] = f.read()
+    return files
+
+
+def _write(staff_name, updates, quarter):
+    shard = core.read_shard('保定')
+    row = shard['performance_data'].set_index('事务员').loc[staff_name]
+    patch = {
+        'updates': updates,
+        'base_version': shard['row_versions'].get(staff_name, 0),
+        'base_values': {key: row[key] for key in updates}
+    }
+    core.cas_patch_shard('保定', {staff_name: patch}, '更新数据', staff_name, 'cs1', quarter)
+
+
+def test_backup_round_trip(seeded, quarter):
+    original = _disk_files()
+    manifest = core.create_backup('测试')
+    _write(seeded.loc[seeded['地市'] == '保定', '事务员'].iloc[0], {'分销_4月': 500}, quarter)
+
+    files = core.read_backup_files(manifest['id'])
+
+    assert files == original
+    restored = pd.concat(
+        pickle.loads(data)['performance_data'] for path, data in files.items() if path.startswith('shards/')
+    ).sort_index()
+    pd.testing.assert_frame_equal(restored, seeded)
+    assert pickle.loads(files['meta.pkl'])['current_quarter'] == quarter
+
+
+def test_backup_stores_unchanged_chunks_once(seeded, quarter):
+    first = core.create_backup('测试')
+    second = core.create_backup('测试')
+    assert first['stored'] > 0
+    assert second['stored'] == 0
+
+    _write(seeded.loc[seeded['地市'] == '保定', '事务员'].iloc[0], {'分销_4月': 500}, quarter)
+    third = core.create_backup('测试')
+    assert 0 < third['stored'] < first['stored']
+    assert [manifest['id'] for manifest in core.list_backups()] == [third['id'], second['id'], first['id']]
+
+
+def test_backup_detects_corrupted_chunk(seeded):
+    manifest = core.create_backup('测试')
+    digest = manifest['files'][0]['chunks'][0]
+    with open(core._chunk_path(digest), 'wb') as f:
+        f.write(zlib.compress(b'corrupted'))
+
+    with pytest.raises(ValueError, match='备份块校验失败'):
+        core.read_backup_files(manifest['id'])
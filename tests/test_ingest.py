@@ -0,0 +1,98 @@
+import pytest
+
+import core
+
+STAFF_CITIES = {'张三': '保定', '李四': '石家庄'}
+
+
+# ========== 校验 ==========
+def test_validate_merges_records_of_same_staff():
+    records = [
+        {'事务员': '张三', '月份': 4, '分销': 100, '条盒': 20},
+        {'事务员': '张三', '地市': '保定', '月份': 5, '分销': 120.0, '核心户数': 8},
+        {'事务员': '张三', '月份': 4, '分销': 110},
+    ]
+
+    updates, errors = core.validate_ingest_records(records, STAFF_CITIES)
+
+    assert errors == []
+    assert updates == {'张三': {'分销_4月': 110, '条盒_4月': 20, '分销_5月': 120, '核心户数': 8}}
+
+
+@pytest.mark.parametrize('record, message', [
+    ({'事务员': '王五', '月份': 4, '分销': 1}, '未知的事务员'),
+    ({'事务员': '张三', '地市': '石家庄', '月份': 4, '分销': 1}, '地市与名册不符'),
+    ({'事务员': '张三', '月份': 13, '分销': 1}, '月份必须是1-12的整数'),
+    ({'事务员': '张三', '月份': True, '分销': 1}, '月份必须是1-12的整数'),
+    ({'事务员': '张三', '月份': 4, '分销': -1}, '指标必须是非负整数'),
+    ({'事务员': '张三', '月份': 4, '分销': 1.5}, '指标必须是非负整数'),
+    ({'事务员': '张三', '核心户数': True}, '指标必须是非负整数'),
+    ({'事务员': '张三', '月份': 4}, '记录中没有可写入的指标'),
+    ('张三', '记录必须是对象'),
+])
+def test_validate_rejects_invalid_record(record, message):
+    updates, errors = core.validate_ingest_records([{'事务员': '李四', '核心户数': 3}, record], STAFF_CITIES)
+
+    assert updates == {'李四': {'核心户数': 3}}
+    assert len(errors) == 1
+    assert errors[0]['index'] == 1 and message in errors[0]['error']
+
+
+@pytest.mark.parametrize('records', [[], None, {'事务员': '张三'}])
+def test_validate_rejects_empty_batch(records):
+    assert core.validate_ingest_records(records, STAFF_CITIES) == ({}, [{'index': None, 'error': 'records必须是非空数组'}])
+
+
+# ========== 幂等写入 ==========
+def _staff(seeded, city):
+    return seeded.loc[seeded['地市'] == city, '事务员'].iloc[0]
+
+
+def _value(city, staff_name, column):
+    df = core.read_shard(city)['performance_data']
+    return df.loc[df['事务员'] == staff_name, column].iloc[0]
+
+
+def test_ingest_writes_batch_once_per_key(seeded):
+    staff_name = _staff(seeded, '保定')
+    records = [{'事务员': staff_name, '月份': 4, '分销': 100}]
+
+    status, result = core.ingest_records(records, 'batch-1')
+    assert (status, result['staff'], result['replayed']) == (200, 1, False)
+    version = core.read_shard('保定')['version']
+
+    status, replay = core.ingest_records(records, 'batch-1')
+    assert (status, replay['replayed']) == (200, True)
+    assert replay['change_set'] == result['change_set']
+    assert core.read_shard('保定')['version'] == version
+    assert _value('保定', staff_name, '分销_4月') == 100
+
+
+def test_ingest_rejects_key_reused_for_different_data(seeded):
+    staff_name = _staff(seeded, '保定')
+    core.ingest_records([{'事务员': staff_name, '月份': 4, '分销': 100}], 'batch-1')
+
+    status, result = core.ingest_records([{'事务员': staff_name, '月份': 4, '分销': 200}], 'batch-1')
+
+    assert status == 409 and 'error' in result
+    assert _value('保定', staff_name, '分销_4月') == 100
+
+
+def test_ingest_invalid_batch_writes_nothing_and_frees_key(seeded):
+    staff_name = _staff(seeded, '保定')
+    other = _staff(seeded, '石家庄')
+    records = [{'事务员': other, '月份': 4, '分销': 100}, {'事务员': staff_name, '月份': 4, '分销': -1}]
+
+    status, result = core.ingest_records(records, 'batch-1')
+    assert (status, result['error_count']) == (400, 1)
+    assert _value('石家庄', other, '分销_4月') == 0
+
+    records[1]['分销'] = 50
+    status, result = core.ingest_records(records, 'batch-1')
+    assert (status, result['replayed'], result['cities']) == (200, False, 2)
+    assert _value('保定', staff_name, '分销_4月') == 50
+
+
+def test_ingest_without_data_returns_503(data_root):
+    status, _ = core.ingest_records([{'事务员': '张三', '月份': 4, '分销': 1}], 'batch-1')
+    assert status == 503
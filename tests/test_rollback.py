@@ -0,0 +1,51 @@
+import core
+
+CITY = '保定'
+
+
+def _write(staff_name, updates, operator, change_set, quarter):
+    """以磁盘上的最新数据为基础写入一次修改"""
+    shard = core.read_shard(CITY)
+    row = shard['performance_data'].set_index('事务员').loc[staff_name]
+    patch = {
+        'updates': updates,
+        'base_version': shard['row_versions'].get(staff_name, 0),
+        'base_values': {key: row[key] for key in updates}
+    }
+    core.cas_patch_shard(CITY, {staff_name: patch}, '更新数据', operator, change_set, quarter)
+
+
+def test_rollback_restores_value_before_earliest_selected_change(seeded, quarter):
+    staff_name = seeded.loc[seeded['地市'] == CITY, '事务员'].iloc[0]
+    _write(staff_name, {'分销_4月': 500}, staff_name, 'cs1', quarter)
+    _write(staff_name, {'分销_4月': 600}, staff_name, 'cs2', quarter)
+
+    updates, skipped = core.plan_rollback(core.get_audit_log().find(staff=staff_name))
+
+    assert updates == {staff_name: {'分销_4月': 0}}
+    assert skipped == []
+
+
+def test_rollback_skips_fields_changed_later_by_others(seeded, quarter):
+    staff_name = seeded.loc[seeded['地市'] == CITY, '事务员'].iloc[0]
+    _write(staff_name, {'分销_4月': 500, '条盒_4月': 100}, staff_name, 'cs1', quarter)
+    _write(staff_name, {'条盒_4月': 200}, '保定地市经理', 'cs2', quarter)
+    selected = [record for record in core.get_audit_log().find(staff=staff_name) if record['id'] == 'cs1']
+
+    updates, skipped = core.plan_rollback(selected)
+
+    assert updates == {staff_name: {'分销_4月': 0}}
+    assert [(item['事务员'], item['字段']) for item in skipped] == [(staff_name, '条盒_4月')]
+    assert '保定地市经理' in skipped[0]['原因']
+
+
+def test_rollback_ignores_fields_that_did_not_change(seeded, quarter):
+    staff_name = seeded.loc[seeded['地市'] == CITY, '事务员'].iloc[0]
+    _write(staff_name, {'分销_4月': 0, '条盒_4月': 100}, staff_name, 'cs1', quarter)
+    _write(staff_name, {'分销_4月': 300}, '保定地市经理', 'cs2', quarter)
+    selected = [record for record in core.get_audit_log().find(staff=staff_name) if record['id'] == 'cs1']
+
+    updates, skipped = core.plan_rollback(selected)
+
+    assert updates == {staff_name: {'条盒_4月': 0}}
+    assert skipped == []
@@ -0,0 +1,56 @@
+import pandas as pd
+
+import core
+
+NEXT_QUARTER = '2025年Q3季度'
+
+
+def _write(staff_name, updates, quarter):
+    shard = core.read_shard('保定')
+    row = shard['performance_data'].set_index('事务员').loc[staff_name]
+    patch = {
+        'updates': updates,
+        'base_version': shard['row_versions'].get(staff_name, 0),
+        'base_values': {key: row[key] for key in updates}
+    }
+    core.cas_patch_shard('保定', {staff_name: patch}, '更新数据', staff_name, 'cs1', quarter)
+
+
+def test_rollover_runs_once_per_quarter(seeded, quarter, monkeypatch):
+    staff_name = seeded.loc[seeded['地市'] == '保定', '事务员'].iloc[0]
+    _write(staff_name, {'分销_4月': 500}, quarter)
+    before = core.read_shard('保定')['performance_data'].set_index('事务员')
+    monkeypatch.setattr(core, 'get_current_quarter', lambda: NEXT_QUARTER)
+    backups = []
+
+    assert core.run_quarter_rollover(backup=backups.append) is True
+
+    assert core.rollover_done(NEXT_QUARTER)
+    assert backups == ['季度重置前备份']
+    assert core.load_meta()['current_quarter'] == NEXT_QUARTER
+    shard = core.read_shard('保定')
+    assert shard['quarter'] == NEXT_QUARTER
+    df = shard['performance_data'].set_index('事务员')
+    assert (df.at[staff_name, '分销_4月'], df.at[staff_name, '分销均季度']) == (0, 0)
+    history = pd.DataFrame(shard['quarter_history'][quarter]).set_index('事务员')
+    assert history.at[staff_name, '分销均季度'] == before.at[staff_name, '分销均季度'] > 0
+
+    # 新季度填报的数据不会被重复执行的切换清零
+    _write(staff_name, {'分销_7月': 300}, NEXT_QUARTER)
+    assert core.run_quarter_rollover(backup=backups.append) is False
+    assert backups == ['季度重置前备份']
+    df = core.read_shard('保定')['performance_data'].set_index('事务员')
+    assert df.at[staff_name, '分销_7月'] == 300
+
+
+def test_rollover_skips_shards_already_in_new_quarter(seeded, quarter):
+    assert core.rollover_shard('保定', quarter, NEXT_QUARTER, 6, '系统', 'cs1') is not None
+    version = core.read_shard('保定')['version']
+
+    assert core.rollover_shard('保定', quarter, NEXT_QUARTER, 6, '系统', 'cs2') is None
+    assert core.read_shard('保定')['version'] == version
+
+
+def test_rollover_without_data_does_nothing(data_root):
+    assert core.run_quarter_rollover(backup=lambda label: None) is False
+    assert not core.rollover_done(core.get_current_quarter())
@@ -0,0 +1,246 @@
+import pandas as pd
+
+import core
+
+CITY = '保定'
+
+
+def _patch(shard, staff_name, updates):
+    """按分片中的当前值和行版本构造一次修改"""
+    row = shard['performance_data'].set_index('事务员').loc[staff_name]
+    return {
+        'updates': updates,
+        'base_version': shard['row_versions'].get(staff_name, 0),
+        'base_values': {key: row[key] for key in updates}
+    }
+
+
+def _row(city, staff_name):
+    df = core.read_shard(city)['performance_data']
+    return df[df['事务员'] == staff_name].iloc[0]
+
+
+# ========== 字段级比较写入 ==========
+def test_patch_writes_and_bumps_row_version(seeded, quarter):
+    staff_name = seeded.loc[seeded['地市'] == CITY, '事务员'].iloc[0]
+    shard = core.read_shard(CITY)
+
+    shard, written, conflicts = core.cas_patch_shard(
+        CITY, {staff_name: _patch(shard, staff_name, {'分销_4月': 500})}, '更新数据', '其他人', 'cs1', quarter
+    )
+
+    assert (written, conflicts) == (1, [])
+    assert shard['row_versions'][staff_name] == 1
+    assert _row(CITY, staff_name)['分销_4月'] == 500
+    _, records = core.get_audit_log().query(staff=staff_name)
+    assert [(record['u'], record['o']) for record in records] == [({'分销_4月': 500}, {'分销_4月': 0})]
+
+
+def test_patch_merges_changes_to_different_fields(seeded, quarter):
+    staff_name = seeded.loc[seeded['地市'] == CITY, '事务员'].iloc[0]
+    base = core.read_shard(CITY)
+    mine = _patch(base, staff_name, {'分销_4月': 500})
+    theirs = _patch(base, staff_name, {'条盒_4月': 300})
+
+    core.cas_patch_shard(CITY, {staff_name: theirs}, '更新数据', '其他人', 'cs1', quarter)
+    _, written, conflicts = core.cas_patch_shard(CITY, {staff_name: mine}, '更新数据', staff_name, 'cs2', quarter)
+
+    assert (written, conflicts) == (1, [])
+    row = _row(CITY, staff_name)
+    assert (row['分销_4月'], row['条盒_4月']) == (500, 300)
+
+
+def test_patch_reports_conflict_on_same_field(seeded, quarter):
+    staff_name = seeded.loc[seeded['地市'] == CITY, '事务员'].iloc[0]
+    base = core.read_shard(CITY)
+    mine = _patch(base, staff_name, {'分销_4月': 500})
+    theirs = _patch(base, staff_name, {'分销_4月': 700})
+
+    core.cas_patch_shard(CITY, {staff_name: theirs}, '更新数据', '其他人', 'cs1', quarter)
+    shard, written, conflicts = core.cas_patch_shard(CITY, {staff_name: mine}, '更新数据', staff_name, 'cs2', quarter)
+
+    assert written == 0
+    assert [(item['字段'], item['我的修改'], item['当前已保存值']) for item in conflicts] == [('分销_4月', 500, 700)]
+    assert shard['row_versions'][staff_name] == 1
+    assert _row(CITY, staff_name)['分销_4月'] == 700
+
+
+def test_patch_same_value_is_not_a_conflict(seeded, quarter):
+    staff_name = seeded.loc[seeded['地市'] == CITY, '事务员'].iloc[0]
+    base = core.read_shard(CITY)
+
+    core.cas_patch_shard(CITY, {staff_name: _patch(base, staff_name, {'分销_4月': 500})}, '更新数据', '其他人', 'cs1', quarter)
+    _, written, conflicts = core.cas_patch_shard(
+        CITY, {staff_name: _patch(base, staff_name, {'分销_4月': 500})}, '更新数据', staff_name, 'cs2', quarter
+    )
+
+    assert (written, conflicts) == (1, [])
+
+
+def test_patch_without_base_version_always_writes(seeded, quarter):
+    staff_name = seeded.loc[seeded['地市'] == CITY, '事务员'].iloc[0]
+    base = core.read_shard(CITY)
+    core.cas_patch_shard(CITY, {staff_name: _patch(base, staff_name, {'分销_4月': 700})}, '更新数据', '其他人', 'cs1', quarter)
+
+    _, written, conflicts = core.cas_patch_shard(
+        CITY, {staff_name: {'updates': {'分销_4月': 500}, 'base_version': None, 'base_values': {}}},
+        core.INGEST_OPERATION, '接口', 'cs2', quarter
+    )
+
+    assert (written, conflicts) == (1, [])
+    assert _row(CITY, staff_name)['分销_4月'] == 500
+
+
+# ========== 整体写入 ==========
+def test_write_merges_fields_of_rows_changed_since_load(seeded, quarter):
+    names = seeded.loc[seeded['地市'] == CITY, '事务员'].tolist()
+    loaded = core.read_shard(CITY)
+    base_versions = dict(loaded['row_versions'])
+    core.cas_patch_shard(
+        CITY, {names[0]: _patch(loaded, names[0], {'分销_4月': 700})}, '更新数据', '其他人', 'cs1', quarter
+    )
+
+    city_df = loaded['performance_data'].copy()
+    city_df['核心户数'] = 9
+    shard, conflicts = core.cas_write_shard(
+        CITY, city_df, base_versions, quarter=quarter, base_df=loaded['performance_data']
+    )
+
+    assert conflicts == []
+    df = shard['performance_data'].set_index('事务员')
+    assert (df.at[names[0], '分销_4月'], df.at[names[0], '核心户数']) == (700, 9)
+    assert (df.loc[names[1:], '核心户数'] == 9).all()
+    # 合并后的行按合并结果重新计算
+    expected = core.calculate_performance(shard['performance_data'], quarter).set_index('事务员')
+    assert df.at[names[0], '总分'] == expected.at[names[0], '总分']
+    assert shard['row_versions'][names[0]] == 2
+
+
+def test_write_reports_conflict_on_same_field(seeded, quarter):
+    names = seeded.loc[seeded['地市'] == CITY, '事务员'].tolist()
+    loaded = core.read_shard(CITY)
+    base_versions = dict(loaded['row_versions'])
+    core.cas_patch_shard(
+        CITY, {names[0]: _patch(loaded, names[0], {'分销_4月': 700})}, '更新数据', '其他人', 'cs1', quarter
+    )
+
+    city_df = loaded['performance_data'].copy()
+    city_df['分销_4月'] = 500
+    city_df['核心户数'] = 9
+    shard, conflicts = core.cas_write_shard(
+        CITY, city_df, base_versions, quarter=quarter, base_df=loaded['performance_data']
+    )
+
+    assert [(row['事务员'], row['字段'], row['我的修改'], row['当前已保存值']) for row in conflicts] == [
+        (names[0], '分销_4月', 500, 700)
+    ]
+    df = shard['performance_data'].set_index('事务员')
+    assert (df.at[names[0], '分销_4月'], df.at[names[0], '核心户数']) == (700, 9)
+    assert (df.loc[names[1:], '分销_4月'] == 500).all()
+
+
+def test_recompute_keeps_rows_changed_during_recompute(seeded, quarter, monkeypatch):
+    staff_name = seeded.loc[seeded['地市'] == CITY, '事务员'].iloc[0]
+    loaded = core.read_shard(CITY)
+    read_shard = core.read_shard
+
+    def read_then_edit(city):
+        # 读取后、写入前其他人修改了数据
+        shard = read_shard(city)
+        core.cas_patch_shard(
+            CITY, {staff_name: _patch(loaded, staff_name, {'分销_4月': 700})}, '更新数据', '其他人', 'cs1', quarter
+        )
+        return shard
+
+    monkeypatch.setattr(core, 'read_shard', read_then_edit)
+    count, conflicts = core.recompute_city(CITY, quarter)
+    monkeypatch.setattr(core, 'read_shard', read_shard)
+
+    assert (count, conflicts) == (len(loaded['performance_data']), [])
+    assert _row(CITY, staff_name)['分销_4月'] == 700
+
+
+def test_write_force_overwrites_changed_rows(seeded, quarter):
+    names = seeded.loc[seeded['地市'] == CITY, '事务员'].tolist()
+    loaded = core.read_shard(CITY)
+    base_versions = dict(loaded['row_versions'])
+    core.cas_patch_shard(
+        CITY, {names[0]: _patch(loaded, names[0], {'分销_4月': 700})}, '更新数据', '其他人', 'cs1', quarter
+    )
+
+    shard, conflicts = core.cas_write_shard(CITY, loaded['performance_data'], base_versions, force=True)
+
+    assert conflicts == []
+    assert _row(CITY, names[0])['分销_4月'] == 0
+    assert shard['row_versions'][names[0]] == 2
+
+
+# ========== 导入 ==========
+def test_import_writes_only_imported_staff_and_cities(seeded, quarter):
+    names = seeded.loc[seeded['地市'] == CITY, '事务员'].tolist()
+    other_city = '石家庄'
+    other_version = core.read_shard(other_city)['version']
+    loaded = core.read_shard(CITY)
+    # 导入期间其他人修改了未导入的事务员
+    core.cas_patch_shard(
+        CITY, {names[1]: _patch(loaded, names[1], {'分销_4月': 700})}, '更新数据', names[1], 'cs1', quarter
+    )
+
+    imported = seeded[seeded['事务员'] == names[0]].copy()
+    imported['分销_4月'] = 500
+    new_staff = imported.assign(事务员='新事务员', 行号=999, 分销_4月=300)
+    meta, cities = core.import_staff_rows(pd.concat([imported, new_staff]), quarter, '管理员')
+
+    assert cities == [CITY]
+    assert core.read_shard(other_city)['version'] == other_version
+    df = core.read_shard(CITY)['performance_data'].set_index('事务员')
+    assert df.at[names[0], '分销_4月'] == 500
+    assert df.at[names[1], '分销_4月'] == 700
+    assert df.at['新事务员', '分销_4月'] == 300
+    assert df['分销_4月'].dtype == seeded['分销_4月'].dtype
+    assert meta['roster'].set_index('事务员').at['新事务员', '地市'] == CITY
+    assert meta['roster'].index.is_unique
+
+
+def test_import_moves_staff_between_cities(seeded, quarter):
+    staff_name = seeded.loc[seeded['地市'] == CITY, '事务员'].iloc[0]
+    moved = seeded[seeded['事务员'] == staff_name].assign(地市='石家庄')
+
+    meta, cities = core.import_staff_rows(moved, quarter, '管理员')
+
+    assert cities == sorted([CITY, '石家庄'])
+    assert staff_name not in core.read_shard(CITY)['performance_data']['事务员'].tolist()
+    assert staff_name in core.read_shard('石家庄')['performance_data']['事务员'].tolist()
+    assert meta['roster'].set_index('事务员').at[staff_name, '地市'] == '石家庄'
+
+
+# ========== 快照 ==========
+def test_writes_within_interval_replay_from_one_snapshot(seeded, quarter):
+    names = seeded.loc[seeded['地市'] == CITY, '事务员'].tolist()
+    for value in (500, 600):
+        loaded = core.read_shard(CITY)
+        city_df = loaded['performance_data'].copy()
+        city_df['分销_4月'] = value
+        core.cas_write_shard(
+            CITY, city_df, dict(loaded['row_versions']), quarter=quarter,
+            operation='保存数据', operator='管理员', change_set=f'cs{value}', base_df=loaded['performance_data']
+        )
+    imported = seeded[seeded['事务员'] == names[0]].assign(分销_4月=700)
+    core.import_staff_rows(imported, quarter, '管理员')
+
+    # 初始化时的快照之后只有审计记录，时点还原回放出最新的数据
+    assert len(core.list_snapshot_times(CITY)) == 1
+    df = core.reconstruct_city(CITY, core.audit_timestamp()).set_index('事务员')
+    assert df.at[names[0], '分销_4月'] == 700
+    assert (df.loc[names[1:], '分销_4月'] == 600).all()
+
+
+def test_import_of_new_staff_saves_snapshot(seeded, quarter):
+    staff_name = seeded.loc[seeded['地市'] == CITY, '事务员'].iloc[0]
+    new_staff = seeded[seeded['事务员'] == staff_name].assign(事务员='新事务员', 行号=999)
+
+    core.import_staff_rows(new_staff, quarter, '管理员')
+
+    assert len(core.list_snapshot_times(CITY)) == 2
+    df = core.reconstruct_city(CITY, core.audit_timestamp())
+    assert '新事务员' in df['事务员'].tolist()
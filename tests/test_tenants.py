@@ -0,0 +1,45 @@
+import pytest
+
+import core
+
+
+class _Job:
+    def __init__(self):
+        self.stopped = False
+
+    def stop(self):
+        self.stopped = True
+
+
+def test_evicted_tenant_keeps_background_jobs(data_root):
+    core.create_tenant('north')
+    core.create_tenant('south')
+    registry = core.TenantRegistry(capacity=1)
+    north = registry.get('north')
+    job = registry.background('north', 'job', _Job)
+
+    # 加载其他数据集时淘汰north，只释放缓存
+    registry.get('south')
+
+    assert registry.loaded() == ['south']
+    assert not job.stopped
+    assert registry.background('north', 'job', _Job) is job
+    with pytest.raises(RuntimeError):
+        north.resource('job', _Job)
+    assert registry.get('north') is not north
+
+    registry.stop_background('north')
+    assert job.stopped
+    assert registry.background('north', 'job', _Job) is not job
+
+
+def test_closed_tenant_stops_its_own_resources(data_root):
+    registry = core.TenantRegistry()
+    tenant = registry.get(core.DEFAULT_TENANT)
+    resource = tenant.resource('job', _Job)
+
+    registry.evict(core.DEFAULT_TENANT)
+
+    assert resource.stopped
+    with pytest.raises(RuntimeError):
+        tenant.resource('job', _Job)